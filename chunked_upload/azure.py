@@ -0,0 +1,202 @@
+"""
+Azure Blob Storage helpers, used by `sinks.azure`.
+
+Clients are shared by the whole process, so the connections (and TLS
+sessions) they keep alive are reused by every chunk. A new client is built
+when the settings change, and in forked children. Clients of
+`azure.storage.blob.aio` (used by async views) are shared by the coroutines
+of each event loop, over a single aiohttp session, closed when the loop
+shuts down.
+"""
+import asyncio
+import os
+import threading
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .settings import AZURE_ASYNC_CLIENT_CLASS, AZURE_CLIENT_CLASS, AZURE_CONNECTION_POOL_SIZE
+
+
+class ClientCache(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.key = None
+        self.pid = None
+        self.service_client = None
+        self.container_clients = {}
+        self.session = None
+
+    async def aclose(self):
+        """
+        Close the async clients, and their aiohttp session.
+        """
+        if self.service_client is not None:
+            await self.service_client.close()
+        if self.session is not None:
+            await self.session.close()
+        self.clear()
+
+
+_clients = ClientCache()
+# Async clients, by event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+if hasattr(os, 'register_at_fork'):
+    # Connections can't be shared with the parent process
+    os.register_at_fork(after_in_child=_clients.clear)
+    os.register_at_fork(after_in_child=_async_clients.clear)
+
+
+def _get_client_class(client_class=AZURE_CLIENT_CLASS):
+    if isinstance(client_class, str):
+        return import_string(client_class)
+    return client_class
+
+
+def _create_transport():
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=AZURE_CONNECTION_POOL_SIZE,
+        pool_maxsize=AZURE_CONNECTION_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return RequestsTransport(session=session, session_owner=False)
+
+
+def create_blob_service_client():
+    from azure.core.credentials import AzureNamedKeyCredential
+
+    account_name = settings.AZURE_ACCOUNT_NAME
+    account_key = settings.AZURE_ACCOUNT_KEY
+    credential = AzureNamedKeyCredential(account_name, account_key)
+    account_url = f"https://{account_name}.blob.core.windows.net"
+    return _get_client_class()(account_url=account_url, credential=credential,
+                               transport=_create_transport())
+
+
+def _check_cache():
+    """
+    Drop the cached clients if the settings changed or the process forked.
+    Must be called with the lock held.
+    """
+    key = (AZURE_CLIENT_CLASS, settings.AZURE_ACCOUNT_NAME,
+           settings.AZURE_ACCOUNT_KEY)
+    if _clients.key != key or _clients.pid != os.getpid():
+        _clients.clear()
+        _clients.key = key
+        _clients.pid = os.getpid()
+    if _clients.service_client is None:
+        _clients.service_client = create_blob_service_client()
+
+
+def get_blob_service_client():
+    with _clients.lock:
+        _check_cache()
+        return _clients.service_client
+
+
+def get_container_client(container_name=None):
+    if container_name is None:
+        container_name = settings.AZURE_MEDIA_CONTAINER
+    with _clients.lock:
+        _check_cache()
+        container_client = _clients.container_clients.get(container_name)
+        if container_client is None:
+            container_client = _clients.service_client.get_container_client(
+                container_name)
+            _clients.container_clients[container_name] = container_client
+        return container_client
+
+
+def get_blob_client(blob_name):
+    return get_container_client().get_blob_client(blob_name)
+
+
+def create_async_session():
+    """
+    Must be called from the event loop the session will be used on, which
+    its connections belong to.
+    """
+    import aiohttp
+
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+        limit=AZURE_CONNECTION_POOL_SIZE))
+
+
+def create_async_blob_service_client(session):
+    from azure.core.credentials import AzureNamedKeyCredential
+    from azure.core.pipeline.transport import AioHttpTransport
+
+    account_name = settings.AZURE_ACCOUNT_NAME
+    account_key = settings.AZURE_ACCOUNT_KEY
+    credential = AzureNamedKeyCredential(account_name, account_key)
+    account_url = f"https://{account_name}.blob.core.windows.net"
+    transport = AioHttpTransport(session=session, session_owner=False)
+    return _get_client_class(AZURE_ASYNC_CLIENT_CLASS)(
+        account_url=account_url, credential=credential, transport=transport)
+
+
+async def _close_at_shutdown(clients):
+    """
+    Async generator suspended until its event loop shuts down, which closes
+    `clients`. asyncio has no other hook for it: the loop closes the async
+    generators it has seen started in `shutdown_asyncgens()` (called by
+    `asyncio.run`, and so by asgiref at the end of each request when an
+    async view runs under WSGI), or once they're garbage collected (e.g.
+    replaced after a change of the settings).
+    """
+    try:
+        yield
+    finally:
+        await clients.aclose()
+
+
+def _watch_loop(clients):
+    """
+    Close `clients` when the running event loop shuts down.
+    """
+    watcher = _close_at_shutdown(clients)
+    try:
+        # Started (which registers it with the loop) and suspended right
+        # away, without waiting for the loop
+        watcher.asend(None).send(None)
+    except StopIteration:
+        pass
+    clients.watcher = watcher
+
+
+def get_async_container_client(container_name=None):
+    if container_name is None:
+        container_name = settings.AZURE_MEDIA_CONTAINER
+    loop = asyncio.get_running_loop()
+    key = (AZURE_ASYNC_CLIENT_CLASS, settings.AZURE_ACCOUNT_NAME,
+           settings.AZURE_ACCOUNT_KEY)
+    clients = _async_clients.get(loop)
+    if clients is None or clients.key != key:
+        # No lock needed: only the coroutines of this loop use them
+        clients = ClientCache()
+        clients.key = key
+        clients.session = create_async_session()
+        clients.service_client = create_async_blob_service_client(
+            clients.session)
+        _watch_loop(clients)
+        _async_clients[loop] = clients
+    container_client = clients.container_clients.get(container_name)
+    if container_client is None:
+        container_client = clients.service_client.get_container_client(
+            container_name)
+        clients.container_clients[container_name] = container_client
+    return container_client
+
+
+def get_async_blob_client(blob_name):
+    return get_async_container_client().get_blob_client(blob_name)
@@ -0,0 +1,319 @@
+"""
+In-memory stand-in for `azure.storage.blob.BlobServiceClient`, for tests and
+local development. Enable it with:
+
+    CHUNKED_UPLOAD_AZURE_CLIENT_CLASS = 'chunked_upload.azure_fake.FakeBlobServiceClient'
+    CHUNKED_UPLOAD_AZURE_ASYNC_CLIENT_CLASS = 'chunked_upload.azure_fake.FakeAsyncBlobServiceClient'
+
+Only the calls made by django-chunked-upload are implemented.
+"""
+import asyncio
+import hashlib
+import threading
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock, BlobProperties, ContentSettings
+
+
+# Max size of an appended block (since API version 2022-11-02)
+MAX_APPEND_BLOCK_SIZE = 100 * 1024 * 1024
+
+
+def _check_content_md5(data, kwargs):
+    """
+    Verify a block against the MD5 sent as is along with it, if any.
+    """
+    content_md5 = kwargs.get('transactional_content_md5')
+    if content_md5 is not None and \
+            bytes(content_md5) != hashlib.md5(data).digest():
+        error = HttpResponseError('The MD5 value specified in the request '
+                                  'did not match with the MD5 value '
+                                  'calculated by the server.')
+        error.error_code = 'Md5Mismatch'
+        raise error
+
+
+class FakeBlob(object):
+
+    def __init__(self, blob_type, content_settings=None, metadata=None):
+        self.blob_type = blob_type
+        self.data = bytearray()
+        self.content_settings = content_settings or ContentSettings()
+        self.metadata = dict(metadata or {})
+        self.blocks = []  # committed (block id, size), for block blobs
+
+
+class FakeBlobServiceClient(object):
+    """
+    Blobs are kept at class level, so every client sees the same "account"
+    (as different clients of the real service would).
+    """
+
+    containers = {}
+    # Staged (uncommitted) blocks by (container name, blob name)
+    staged_blocks = {}
+    lock = threading.RLock()
+
+    def __init__(self, account_url=None, credential=None, **kwargs):
+        self.account_url = account_url
+        self.credential = credential
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.containers.clear()
+            cls.staged_blocks.clear()
+
+    def get_container_client(self, container):
+        return FakeContainerClient(self, container)
+
+
+class FakeContainerClient(object):
+
+    def __init__(self, service, container_name):
+        self.service = service
+        self.container_name = container_name
+
+    @property
+    def blobs(self):
+        return self.service.containers.setdefault(self.container_name, {})
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self, blob)
+
+    def delete_blobs(self, *blobs, raise_on_any_failure=True, **kwargs):
+        if len(blobs) > 256:
+            raise HttpResponseError('The batch operation exceeds the '
+                                    'maximum number of sub-requests.')
+        responses = []
+        for blob in blobs:
+            try:
+                FakeBlobClient(self, blob).delete_blob()
+                responses.append(FakeBatchResponse(202, 'Accepted'))
+            except ResourceNotFoundError:
+                if raise_on_any_failure:
+                    raise
+                responses.append(FakeBatchResponse(404, 'Not Found'))
+        return iter(responses)
+
+
+class FakeBatchResponse(object):
+
+    def __init__(self, status_code, reason):
+        self.status_code = status_code
+        self.reason = reason
+
+
+class FakeBlobClient(object):
+
+    def __init__(self, container, blob_name):
+        self.container = container
+        self.blob_name = blob_name
+        self.url = '%s/%s/%s' % (container.service.account_url,
+                                 container.container_name, blob_name)
+
+    @property
+    def service_lock(self):
+        return self.container.service.lock
+
+    def _get_blob(self):
+        try:
+            return self.container.blobs[self.blob_name]
+        except KeyError:
+            raise ResourceNotFoundError('The specified blob does not exist.')
+
+    @property
+    def staged_blocks(self):
+        return self.container.service.staged_blocks.setdefault(
+            (self.container.container_name, self.blob_name), {})
+
+    def exists(self, **kwargs):
+        return self.blob_name in self.container.blobs
+
+    def delete_blob(self, delete_snapshots=None, **kwargs):
+        with self.service_lock:
+            self._get_blob()
+            del self.container.blobs[self.blob_name]
+            self.staged_blocks.clear()
+
+    def create_append_blob(self, content_settings=None, metadata=None,
+                           **kwargs):
+        with self.service_lock:
+            self.container.blobs[self.blob_name] = FakeBlob(
+                'AppendBlob', content_settings, metadata)
+            self.staged_blocks.clear()
+        return {}
+
+    def append_block(self, data, length=None, validate_content=False,
+                     appendpos_condition=None, **kwargs):
+        data = bytes(data.read(length) if hasattr(data, 'read') else data)
+        _check_content_md5(data, kwargs)
+        if len(data) > MAX_APPEND_BLOCK_SIZE:
+            raise HttpResponseError('The request body is too large.')
+        with self.service_lock:
+            blob = self._get_blob()
+            if blob.blob_type != 'AppendBlob':
+                raise HttpResponseError('The blob type is invalid for this '
+                                        'operation.')
+            append_offset = len(blob.data)
+            if appendpos_condition is not None and \
+                    appendpos_condition != append_offset:
+                error = HttpResponseError('The append position condition '
+                                          'specified was not met.')
+                error.error_code = 'AppendPositionConditionNotMet'
+                raise error
+            blob.data += data
+        result = {'blob_append_offset': str(append_offset)}
+        if validate_content:
+            # The real service verifies the MD5 sent along with the block
+            result['content_md5'] = bytearray(hashlib.md5(data).digest())
+        return result
+
+    def stage_block(self, block_id, data, length=None, validate_content=False,
+                    **kwargs):
+        data = bytes(data.read(length) if hasattr(data, 'read') else data)
+        _check_content_md5(data, kwargs)
+        with self.service_lock:
+            self.staged_blocks[block_id] = data
+        result = {}
+        if validate_content:
+            result['content_md5'] = bytearray(hashlib.md5(data).digest())
+        return result
+
+    def commit_block_list(self, block_list, content_settings=None,
+                          metadata=None, **kwargs):
+        with self.service_lock:
+            staged = self.staged_blocks
+            blob = FakeBlob('BlockBlob', content_settings, metadata)
+            for block in block_list:
+                block_id = getattr(block, 'id', block)
+                try:
+                    blob.data += staged[block_id]
+                except KeyError:
+                    raise HttpResponseError('The specified block list is '
+                                            'invalid.')
+                blob.blocks.append((block_id, len(staged[block_id])))
+            self.container.blobs[self.blob_name] = blob
+            staged.clear()
+        return {}
+
+    def get_block_list(self, block_list_type='committed', **kwargs):
+        with self.service_lock:
+            blob = self.container.blobs.get(self.blob_name)
+            committed = blob.blocks if blob is not None else []
+            uncommitted = list(self.staged_blocks.items())
+        result = ([], [])
+        for index, blocks in enumerate((committed, uncommitted)):
+            if block_list_type in ('all', ('committed', 'uncommitted')[index]):
+                for block_id, size in blocks:
+                    block = BlobBlock(block_id)
+                    block.size = len(size) if isinstance(size, bytes) else size
+                    result[index].append(block)
+        return result
+
+    def start_copy_from_url(self, source_url, **kwargs):
+        path = source_url[len(self.container.service.account_url) + 1:]
+        container_name, blob_name = path.split('/', 1)
+        with self.service_lock:
+            try:
+                source = self.container.service.containers[container_name][
+                    blob_name]
+            except KeyError:
+                raise ResourceNotFoundError('The specified blob does not '
+                                            'exist.')
+            blob = FakeBlob(source.blob_type, source.content_settings,
+                            source.metadata)
+            blob.data = bytearray(source.data)
+            blob.blocks = list(source.blocks)
+            self.container.blobs[self.blob_name] = blob
+        return {'copy_status': 'success'}
+
+    def get_blob_properties(self, **kwargs):
+        blob = self._get_blob()
+        properties = BlobProperties()
+        properties.name = self.blob_name
+        properties.blob_type = blob.blob_type
+        properties.size = len(blob.data)
+        properties.content_settings = blob.content_settings
+        properties.metadata = dict(blob.metadata)
+        return properties
+
+    def set_http_headers(self, content_settings=None, **kwargs):
+        with self.service_lock:
+            self._get_blob().content_settings = (content_settings or
+                                                 ContentSettings())
+        return {}
+
+    def set_blob_metadata(self, metadata=None, **kwargs):
+        with self.service_lock:
+            self._get_blob().metadata = dict(metadata or {})
+        return {}
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        data = bytes(self._get_blob().data)
+        offset = offset or 0
+        end = len(data) if length is None else offset + length
+        return FakeStreamDownloader(data[offset:end])
+
+
+class FakeStreamDownloader(object):
+
+    chunk_size = 4 * 1024 * 1024
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def readall(self):
+        return self.data
+
+    def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+
+class FakeAsyncBlobServiceClient(FakeBlobServiceClient):
+    """
+    `azure.storage.blob.aio` version, sharing the blobs of
+    `FakeBlobServiceClient`.
+    """
+
+    def get_container_client(self, container):
+        return FakeAsyncContainerClient(self, container)
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncContainerClient(FakeContainerClient):
+
+    def get_blob_client(self, blob):
+        return FakeAsyncBlobClient(FakeBlobClient(self, blob))
+
+
+async def _join(iterable):
+    return b''.join([data async for data in iterable])
+
+
+class FakeAsyncBlobClient(object):
+    """
+    Runs the calls of a `FakeBlobClient` as coroutines, which give control
+    back to the event loop first (as a network call would).
+    """
+
+    def __init__(self, blob_client):
+        self._blob_client = blob_client
+
+    def __getattr__(self, name):
+        attr = getattr(self._blob_client, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            # Bodies streamed from async iterables
+            args = [await _join(arg) if hasattr(arg, '__aiter__') else arg
+                    for arg in args]
+            return attr(*args, **kwargs)
+
+        return call
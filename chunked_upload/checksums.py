@@ -0,0 +1,861 @@
+"""
+Checksum helpers used by django-chunked-upload.
+"""
+import asyncio
+import base64
+import binascii
+import collections
+import contextlib
+import ctypes
+import functools
+import hashlib
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+
+from .settings import HASH_CACHE_SIZE, TREE_HASH_LEAF_SIZE
+
+
+class CRCHash(object):
+    """
+    `hashlib`-like wrapper around a CRC function with the signature
+    `func(data, value) -> value`.
+    """
+
+    digest_size = 4
+
+    def __init__(self, name, func, value=0):
+        self.name = name
+        self._func = func
+        self._value = value
+
+    def update(self, data):
+        self._value = self._func(data, self._value)
+
+    def copy(self):
+        return CRCHash(self.name, self._func, self._value)
+
+    def digest(self):
+        return self._value.to_bytes(self.digest_size, 'big')
+
+    def hexdigest(self):
+        return '%08x' % self._value
+
+
+# Low-level digest functions of libcrypto: name prefix, layout of the
+# context structure in native byte order (hash words, bit counter as low and
+# high words, pending block, amount of bytes pending and, for SHA-2, size of
+# the digest), amount of hash words, bits of the counter words, size of the
+# digest and of the blocks
+OPENSSL_DIGESTS = {
+    'md5': ('MD5', '=4I2I64xI', 4, 32, 16, 64),
+    'sha1': ('SHA1', '=5I2I64xI', 5, 32, 20, 64),
+    'sha256': ('SHA256', '=8I2I64x2I', 8, 32, 32, 64),
+    'sha512': ('SHA512', '=8Q2Q128x2I', 8, 64, 64, 128),
+}
+# Contexts are allocated with room to spare. A library whose contexts don't
+# match the layouts above is left out (see `_check_functions`)
+CONTEXT_BUFFER_SIZE = 512
+
+OpenSSLFunctions = collections.namedtuple(
+    'OpenSSLFunctions',
+    'init update final context hash_words word_bits digest_size block_size')
+
+
+class _PyBuffer(ctypes.Structure):
+    # `Py_buffer`, part of the stable ABI
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.c_void_p),
+        ('strides', ctypes.c_void_p),
+        ('suboffsets', ctypes.c_void_p),
+        ('internal', ctypes.c_void_p),
+    ]
+
+
+_get_buffer = ctypes.pythonapi['PyObject_GetBuffer']
+_get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(_PyBuffer),
+                        ctypes.c_int]
+_get_buffer.restype = ctypes.c_int
+_release_buffer = ctypes.pythonapi['PyBuffer_Release']
+_release_buffer.argtypes = [ctypes.POINTER(_PyBuffer)]
+_release_buffer.restype = None
+
+
+@contextlib.contextmanager
+def _buffer_address(data):
+    """
+    Address and size of the buffer of `data` (contiguous, possibly
+    read-only like a memory map), without copying it.
+    """
+    buffer = _PyBuffer()
+    _get_buffer(data, ctypes.byref(buffer), 0)  # PyBUF_SIMPLE
+    try:
+        yield buffer.buf, buffer.len
+    finally:
+        _release_buffer(ctypes.byref(buffer))
+
+
+def check_context(functions, context, size):
+    """
+    Whether `context` is a context of `functions` after `size` bytes. Its
+    bit counter, amount of bytes pending and size of digest are checked:
+    libcrypto trusts them, and a bad one makes it overflow the context.
+    """
+    if len(context) != functions.context.size:
+        return False
+    fields = functions.context.unpack(context)
+    low, high, pending = fields[functions.hash_words:functions.hash_words + 3]
+    digest_sizes = fields[functions.hash_words + 3:]
+    return ((low | high << functions.word_bits) == size * 8 and
+            pending == size % functions.block_size and
+            all(digest_size == functions.digest_size
+                for digest_size in digest_sizes))
+
+
+def _check_functions(name, functions):
+    """
+    Whether contexts have the expected layout, and a context saved after
+    some data, then restored, gives the same digest as `hashlib`.
+    """
+    data = bytes(range(256)) * 3
+    context = ctypes.create_string_buffer(CONTEXT_BUFFER_SIZE)
+    functions.init(context)
+    functions.update(context, data[:100], 100)
+    state = context.raw[:functions.context.size]
+    if not check_context(functions, state, 100):
+        return False
+    restored = ctypes.create_string_buffer(state, CONTEXT_BUFFER_SIZE)
+    functions.update(restored, data[100:], len(data) - 100)
+    digest = ctypes.create_string_buffer(functions.digest_size)
+    functions.final(digest, restored)
+    return digest.raw == hashlib.new(name, data).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_library():
+    """
+    The libcrypto `hashlib` is linked to, or `None`.
+    """
+    try:
+        import _hashlib
+        return ctypes.CDLL(_hashlib.__file__)
+    except (ImportError, OSError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_state_format():
+    """
+    Version of libcrypto and byte order the saved states of `OpenSSLHash`
+    depend on, or `None` if unknown.
+    """
+    library = _load_library()
+    for function_name in ('OpenSSL_version', 'SSLeay_version'):
+        function = getattr(library, function_name, None)
+        if function is not None:
+            function.argtypes = [ctypes.c_int]
+            function.restype = ctypes.c_char_p
+            return '%s %s' % (function(0).decode('ascii', 'replace'),
+                              sys.byteorder)
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_openssl_functions():
+    """
+    Low-level digest functions of the libcrypto `hashlib` is linked to, by
+    algorithm name. Empty if they aren't available.
+    """
+    library = _load_library()
+    if library is None or get_state_format() is None:
+        return {}
+    all_functions = {}
+    for name, (prefix, layout, hash_words, word_bits, digest_size,
+               block_size) in OPENSSL_DIGESTS.items():
+        try:
+            init = getattr(library, prefix + '_Init')
+            update = getattr(library, prefix + '_Update')
+            final = getattr(library, prefix + '_Final')
+        except AttributeError:
+            continue  # Built without the deprecated functions
+        init.argtypes = [ctypes.c_void_p]
+        update.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+        final.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        for function in (init, update, final):
+            function.restype = ctypes.c_int
+        functions = OpenSSLFunctions(init, update, final,
+                                     struct.Struct(layout), hash_words,
+                                     word_bits, digest_size, block_size)
+        if _check_functions(name, functions):
+            all_functions[name] = functions
+    return all_functions
+
+
+class OpenSSLHash(object):
+    """
+    `hashlib`-like hash computed with the low-level functions of libcrypto
+    (`MD5_Init`, `MD5_Update`...), whose state can be saved (`get_state`)
+    and restored, along with the amount of bytes hashed, by any process of
+    any host using the same library (see `get_state_format`). Only for the
+    algorithms of `get_openssl_functions()`.
+    """
+
+    def __init__(self, name, state=None, size=0):
+        self.name = name
+        self.size = size
+        self._functions = get_openssl_functions()[name]
+        if state is None:
+            self._context = ctypes.create_string_buffer(CONTEXT_BUFFER_SIZE)
+            self._functions.init(self._context)
+        else:
+            if not check_context(self._functions, state, size):
+                raise ValueError('Invalid %s state' % name)
+            self._context = ctypes.create_string_buffer(state,
+                                                        CONTEXT_BUFFER_SIZE)
+
+    def update(self, data):
+        if isinstance(data, bytes):
+            self._functions.update(self._context, data, len(data))
+            self.size += len(data)
+            return
+        # Hashed in place (e.g. memory maps), without a copy
+        with _buffer_address(data) as (address, size):
+            self._functions.update(self._context, address, size)
+        self.size += size
+
+    def copy(self):
+        return OpenSSLHash(self.name, self.get_state(), self.size)
+
+    def get_state(self):
+        return self._context.raw[:self._functions.context.size]
+
+    def digest(self):
+        # Finalizing alters the context
+        context = self.copy()._context
+        digest = ctypes.create_string_buffer(self._functions.digest_size)
+        self._functions.final(digest, context)
+        return digest.raw
+
+    def hexdigest(self):
+        return binascii.hexlify(self.digest()).decode()
+
+
+def tree_hash_root(leaf_digests, leaf_hash):
+    """
+    Compute the root of a tree hash from the (binary) digests of its
+    leaves: adjacent digests are hashed together, level by level, and an
+    odd digest at the end of a level is promoted as is.
+    """
+    level = list(leaf_digests)
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            next_level.append(leaf_hash(level[i] + level[i + 1]).digest())
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+class TreeHash(object):
+    """
+    `hashlib`-like tree hash, with leaves of `leaf_size` bytes hashed with
+    `leaf_hash` (as the `x-amz-sha256-tree-hash` of Amazon Glacier).
+    """
+
+    def __init__(self, name, leaf_hash, leaf_size):
+        self.name = name
+        self.leaf_hash = leaf_hash
+        self.leaf_size = leaf_size
+        self._leaves = []
+        self._current = leaf_hash()
+        self._current_size = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while data:
+            size = min(len(data), self.leaf_size - self._current_size)
+            self._current.update(data[:size])
+            self._current_size += size
+            data = data[size:]
+            if self._current_size == self.leaf_size:
+                self._leaves.append(self._current.digest())
+                self._current = self.leaf_hash()
+                self._current_size = 0
+
+    def copy(self):
+        other = TreeHash(self.name, self.leaf_hash, self.leaf_size)
+        other._leaves = list(self._leaves)
+        other._current = self._current.copy()
+        other._current_size = self._current_size
+        return other
+
+    def digest(self):
+        leaves = list(self._leaves)
+        if self._current_size or not leaves:
+            leaves.append(self._current.digest())
+        return tree_hash_root(leaves, self.leaf_hash)
+
+    def hexdigest(self):
+        return binascii.hexlify(self.digest()).decode()
+
+
+class LeafRecorder(object):
+    """
+    Hashes the leaves of a tree hash that start inside a chunk stored at
+    `start`, as its data is fed through `update()`. Leaves that start in a
+    previous chunk are left out.
+    """
+
+    def __init__(self, leaf_hash, start, leaf_size):
+        self.leaf_hash = leaf_hash
+        self.leaf_size = leaf_size
+        self._leaves = {}
+        self._index = -(-start // leaf_size)
+        self._skip = self._index * leaf_size - start
+        self._current = None
+        self._current_size = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            self._skip -= skipped
+            data = data[skipped:]
+        while data:
+            if self._current is None:
+                self._current = self.leaf_hash()
+                self._current_size = 0
+            size = min(len(data), self.leaf_size - self._current_size)
+            self._current.update(data[:size])
+            self._current_size += size
+            data = data[size:]
+            if self._current_size == self.leaf_size:
+                self._record_current()
+
+    def _record_current(self):
+        self._leaves[str(self._index)] = [self._current_size,
+                                          self._current.hexdigest()]
+        self._index += 1
+        self._current = None
+
+    def get_leaves(self):
+        """
+        Returns `{index: [size, hex digest]}`. The last leaf may be shorter
+        than `leaf_size` if the chunk ends in the middle of it.
+        """
+        if self._current is not None:
+            self._record_current()
+        return self._leaves
+
+
+ALGORITHMS = {}
+
+
+def register_algorithm(name, factory):
+    """
+    Make a checksum algorithm available to uploads. `factory` is called
+    without arguments and must return a new hash object supporting
+    `update()`, `copy()` and `hexdigest()`.
+    """
+    ALGORITHMS[name] = factory
+
+
+def get_hasher(name):
+    try:
+        factory = ALGORITHMS[name]
+    except KeyError:
+        raise ValueError('Unsupported checksum algorithm: %s' % name)
+    return factory()
+
+
+for _name in ('md5', 'sha1', 'sha256', 'sha512', 'blake2b', 'blake2s'):
+    register_algorithm(_name, getattr(hashlib, _name))
+
+register_algorithm('crc32', lambda: CRCHash('crc32', zlib.crc32))
+
+# Tree hashes, with the hash used for their leaves. The leaves are hashed
+# (and recorded) as chunks arrive, and the root computed at completion
+TREE_ALGORITHMS = {
+    'sha256_tree': hashlib.sha256,
+}
+
+for _name, _leaf_hash in TREE_ALGORITHMS.items():
+    register_algorithm(_name, functools.partial(
+        TreeHash, _name, _leaf_hash, TREE_HASH_LEAF_SIZE))
+
+try:
+    import crc32c as _crc32c
+except ImportError:
+    try:
+        import google_crc32c as _google_crc32c
+    except ImportError:
+        pass
+    else:
+        register_algorithm('crc32c', lambda: CRCHash(
+            'crc32c', lambda data, value: _google_crc32c.extend(value, data)))
+else:
+    register_algorithm('crc32c', lambda: CRCHash('crc32c', _crc32c.crc32c))
+
+try:
+    import xxhash as _xxhash
+except ImportError:
+    pass
+else:
+    for _name in ('xxh64', 'xxh3_64', 'xxh3_128'):
+        register_algorithm(_name, getattr(_xxhash, _name))
+
+
+# CRC algorithms whose per-chunk values can be combined into the checksum of
+# the whole file, whatever the order the chunks arrive in. Values are the
+# (reflected) polynomials
+COMBINABLE_ALGORITHMS = {
+    'crc32': 0xEDB88320,
+    'crc32c': 0x82F63B78,
+}
+
+
+def _multmodp(polynomial, a, b):
+    """
+    Multiply `a` and `b` modulo `polynomial` (reflected bit order).
+    """
+    m = 1 << 31
+    product = 0
+    while True:
+        if a & m:
+            product ^= b
+            if not a & (m - 1):
+                break
+        m >>= 1
+        b = (b >> 1) ^ polynomial if b & 1 else b >> 1
+    return product
+
+
+@functools.lru_cache(maxsize=256)
+def _zeros_operator(polynomial, length):
+    """
+    Return x^(8 * length) modulo `polynomial`, the operator that appends
+    `length` zero bytes to a CRC.
+    """
+    operator = 1 << 31  # x^0
+    square = 1 << 30  # x^1, squared on each bit of the length in bits
+    length <<= 3
+    while length:
+        if length & 1:
+            operator = _multmodp(polynomial, square, operator)
+        length >>= 1
+        square = _multmodp(polynomial, square, square)
+    return operator
+
+
+def crc_combine(polynomial, crc1, crc2, length2):
+    """
+    Return the CRC of the concatenation of two blocks, given the CRC of
+    each block and the length of the second one (same as zlib's
+    `crc32_combine`, for any reflected 32 bits polynomial).
+    """
+    return _multmodp(polynomial, _zeros_operator(polynomial, length2),
+                     crc1) ^ crc2
+
+
+def combine_part_checksums(algorithm, parts, size):
+    """
+    Combine the per-chunk CRCs stored in `parts` (a dict of
+    `{start: {'size': ..., algorithm: hex}}`) into the hex CRC of the first
+    `size` bytes. Returns `None` if the parts don't cover them exactly.
+    """
+    polynomial = COMBINABLE_ALGORITHMS[algorithm]
+    crc = 0
+    position = 0
+    for start, part in sorted((int(start), part)
+                              for start, part in parts.items()):
+        if start != position or algorithm not in part:
+            return None
+        crc = crc_combine(polynomial, crc, int(part[algorithm], 16),
+                          part['size'])
+        position += part['size']
+    if position != size:
+        return None
+    return '%08x' % crc
+
+
+# Algorithms (by order of preference) whose checksum can identify the content
+# of an upload. Weak ones (MD5, SHA-1, CRCs) are left out on purpose:
+# colliding files can be crafted for them
+CONTENT_ADDRESS_ALGORITHMS = ('sha256', 'sha512', 'blake2b', 'blake2s')
+
+
+class MultiHash(object):
+    """
+    Computes several checksums in a single pass over the data.
+    """
+
+    def __init__(self, algorithms, hashers=None):
+        self.algorithms = tuple(algorithms)
+        if hashers is None:
+            hashers = [get_hasher(name) for name in self.algorithms]
+        self._hashers = hashers
+
+    def update(self, data):
+        for hasher in self._hashers:
+            hasher.update(data)
+
+    def copy(self):
+        return MultiHash(self.algorithms,
+                         [hasher.copy() for hasher in self._hashers])
+
+    def hexdigests(self):
+        return dict((name, hasher.hexdigest())
+                    for name, hasher in zip(self.algorithms, self._hashers))
+
+    def get_state(self):
+        """
+        Saved state of the hash objects (see `OpenSSLHash`), as base64 text
+        keyed by algorithm name, or `None` if some of them can't be saved.
+        """
+        states = {}
+        for name, hasher in zip(self.algorithms, self._hashers):
+            if not isinstance(hasher, OpenSSLHash):
+                return None
+            states[name] = base64.b64encode(hasher.get_state()).decode('ascii')
+        return states
+
+    @classmethod
+    def from_state(cls, algorithms, states, size):
+        """
+        Restore the hash objects saved by `get_state` after `size` bytes.
+        Returns `None` if they can't be restored by this process, or don't
+        look like states of `size` bytes.
+        """
+        functions = get_openssl_functions()
+        hashers = []
+        for name in algorithms:
+            try:
+                if name not in functions:
+                    return None
+                hashers.append(OpenSSLHash(name, base64.b64decode(
+                    states[name], validate=True), size))
+            except (KeyError, TypeError, ValueError):
+                return None
+        return cls(algorithms, hashers)
+
+
+def new_running_hash(algorithms):
+    """
+    `MultiHash` for the running checksums of an upload. The algorithms
+    supported by `OpenSSLHash` use it, so their state can be saved.
+    """
+    functions = get_openssl_functions()
+    return MultiHash(algorithms, [
+        OpenSSLHash(name) if name in functions else get_hasher(name)
+        for name in algorithms])
+
+
+class ChunkHasher(object):
+    """
+    Computes, in a single pass over a chunk stored at `start`, the running
+    checksums of the whole file (`running_hash`), the per-chunk CRCs and
+    the leaves of the tree hashes of the upload `algorithms`.
+    """
+
+    def __init__(self, running_hash, algorithms, start):
+        self.running_hash = running_hash
+        self.size = 0
+        self._part_hash = MultiHash([name for name in algorithms
+                                     if name in COMBINABLE_ALGORITHMS])
+        self._leaf_recorders = dict(
+            (name, LeafRecorder(TREE_ALGORITHMS[name], start,
+                                TREE_HASH_LEAF_SIZE))
+            for name in algorithms if name in TREE_ALGORITHMS
+        )
+
+    def update(self, data):
+        self.running_hash.update(data)
+        self._part_hash.update(data)
+        for recorder in self._leaf_recorders.values():
+            recorder.update(data)
+        self.size += len(data)
+
+    def get_part(self):
+        part = {'size': self.size}
+        part.update(self._part_hash.hexdigests())
+        return part
+
+    def get_tree_leaves(self):
+        return dict((name, recorder.get_leaves())
+                    for name, recorder in self._leaf_recorders.items())
+
+
+class HashingPipeline(object):
+    """
+    Feeds buffers to `consume` on a worker thread, so hashing overlaps with
+    the storage I/O done by the caller (hashlib releases the GIL while
+    hashing large buffers). Buffers must not be modified after being fed.
+    """
+
+    def __init__(self, consume, max_pending=4):
+        self._consume = consume
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            buffer = self._queue.get()
+            if buffer is None:
+                break
+            if self._error is None:
+                try:
+                    self._consume(buffer)
+                except BaseException as error:
+                    self._error = error
+
+    def feed(self, buffer):
+        self._queue.put(buffer)
+
+    def close(self):
+        """
+        Wait until every buffer has been consumed. Re-raises the error
+        raised by `consume`, if any.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class HashingReader(object):
+    """
+    Read-only file-like wrapper around `file_obj` (a file of `size` bytes,
+    read from its start) feeding the data read from it to `consume`. Data
+    read again after seeking back (e.g. when a request is retried) isn't fed
+    again.
+    """
+
+    def __init__(self, file_obj, size, consume):
+        self.file_obj = file_obj
+        self.size = size
+        self._consume = consume
+        self._position = 0
+        self._fed = 0
+        file_obj.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        end = self._position + len(data)
+        if self._position <= self._fed < end:
+            self._consume(memoryview(data)[self._fed - self._position:])
+            self._fed = end
+        self._position = end
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._position = self.file_obj.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    @property
+    def md5_digest(self):
+        """
+        MD5 of the file, if computed while it was received (see
+        `handlers.MD5TemporaryFileUploadHandler`), else `None`.
+        """
+        return getattr(self.file_obj, 'md5_digest', None)
+
+    def finish(self, buffer_size):
+        """
+        Feed the data that wasn't read (by a consumer that skipped part of
+        the file, or stopped early).
+        """
+        if self._fed < self.size:
+            self.seek(self._fed)
+            while self.read(buffer_size):
+                pass
+
+
+class AsyncHashingReader(object):
+    """
+    `HashingReader` for coroutines (`await reader.read(size)`). The data is
+    read and hashed in the default executor of the event loop, which
+    doesn't wait on the disk or on the hashing.
+    """
+
+    def __init__(self, file_obj, size, consume):
+        self.size = size
+        self._reader = HashingReader(file_obj, size, consume)
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, function, *args)
+
+    async def read(self, size=-1):
+        return await self._run(self._reader.read, size)
+
+    async def seek(self, offset, whence=os.SEEK_SET):
+        return await self._run(self._reader.seek, offset, whence)
+
+    async def finish(self, buffer_size):
+        await self._run(self._reader.finish, buffer_size)
+
+
+# Amount of data fed at once to the hash objects when hashing a whole file
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def map_path(path):
+    """
+    Memory map the file at `path` for a sequential read, and yield a
+    read-only buffer of its content. Slices of it mustn't be kept after
+    leaving the context.
+    """
+    with open(path, 'rb') as file_obj:
+        if not os.fstat(file_obj.fileno()).st_size:
+            yield b''  # Empty files can't be mapped
+            return
+        with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                yield view
+
+
+def hash_path(path, hash_obj, buffer_size=HASH_BUFFER_SIZE, size=None):
+    """
+    Feed the content of the file at `path` (only its first `size` bytes, if
+    given) to `hash_obj`. The file is memory mapped, so the data isn't
+    copied into Python buffers.
+    """
+    with map_path(path) as view:
+        size = len(view) if size is None else min(size, len(view))
+        for start in range(0, size, buffer_size):
+            hash_obj.update(view[start:start + buffer_size])
+
+
+def parse_algorithms(value):
+    """
+    Parse a comma separated list of algorithm names. Raises `ValueError`
+    if any of them isn't registered.
+    """
+    algorithms = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if not name or name in algorithms:
+            continue
+        if name not in ALGORITHMS:
+            raise ValueError('Unsupported checksum algorithm: %s' % name)
+        algorithms.append(name)
+    if not algorithms:
+        raise ValueError('No checksum algorithm given')
+    return algorithms
+
+
+# Names used by the `Digest` (RFC 3230) and `Repr-Digest` (RFC 9530)
+# headers, mapped to the registry names
+DIGEST_HEADER_ALGORITHMS = {
+    'md5': 'md5',
+    'sha': 'sha1',
+    'sha-256': 'sha256',
+    'sha-512': 'sha512',
+    'crc32c': 'crc32c',
+}
+
+
+def decode_base64_digest(value):
+    """
+    Convert a base64 encoded digest (as sent in HTTP headers) to hex.
+    """
+    return binascii.hexlify(base64.b64decode(value, validate=True)).decode()
+
+
+def parse_digest_header(value):
+    """
+    Parse a `Digest` or `Repr-Digest` header into a dict of hex digests
+    keyed by algorithm name. Algorithms that aren't registered are skipped.
+    Raises `ValueError` if the header is malformed.
+    """
+    checksums = {}
+    for item in value.split(','):
+        name, sep, encoded = item.strip().partition('=')
+        if not sep:
+            raise ValueError('Malformed digest header')
+        name = DIGEST_HEADER_ALGORITHMS.get(name.strip().lower())
+        if name is None or name not in ALGORITHMS:
+            continue
+        encoded = encoded.strip()
+        if len(encoded) > 1 and encoded[0] == encoded[-1] == ':':
+            # RFC 9530 byte sequence
+            encoded = encoded[1:-1]
+        checksums[name] = decode_base64_digest(encoded)
+    return checksums
+
+
+class RunningHashCache(object):
+    """
+    Process-wide store of running hash objects, keyed by upload id, so the
+    process that appended the last chunk doesn't have to restore them. Each
+    entry is tagged with the offset it covers. Other processes restore the
+    state saved with the upload, when it can be saved (see `OpenSSLHash`).
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, upload_id, offset):
+        """
+        Remove and return the hash object for `upload_id` if it covers
+        exactly `offset` bytes. Returns `None` otherwise.
+        """
+        with self._lock:
+            entry = self._entries.pop(upload_id, None)
+        if entry is None or entry[0] != offset:
+            return None
+        return entry[1]
+
+    def get(self, upload_id, offset):
+        """
+        Return a copy of the hash object for `upload_id` if it covers
+        exactly `offset` bytes, leaving the cached one untouched.
+        """
+        with self._lock:
+            entry = self._entries.get(upload_id)
+        if entry is None or entry[0] != offset:
+            return None
+        return entry[1].copy()
+
+    def put(self, upload_id, offset, hash_obj):
+        with self._lock:
+            self._entries.pop(upload_id, None)
+            self._entries[upload_id] = (offset, hash_obj)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._entries.pop(upload_id, None)
+
+
+running_hashes = RunningHashCache(HASH_CACHE_SIZE)
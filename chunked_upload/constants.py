@@ -6,6 +6,7 @@ class http_status:
     HTTP_400_BAD_REQUEST = 400
     HTTP_403_FORBIDDEN = 403
     HTTP_410_GONE = 410
+    HTTP_503_SERVICE_UNAVAILABLE = 503
 
 
 UPLOADING = 1
@@ -1,6 +1,7 @@
 """
 Exceptions raised by django-chunked-upload.
 """
+from .constants import http_status
 
 
 class ChunkedUploadError(Exception):
@@ -11,3 +12,14 @@ class ChunkedUploadError(Exception):
     def __init__(self, status, **data):
         self.status_code = status
         self.data = data
+
+
+class ChunkChecksumError(ChunkedUploadError):
+    """
+    Exception raised if a chunk doesn't match the checksum sent along with it.
+    """
+
+    def __init__(self, algorithm, **data):
+        detail = '%s checksum of chunk does not match' % algorithm
+        super(ChunkChecksumError, self).__init__(
+            status=http_status.HTTP_400_BAD_REQUEST, detail=detail, **data)
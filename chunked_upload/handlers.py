@@ -0,0 +1,30 @@
+"""
+Upload handlers for the chunks.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class MD5TemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    `TemporaryFileUploadHandler` computing the MD5 of the file while it's
+    spooled to disk (`md5_digest` attribute of the file), so sinks sending
+    it along with the data (`S3MultipartSink`, with
+    `CHUNKED_UPLOAD_S3_VALIDATE_CONTENT`) don't read the file twice.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super(MD5TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.md5 = hashlib.md5()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        return super(MD5TemporaryFileUploadHandler, self).receive_data_chunk(
+            raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super(MD5TemporaryFileUploadHandler, self).file_complete(
+            file_size)
+        file.md5_digest = self.md5.digest()
+        return file
@@ -16,6 +16,10 @@ class Command(BaseCommand):
 
     help = 'Deletes chunked uploads that have already expired.'
 
+    # Uploads deleted at once (their data is deleted in batches when the
+    # storage allows it)
+    batch_size = 1000
+
     def add_arguments(self, parser):
         super().add_arguments(parser)
         parser.add_argument(
@@ -33,18 +37,26 @@ class Command(BaseCommand):
         qs = self.model.objects.all()
         qs = qs.filter(created_on__lt=(timezone.now() - EXPIRATION_DELTA))
 
-        for chunked_upload in qs:
-            if interactive:
+        if interactive:
+            pks = []
+            for chunked_upload in qs:
                 prompt = prompt_msg.format(obj=chunked_upload) + u' (y/n): '
                 answer = input(prompt).lower()
                 while answer not in ('y', 'n'):
                     answer = input(prompt).lower()
-                if answer == 'n':
-                    continue
-
-            count[chunked_upload.status] += 1
-            # Deleting objects individually to call delete method explicitly
-            chunked_upload.delete()
+                if answer == 'y':
+                    pks.append(chunked_upload.pk)
+            qs = qs.filter(pk__in=pks)
+
+        while True:
+            batch = list(qs.values_list('pk', 'status')[:self.batch_size])
+            if not batch:
+                break
+            for pk, status in batch:
+                count[status] += 1
+            # The queryset deletes the data too (see ChunkedUploadQuerySet)
+            self.model.objects.filter(
+                pk__in=[pk for pk, status in batch]).delete()
 
         print('%i complete uploads were deleted.' % count[COMPLETE])
         print('%i incomplete uploads were deleted.' % count[UPLOADING])
@@ -0,0 +1,17 @@
+import chunked_upload.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chunked_upload', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='checksum_algorithms',
+            field=models.CharField(default=chunked_upload.models.default_checksum_algorithms, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chunked_upload', '0002_chunkedupload_checksum_algorithms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='parts',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chunked_upload', '0004_chunkedupload_tree_leaves'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=150),
+        ),
+    ]
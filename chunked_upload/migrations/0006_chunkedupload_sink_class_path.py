@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chunked_upload', '0005_chunkedupload_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='sink_class_path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chunked_upload', '0006_chunkedupload_sink_class_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='sink_state',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+    ]
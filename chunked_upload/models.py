@@ -1,19 +1,50 @@
-import hashlib
+import contextlib
+import copy
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
+from asgiref.sync import sync_to_async
 from django.db import models
 from django.conf import settings
 from django.core.files.uploadedfile import UploadedFile
 from django.utils import timezone
 
-from .settings import EXPIRATION_DELTA, UPLOAD_TO, STORAGE, DEFAULT_MODEL_USER_FIELD_NULL, DEFAULT_MODEL_USER_FIELD_BLANK
-from .constants import CHUNKED_UPLOAD_CHOICES, UPLOADING
+from .settings import EXPIRATION_DELTA, UPLOAD_TO, STORAGE, DEFAULT_MODEL_USER_FIELD_NULL, DEFAULT_MODEL_USER_FIELD_BLANK, \
+    CHECKSUM_ALGORITHMS, TREE_HASH_LEAF_SIZE, BACKGROUND_HASHING_THRESHOLD, WRITE_BUFFER_SIZE
+from .constants import CHUNKED_UPLOAD_CHOICES, UPLOADING, COMPLETE
+from .checksums import COMBINABLE_ALGORITHMS, CONTENT_ADDRESS_ALGORITHMS, TREE_ALGORITHMS, AsyncHashingReader, ChunkHasher, \
+    HashingPipeline, HashingReader, MultiHash, HASH_BUFFER_SIZE, combine_part_checksums, get_state_format, hash_path, \
+    map_path, new_running_hash, running_hashes, tree_hash_root
+from .exceptions import ChunkChecksumError
+from .sinks import ASYNC, COPY_FILE, TRUNCATE, WRITE_AT, PartialWriteError, delete_sinks, get_sink_class, get_sink_class_path
 
 
 def generate_upload_id():
     return uuid.uuid4().hex
 
 
+def default_checksum_algorithms():
+    return ','.join(CHECKSUM_ALGORITHMS)
+
+
+class ChunkedUploadQuerySet(models.QuerySet):
+
+    def delete(self, delete_files=True):
+        """
+        Delete the uploads along with their data, in batches when their
+        storage allows it (see `AbstractChunkedUpload.delete_data`).
+        """
+        if not delete_files:
+            return super(ChunkedUploadQuerySet, self).delete()
+        uploads = list(self)
+        deleted = super(ChunkedUploadQuerySet, self).delete()
+        self.model.delete_data(uploads)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class AbstractChunkedUpload(models.Model):
     """
     Base chunked upload model. This model is abstract (doesn't create a table
@@ -31,6 +62,52 @@ class AbstractChunkedUpload(models.Model):
     status = models.PositiveSmallIntegerField(choices=CHUNKED_UPLOAD_CHOICES,
                                               default=UPLOADING)
     completed_on = models.DateTimeField(null=True, blank=True)
+    checksum_algorithms = models.CharField(max_length=255, editable=False,
+                                           default=default_checksum_algorithms)
+    # Chunks received so far, keyed by their start offset:
+    # {start: {'size': ..., <combinable algorithm>: <chunk checksum>}}
+    parts = models.JSONField(default=dict, editable=False)
+    # Leaves of the tree hashes: {algorithm: {index: [size, leaf checksum]}}
+    tree_leaves = models.JSONField(default=dict, editable=False)
+    # Checksum identifying the content of a completed upload, as
+    # '<algorithm>:<hex digest>' (see `get_digest`)
+    digest = models.CharField(max_length=150, blank=True, db_index=True,
+                              editable=False)
+    # Sink the chunks are written to (dotted path), set with the first one
+    sink_class_path = models.CharField(max_length=255, blank=True,
+                                       editable=False)
+    # Data the sink keeps along with the upload (e.g. the id of a remote
+    # multipart upload)
+    sink_state = models.JSONField(default=dict, editable=False)
+    # Saved state of the running checksums (see `checksums.OpenSSLHash`),
+    # with the offset they cover: {'offset': ..., 'states': {algorithm: ...}}
+    hash_state = models.JSONField(default=dict, editable=False)
+
+    # Sink (class or dotted path) used by default by the uploads of this
+    # model. `None` means `CHUNKED_UPLOAD_SINK_CLASS`
+    sink_class = None
+
+    objects = ChunkedUploadQuerySet.as_manager()
+
+    def get_sink(self):
+        """
+        Sink where the chunks of this upload are written.
+        """
+        if getattr(self, '_sink', None) is None:
+            if not self.sink_class_path:
+                # Keep using the same sink even if the settings change
+                self.sink_class_path = get_sink_class_path(
+                    get_sink_class(self.sink_class))
+            self._sink = get_sink_class(self.sink_class_path)(self)
+        return self._sink
+
+    def set_sink_class(self, sink_class):
+        """
+        Use `sink_class` (a class or dotted path) for this upload. Has to be
+        called before the first chunk is written.
+        """
+        self.sink_class_path = get_sink_class_path(sink_class)
+        self._sink = None
 
     @property
     def expires_on(self):
@@ -40,86 +117,600 @@ class AbstractChunkedUpload(models.Model):
     def expired(self):
         return self.expires_on <= timezone.now()
 
+    def get_checksum_algorithms(self):
+        return self.checksum_algorithms.split(',')
+
+    def _get_running_algorithms(self):
+        """
+        Algorithms that have to be computed in order, over the whole file.
+        The combinable ones (CRCs) and tree hashes are computed per chunk
+        instead.
+        """
+        return [name for name in self.get_checksum_algorithms()
+                if name not in COMBINABLE_ALGORITHMS and
+                name not in TREE_ALGORITHMS]
+
+    @property
+    def checksums(self):
+        """
+        Hex digests of the data uploaded so far, keyed by algorithm name.
+        """
+        if getattr(self, '_checksums', None) is None:
+            hash_obj = running_hashes.get(self.upload_id, self.offset)
+            if hash_obj is None:
+                # Appended by another process
+                hash_obj = self._load_hash_state(self.offset)
+            if hash_obj is not None:
+                checksums = hash_obj.hexdigests()
+            else:
+                checksums = self._get_stored_checksums()
+                missing = [name for name in self._get_running_algorithms()
+                           if name not in checksums]
+                if missing:
+                    checksums.update(
+                        self._hash_stored_data(missing).hexdigests())
+            for name in self.get_checksum_algorithms():
+                if name in TREE_ALGORITHMS:
+                    checksums[name] = self._get_tree_checksum(name)
+                if name not in COMBINABLE_ALGORITHMS:
+                    continue
+                checksums[name] = combine_part_checksums(name, self.parts,
+                                                         self.offset)
+                if checksums[name] is None:
+                    # Parts don't cover the whole file
+                    checksums[name] = self._hash_stored_data(
+                        [name]).hexdigests()[name]
+            self._checksums = checksums
+        return self._checksums
+
+    def get_checksum(self, algorithm):
+        if algorithm in self.checksums:
+            return self.checksums[algorithm]
+        # Not tracked for this upload: read the data back
+        return self._hash_stored_data([algorithm]).hexdigests()[algorithm]
+
     @property
     def md5(self):
-        if getattr(self, '_md5', None) is None:
-            md5 = hashlib.md5()
-            for chunk in self.file.chunks():
-                md5.update(chunk)
-            self._md5 = md5.hexdigest()
-        return self._md5
+        return self.get_checksum('md5')
+
+    def _hash_stored_data(self, algorithms=None):
+        """
+        Hash the data already stored. Only needed when the running hash of
+        this upload is lost (see `_take_running_hash`).
+        """
+        if algorithms is None:
+            algorithms = self._get_running_algorithms()
+        hash_obj = MultiHash(algorithms)
+        if self.offset and algorithms:
+            sink = self.get_sink()
+            path = sink.local_path()
+            if path is not None:
+                # The file may be larger than the data (e.g. preallocated)
+                hash_path(path, hash_obj, size=self.offset)
+            else:
+                for chunk in sink.chunks(chunk_size=HASH_BUFFER_SIZE):
+                    hash_obj.update(chunk)
+        return hash_obj
+
+    def _get_stored_checksums(self):
+        """
+        Checksums kept along with the stored data (see `store_checksums`).
+        """
+        if self.digest:
+            # Only set once the data has been verified
+            name, value = self.digest.split(':', 1)
+            return {name: value}
+        return self.get_sink().get_stored_checksums()
+
+    def get_digest(self):
+        """
+        Checksum that identifies the content of the upload, using the
+        preferred algorithm of `CONTENT_ADDRESS_ALGORITHMS` computed for it.
+        Empty if none is.
+        """
+        for name in CONTENT_ADDRESS_ALGORITHMS:
+            if name in self.get_checksum_algorithms():
+                return '%s:%s' % (name, self.checksums[name])
+        return ''
+
+    def store_checksums(self):
+        """
+        Record the digest of the upload. Also keep the checksums along with
+        the stored data when the sink supports it (e.g. the Content-MD5
+        property of an Azure blob), so they don't have to be computed again
+        by any other process.
+        """
+        self.digest = self.get_digest()
+        self.get_sink().store_checksums(self.checksums)
+
+    def finalize_chunks(self):
+        """
+        Make the chunks written so far readable as a single file. Called
+        once all of them have been uploaded (see `BaseChunkSink.finalize`).
+        The chunks still buffered by the sink are flushed first.
+        """
+        sink = self.get_sink()
+        try:
+            parts = sink.flush()
+        except PartialWriteError as error:
+            for args in error.parts:
+                self.add_part(*args)
+            raise
+        for args in parts:
+            self.add_part(*args)
+        sink.finalize()
+
+    def hash_tree_leaves(self, algorithm, indices):
+        """
+        Hash the leaves `indices` of a tree hash from the stored data, in
+        parallel. Returns `{index: [size, leaf checksum]}`.
+        """
+        leaf_hash = TREE_ALGORITHMS[algorithm]
+
+        def hash_leaf(index):
+            data = self.get_sink().read_range(index * TREE_HASH_LEAF_SIZE,
+                                              TREE_HASH_LEAF_SIZE)
+            return str(index), [len(data), leaf_hash(data).hexdigest()]
+
+        if not indices:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(indices), 8)) as executor:
+            return dict(executor.map(hash_leaf, indices))
+
+    def check_tree_leaves(self, algorithm, indices=None):
+        """
+        Verify the stored data against the recorded leaves of a tree hash,
+        without hashing the whole file. Returns the indices of the leaves
+        that don't match. Leaves only recorded in part (they span several
+        chunks) aren't checked.
+        """
+        recorded = self.tree_leaves.get(algorithm, {})
+        if indices is None:
+            indices = sorted(int(index) for index in recorded)
+        checked = []
+        for index in indices:
+            size = min(TREE_HASH_LEAF_SIZE,
+                       self.offset - index * TREE_HASH_LEAF_SIZE)
+            leaf = recorded.get(str(index))
+            if leaf is not None and leaf[0] == size:
+                checked.append(index)
+        computed = self.hash_tree_leaves(algorithm, checked)
+        return [index for index in checked
+                if recorded[str(index)] != computed[str(index)]]
+
+    def _get_tree_checksum(self, algorithm):
+        """
+        Compute the root of a tree hash from the recorded leaves. Leaves
+        that weren't recorded (they span several chunks) are hashed from
+        the stored data.
+        """
+        recorded = self.tree_leaves.setdefault(algorithm, {})
+        count = max(1, -(-self.offset // TREE_HASH_LEAF_SIZE))
+        missing = []
+        for index in range(count):
+            size = min(TREE_HASH_LEAF_SIZE,
+                       self.offset - index * TREE_HASH_LEAF_SIZE)
+            leaf = recorded.get(str(index))
+            if leaf is None or leaf[0] != size:
+                missing.append(index)
+        recorded.update(self.hash_tree_leaves(algorithm, missing))
+        leaves = [bytes.fromhex(recorded[str(index)][1])
+                  for index in range(count)]
+        return tree_hash_root(leaves, TREE_ALGORITHMS[algorithm]).hex()
+
+    def _is_file_shared(self):
+        """
+        Whether other uploads are linked to the same file (see
+        `deduplicate`).
+        """
+        return type(self).objects.filter(file=self.file.name).exclude(
+            pk=self.pk).exists()
+
+    def deduplicate(self):
+        """
+        If an identical upload (same digest) is already stored, drop the
+        data of this one and link it to the existing file instead. Returns
+        whether the upload was linked.
+        """
+        if not self.digest:
+            return False
+        original = type(self).objects.filter(
+            digest=self.digest, offset=self.offset, status=COMPLETE
+        ).exclude(pk=self.pk).exclude(file=self.file.name).exclude(
+            file='').first()
+        if original is None:
+            return False
+        self.get_sink().delete()
+        self.link_to(original)
+        return True
+
+    def move_to(self, name, storage=None, save=True):
+        """
+        Save the data of the completed upload as `name` in `storage` (the
+        storage of the `file` field by default), and return the name it was
+        saved as. Unlike saving `get_uploaded_file()` in another field, the
+        data isn't read when the sink can avoid it (see
+        `BaseChunkSink.save_to`). The upload doesn't keep the data (its
+        `file` is cleared), unless other uploads are linked to it.
+        """
+        if not self.file:
+            raise ValueError('The upload has no data (already moved?)')
+        if storage is None:
+            storage = self.file.storage
+        shared = self._is_file_shared()
+        self.file.close()
+        name = self.get_sink().save_to(name, storage, move=not shared)
+        if not shared:
+            self.file = None
+            if save:
+                self.save()
+        return name
+
+    def link_to(self, original):
+        """
+        Make the upload use the (already verified) file of `original`,
+        through the sink it was written to.
+        """
+        self.file.name = original.file.name
+        self.offset = original.offset
+        self.digest = original.digest
+        self.sink_class_path = original.sink_class_path
+        self.sink_state = copy.deepcopy(original.sink_state)
+        self._sink = None
 
     def delete(self, delete_file=True, *args, **kwargs):
-        if self.file:
-            storage, path = self.file.storage, self.file.path
+        if self.file and delete_file and self._is_file_shared():
+            delete_file = False
+        running_hashes.discard(self.upload_id)
         super(AbstractChunkedUpload, self).delete(*args, **kwargs)
         if self.file and delete_file:
-            storage.delete(path)
+            self.get_sink().delete()
+
+    @classmethod
+    def delete_data(cls, uploads):
+        """
+        Delete the data of `uploads`, already deleted from the database.
+        Sinks of the same class are deleted together, so they can use the
+        batch operations of their storage (see `BaseChunkSink.delete_many`).
+        Files still used by other uploads are kept.
+        """
+        sinks = {}
+        for upload in uploads:
+            running_hashes.discard(upload.upload_id)
+            if upload.file:
+                upload.file.close()
+                sinks.setdefault(upload.file.name, upload.get_sink())
+        names = list(sinks)
+        # In batches: databases limit the parameters of a query
+        for i in range(0, len(names), 500):
+            for name in cls.objects.filter(
+                    file__in=names[i:i + 500]).values_list('file', flat=True):
+                sinks.pop(name, None)
+        delete_sinks(sinks.values())
 
     def __str__(self):
         return u'<%s - upload_id: %s - bytes: %s - status: %s>' % (
             self.filename, self.upload_id, self.offset, self.status)
 
-    def _get_blob_service_client(self):
-        from azure.core.credentials import AzureNamedKeyCredential
-        from azure.storage.blob import BlobServiceClient
-
-        account_name = settings.AZURE_ACCOUNT_NAME
-        account_key = settings.AZURE_ACCOUNT_KEY
-        credential = AzureNamedKeyCredential(account_name, account_key)
-        account_url = f"https://{account_name}.blob.core.windows.net"
-        return BlobServiceClient(account_url=account_url, credential=credential)
-
-    def append_chunk(self, chunk, chunk_size=None, save=True):
-        if getattr(settings, 'USE_AZURE_APPEND_BLOB', False):
-            container_name = settings.AZURE_MEDIA_CONTAINER
-            blob_name = self.file.name
-
-            blob_service_client = self._get_blob_service_client()
-            container_client = blob_service_client.get_container_client(container_name)
-            append_blob_client = container_client.get_blob_client(blob_name)
-
-            # For new uploads, ensure we have a clean slate:
-            if self.offset == 0:
-                if append_blob_client.exists():
-                    # Delete existing blob if it's not of the Append Blob type
-                    append_blob_client.delete_blob()
-                append_blob_client.create_append_blob()
-
-            # Append the chunk data
-            data = chunk.read()
-            append_blob_client.append_block(data)
-
-            # Update offset accordingly
+    def verify_chunk(self, data, checksums):
+        """
+        Raise `ChunkChecksumError` if `data` doesn't match `checksums` (hex
+        digests keyed by algorithm name). The offset isn't modified.
+        """
+        chunk_hash = MultiHash(checksums.keys())
+        chunk_hash.update(data)
+        self._check_chunk_hash(chunk_hash, checksums)
+
+    def _check_chunk_hash(self, chunk_hash, checksums):
+        for name, value in chunk_hash.hexdigests().items():
+            if value != checksums[name]:
+                raise ChunkChecksumError(name, offset=self.offset)
+
+    def open_sink(self, size=None):
+        """
+        Prepare the sink of a new upload (see `BaseChunkSink.open`). `size`
+        is the size of the whole file, if known. If not called, it's done
+        when the first chunk is written.
+        """
+        self.get_sink().open(size=size)
+        self._sink_opened = True
+
+    def _must_open_sink(self):
+        return self._state.adding and not getattr(self, '_sink_opened', False)
+
+    def supports_write_at(self):
+        """
+        Whether chunks can be written at any offset, in any order (and in
+        parallel).
+        """
+        return WRITE_AT in self.get_sink().capabilities
+
+    def has_missing_chunks(self):
+        """
+        Whether chunks were written after a range that is still missing.
+        """
+        return any(int(start) > self.offset for start in self.parts)
+
+    def append_chunk(self, chunk, chunk_size=None, save=True, checksums=None,
+                     total=None):
+        """
+        Append `chunk` to the upload. If `checksums` is given, the chunk is
+        verified before being stored (see `verify_chunk`). `total` is the
+        size of the whole file, if known. Returns whether the offset moved
+        (see `commit_chunk`). If only part of the data could be stored
+        (`PartialWriteError`), that part is added before re-raising.
+        """
+        start = self.get_append_offset()
+        try:
+            part, tree_leaves = self.write_chunk(
+                chunk, start, checksums=checksums, total=total)
             if chunk_size is not None:
-                self.offset += chunk_size
-            elif hasattr(chunk, 'size'):
-                self.offset += chunk.size
-            else:
-                self.offset += len(data)
+                part['size'] = chunk_size
+            moved = self.commit_chunk(start, part, tree_leaves)
+        except PartialWriteError as error:
+            for args in error.parts:
+                self.add_part(*args)
+            if save:
+                self.save()
+            raise
+        if save and (moved or self._state.adding):
+            self.save()
+        return moved
+
+    def get_append_offset(self):
+        """
+        Offset of the next chunk appended: past the data buffered by the
+        sink (see `BaseChunkSink.pending_size`), which isn't counted by
+        `offset` until it's stored for good.
+        """
+        return self.offset + self.get_sink().pending_size()
+
+    def commit_chunk(self, start, part, tree_leaves):
+        """
+        Record a chunk appended at `start` (see `add_part`) once the sink
+        has stored it for good: chunks buffered by the sink are recorded
+        when they're flushed (see `BaseChunkSink.commit_part`). Returns
+        whether the offset moved.
+        """
+        parts = self.get_sink().commit_part(start, part, tree_leaves)
+        for args in parts:
+            self.add_part(*args)
+        return bool(parts)
+
+    def write_chunk(self, chunk, start, checksums=None, total=None):
+        """
+        Write `chunk` at `start` and hash it, without modifying the upload
+        (see `add_part`). Writing anywhere but at the current offset needs a
+        sink with the `WRITE_AT` capability. The chunk is read in buffers of
+        `CHUNKED_UPLOAD_WRITE_BUFFER_SIZE` bytes at most. Returns the part
+        record and the tree leaves of the chunk. If the sink could only store
+        part of it, the `PartialWriteError` raised carries them for that part
+        (`parts` attribute, as a list of `add_part` arguments).
+        """
+        sink = self.get_sink()
+        if COPY_FILE in sink.capabilities and \
+                hasattr(chunk, 'temporary_file_path'):
+            # Already spooled to disk by Django: let the kernel copy it, and
+            # hash it through a memory map instead of reading it
+            path = chunk.temporary_file_path()
+            with map_path(path) as data:
+                if checksums:
+                    self.verify_chunk(data, checksums)
+                hash_obj = self._take_running_hash(sink, start)
+                with self._hashing(sink, start, len(data),
+                                   hash_obj=hash_obj) as (feed, chunk_hasher):
+                    feed(data)
+                    if self._must_open_sink():
+                        self.open_sink(size=total)
+                    sink.copy_file(path, start)
         else:
-            # Fallback for development using local storage
-            self.file.close()
-            with open(self.file.path, mode='ab') as file_obj:
-                file_obj.write(chunk.read())
-            if chunk_size is not None:
-                self.offset += chunk_size
-            elif hasattr(chunk, 'size'):
-                self.offset += chunk.size
+            if checksums and not self._can_discard_chunk(sink, start):
+                # It couldn't be dropped from the sink if it turned out to be
+                # corrupted: check it before writing it
+                self._verify_chunk_file(chunk, checksums)
+                checksums = None
+            hash_obj = self._take_running_hash(sink, start)
+            with self._hashing(sink, start, chunk.size, checksums,
+                               hash_obj) as (feed, chunk_hasher):
+                reader = HashingReader(chunk, chunk.size, feed)
+                if self._must_open_sink():
+                    self.open_sink(size=total)
+                try:
+                    sink.write(start, reader, chunk.size)
+                except PartialWriteError as error:
+                    chunk.seek(0)
+                    error.parts = [self.hash_part(chunk, start, error.size)]
+                    raise
+                reader.finish(WRITE_BUFFER_SIZE)
+        return chunk_hasher.get_part(), chunk_hasher.get_tree_leaves()
+
+    async def awrite_chunk(self, chunk, start, checksums=None, total=None):
+        """
+        Async version of `write_chunk`. With a sink having the `ASYNC`
+        capability, the chunk is written without holding a thread while the
+        storage replies; otherwise `write_chunk` runs in a worker thread.
+        """
+        sink = self.get_sink()
+        if ASYNC not in sink.capabilities:
+            return await sync_to_async(self.write_chunk,
+                                       thread_sensitive=False)(
+                chunk, start, checksums=checksums, total=total)
+        if checksums and not self._can_discard_chunk(sink, start):
+            await sync_to_async(self._verify_chunk_file,
+                                thread_sensitive=False)(chunk, checksums)
+            checksums = None
+        hash_obj = self._take_running_hash(sink, start)
+        # Read and hashed in the executor of the loop: no pipeline needed
+        with self._hashing(sink, start, chunk.size, checksums, hash_obj,
+                           background=False) as (feed, chunk_hasher):
+            reader = AsyncHashingReader(chunk, chunk.size, feed)
+            if self._must_open_sink():
+                await sink.aopen(size=total)
+                self._sink_opened = True
+            try:
+                await sink.awrite(start, reader, chunk.size)
+            except PartialWriteError as error:
+                error.parts = [await sync_to_async(
+                    self._hash_written_part, thread_sensitive=False)(
+                    chunk, start, error.size)]
+                raise
+            await reader.finish(WRITE_BUFFER_SIZE)
+        return chunk_hasher.get_part(), chunk_hasher.get_tree_leaves()
+
+    def _hash_written_part(self, chunk, start, size):
+        chunk.seek(0)
+        return self.hash_part(chunk, start, size)
+
+    def hash_part(self, file_obj, start, size):
+        """
+        Hash `size` bytes read from `file_obj`, stored at `start` (e.g. the
+        part of a chunk stored before a `PartialWriteError`). Returns the
+        arguments of `add_part` for them.
+        """
+        chunk_hasher = ChunkHasher(MultiHash([]),
+                                   self.get_checksum_algorithms(), start)
+        remaining = size
+        while remaining:
+            data = file_obj.read(min(WRITE_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            chunk_hasher.update(data)
+            remaining -= len(data)
+        return start, chunk_hasher.get_part(), chunk_hasher.get_tree_leaves()
+
+    def _verify_chunk_file(self, chunk, checksums):
+        chunk_hash = MultiHash(checksums.keys())
+        for data in chunk.chunks(chunk_size=WRITE_BUFFER_SIZE):
+            chunk_hash.update(data)
+        self._check_chunk_hash(chunk_hash, checksums)
+
+    def _take_running_hash(self, sink, start):
+        """
+        Hash of the data stored before `start`, if it can be followed by the
+        chunk written there (`None` otherwise): kept by this process, or
+        restored from `hash_state`. The data stored isn't read to catch up:
+        if the running hash is lost, the checksums are computed once, on
+        completion.
+        """
+        # The running hash can only follow chunks written in order
+        hash_obj = running_hashes.take(self.upload_id, start)
+        if hash_obj is None and WRITE_AT not in sink.capabilities:
+            if start == 0:
+                hash_obj = new_running_hash(self._get_running_algorithms())
             else:
-                self.offset = self.file.size
+                hash_obj = self._load_hash_state(start)
+        return hash_obj
 
-        self._md5 = None  # Clear cached MD5
-        if save:
-            self.save()
-        if not getattr(settings, 'USE_AZURE_APPEND_BLOB', False):
-            self.file.close()
+    def _load_hash_state(self, offset):
+        """
+        Running hash restored from `hash_state`, if it covers `offset` bytes
+        and can be restored by this process (`None` otherwise).
+        """
+        if self.hash_state.get('offset') != offset or \
+                self.hash_state.get('format') != get_state_format():
+            return None
+        return MultiHash.from_state(self._get_running_algorithms(),
+                                    self.hash_state.get('states'), offset)
+
+    def _save_hash_state(self, offset, hash_obj):
+        """
+        Keep the state of the running hash with the upload (saved along with
+        the chunk), so any process can resume it.
+        """
+        states = hash_obj.get_state()
+        if states is None:
+            self.hash_state = {}
+        else:
+            self.hash_state = {'offset': offset, 'format': get_state_format(),
+                               'states': states}
+
+    @contextlib.contextmanager
+    def _hashing(self, sink, start, size, checksums=None, hash_obj=None,
+                 background=True):
+        """
+        Context for writing a chunk of `size` bytes at `start`. Yields a
+        function hashing the data as it's written (on a worker thread, for
+        large chunks, unless `background` is false) and the `ChunkHasher` it
+        feeds. `hash_obj` is the
+        running hash it follows (see `_take_running_hash`). If `checksums`
+        is given, the chunk is verified too, and discarded from the sink if
+        it doesn't match them.
+        """
+        chunk_hasher = ChunkHasher(hash_obj or MultiHash([]),
+                                   self.get_checksum_algorithms(), start)
+        chunk_hash = MultiHash((checksums or {}).keys())
+
+        def consume(data):
+            chunk_hasher.update(data)
+            chunk_hash.update(data)
+
+        if (background and BACKGROUND_HASHING_THRESHOLD is not None and
+                size >= BACKGROUND_HASHING_THRESHOLD):
+            # Hash while the chunk is being written
+            pipeline = HashingPipeline(consume)
+            feed = pipeline.feed
+        else:
+            pipeline = None
+            feed = consume
+        try:
+            yield feed, chunk_hasher
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+        if checksums:
+            try:
+                self._check_chunk_hash(chunk_hash, checksums)
+            except ChunkChecksumError:
+                self._discard_chunk(sink, start)
+                raise
+        if hash_obj is not None:
+            # Keep the running hash so completion doesn't have to re-read
+            # the file
+            end = start + chunk_hasher.size
+            if WRITE_AT not in sink.capabilities:
+                self._save_hash_state(end, hash_obj)
+            running_hashes.put(self.upload_id, end, hash_obj)
+
+    def _can_discard_chunk(self, sink, start):
+        """
+        Whether a chunk written at `start` can be dropped from the sink,
+        leaving the data stored so far as it was.
+        """
+        if WRITE_AT in sink.capabilities:
+            # Not recorded yet, unless it replaces a chunk already received
+            return str(start) not in self.parts
+        return TRUNCATE in sink.capabilities
+
+    def _discard_chunk(self, sink, start):
+        if WRITE_AT not in sink.capabilities:
+            sink.truncate(start)
+
+    def add_part(self, start, part, tree_leaves):
+        """
+        Record a chunk written at `start` (see `write_chunk`). The offset is
+        moved to the end of the data received without gaps from the start.
+        """
+        key = str(start)
+        if key in self.parts and start < self.offset:
+            # Chunk written again: the running hash may not match any more
+            running_hashes.discard(self.upload_id)
+        self.parts[key] = part
+        for name, leaves in tree_leaves.items():
+            self.tree_leaves.setdefault(name, {}).update(leaves)
+        if start == self.offset:
+            self.offset += part['size']
+            while str(self.offset) in self.parts:
+                self.offset += self.parts[str(self.offset)]['size']
+        self._checksums = None  # Clear cached checksums
 
     def get_uploaded_file(self):
-        self.file.close()
-        self.file.open(mode='rb')  # mode = read+binary
-        return UploadedFile(file=self.file, name=self.filename,
-                            size=self.offset)
+        uploaded_file = UploadedFile(file=self.get_sink().open_file(),
+                                     name=self.filename, size=self.offset)
+        # Already computed, no need to hash the file again in `on_completion`
+        uploaded_file.checksums = self.checksums
+        # To store it elsewhere without copying the data (see `move_to`)
+        uploaded_file.chunked_upload = self
+        return uploaded_file
 
     class Meta:
         abstract = True
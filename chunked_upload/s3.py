@@ -0,0 +1,57 @@
+"""
+Amazon S3 helpers, used by `sinks.s3`. Any S3-compatible store (MinIO, Ceph
+RGW...) can be used through `CHUNKED_UPLOAD_S3_ENDPOINT_URL`.
+
+The client (thread-safe) is shared by the whole process, so the connections
+it keeps alive are reused by every chunk. A new client is built in forked
+children.
+"""
+import os
+import threading
+
+from .settings import S3_ACCESS_KEY_ID, S3_CONNECTION_POOL_SIZE, S3_ENDPOINT_URL, S3_REGION_NAME, \
+    S3_SECRET_ACCESS_KEY
+
+
+class ClientCache(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.pid = None
+        self.client = None
+
+
+_clients = ClientCache()
+
+if hasattr(os, 'register_at_fork'):
+    # Connections can't be shared with the parent process
+    os.register_at_fork(after_in_child=_clients.clear)
+
+
+def create_client():
+    import boto3
+    from botocore.config import Config
+
+    config = Config(max_pool_connections=S3_CONNECTION_POOL_SIZE)
+    return boto3.session.Session().client(
+        's3', endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION_NAME,
+        aws_access_key_id=S3_ACCESS_KEY_ID,
+        aws_secret_access_key=S3_SECRET_ACCESS_KEY, config=config)
+
+
+def get_client():
+    with _clients.lock:
+        if _clients.client is None or _clients.pid != os.getpid():
+            _clients.client = create_client()
+            _clients.pid = os.getpid()
+        return _clients.client
+
+
+def get_error_code(error):
+    """
+    Error code of a `botocore.exceptions.ClientError`.
+    """
+    return error.response.get('Error', {}).get('Code')
@@ -54,10 +54,196 @@ CONTENT_TYPE = getattr(settings, 'CHUNKED_UPLOAD_CONTENT_TYPE',
 DEFAULT_MAX_BYTES = None
 MAX_BYTES = getattr(settings, 'CHUNKED_UPLOAD_MAX_BYTES', DEFAULT_MAX_BYTES)
 
+# Link completed uploads to an identical one already stored (same digest)
+# instead of keeping a copy of the data
+DEFAULT_DEDUPLICATE = False
+DEDUPLICATE = getattr(settings, 'CHUNKED_UPLOAD_DEDUPLICATE',
+                      DEFAULT_DEDUPLICATE)
+
+# Checksum algorithms computed for an upload when the client doesn't pick any
+DEFAULT_CHECKSUM_ALGORITHMS = ('md5',)
+CHECKSUM_ALGORITHMS = getattr(settings, 'CHUNKED_UPLOAD_CHECKSUM_ALGORITHMS',
+                              DEFAULT_CHECKSUM_ALGORITHMS)
+
+# Size of the leaves of tree hashes (e.g. `sha256_tree`). Shouldn't be
+# changed while there are uploads in progress
+DEFAULT_TREE_HASH_LEAF_SIZE = 1024 * 1024
+TREE_HASH_LEAF_SIZE = getattr(settings, 'CHUNKED_UPLOAD_TREE_HASH_LEAF_SIZE',
+                              DEFAULT_TREE_HASH_LEAF_SIZE)
+
+# Chunks of at least this size (in bytes) are hashed on a separate thread
+# while being written. `None` means never
+DEFAULT_BACKGROUND_HASHING_THRESHOLD = 1024 * 1024
+BACKGROUND_HASHING_THRESHOLD = getattr(
+    settings, 'CHUNKED_UPLOAD_BACKGROUND_HASHING_THRESHOLD',
+    DEFAULT_BACKGROUND_HASHING_THRESHOLD)
+
+# Chunks are read (hashed and written) in buffers of at most this size, so
+# the memory used by a request doesn't depend on the size of its chunk
+DEFAULT_WRITE_BUFFER_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = getattr(settings, 'CHUNKED_UPLOAD_WRITE_BUFFER_SIZE',
+                            DEFAULT_WRITE_BUFFER_SIZE)
+
+# Max amount of running (incremental) hashes kept in memory per process
+DEFAULT_HASH_CACHE_SIZE = 10000
+HASH_CACHE_SIZE = getattr(settings, 'CHUNKED_UPLOAD_HASH_CACHE_SIZE',
+                          DEFAULT_HASH_CACHE_SIZE)
+
+# Files larger than this (in bytes, as declared by the `Content-Range` of
+# their first chunk) aren't preallocated by
+# `chunked_upload.sinks.local.PreallocatedFileSink`: they grow as written.
+# `None` means no limit
+DEFAULT_PREALLOCATE_MAX_SIZE = 1024 * 1024 * 1024
+PREALLOCATE_MAX_SIZE = getattr(settings, 'CHUNKED_UPLOAD_PREALLOCATE_MAX_SIZE',
+                               DEFAULT_PREALLOCATE_MAX_SIZE)
+
+# Threads deleting the data of several uploads at once, from storages that
+# can't delete them in batches
+DEFAULT_DELETE_THREADS = 8
+DELETE_THREADS = getattr(settings, 'CHUNKED_UPLOAD_DELETE_THREADS',
+                         DEFAULT_DELETE_THREADS)
+
 # determine the "null" and "blank" properties of "user" field in the "ChunkedUpload" model
 DEFAULT_MODEL_USER_FIELD_NULL = getattr(settings, 'CHUNKED_UPLOAD_MODEL_USER_FIELD_NULL', True)
 DEFAULT_MODEL_USER_FIELD_BLANK = getattr(settings, 'CHUNKED_UPLOAD_MODEL_USER_FIELD_BLANK', True)
 
+# Sink (class or dotted path) where the chunks are written. `None` means
+# `chunked_upload.sinks.azure.AzureAppendBlobSink` if `USE_AZURE_APPEND_BLOB`
+# is set, else `chunked_upload.sinks.local.LocalFileSink`
+DEFAULT_SINK_CLASS = None
+SINK_CLASS = getattr(settings, 'CHUNKED_UPLOAD_SINK_CLASS', DEFAULT_SINK_CLASS)
+
+# Sink (class or dotted path) the chunks gathered by
+# `chunked_upload.sinks.coalescing.CoalescingSink` are flushed to. `None`
+# means `AzureAppendBlobSink` if `USE_AZURE_APPEND_BLOB` is set, else
+# `LocalFileSink`
+DEFAULT_COALESCE_SINK_CLASS = None
+COALESCE_SINK_CLASS = getattr(settings, 'CHUNKED_UPLOAD_COALESCE_SINK_CLASS',
+                              DEFAULT_COALESCE_SINK_CLASS)
+
+# Chunks gathered by `CoalescingSink` are flushed once they add up to this
+# amount of bytes...
+DEFAULT_COALESCE_SIZE = 4 * 1024 * 1024
+COALESCE_SIZE = getattr(settings, 'CHUNKED_UPLOAD_COALESCE_SIZE',
+                        DEFAULT_COALESCE_SIZE)
+
+# ...or when a chunk arrives this amount of seconds after the first one
+# gathered
+DEFAULT_COALESCE_MAX_DELAY = 10
+COALESCE_MAX_DELAY = getattr(settings, 'CHUNKED_UPLOAD_COALESCE_MAX_DELAY',
+                             DEFAULT_COALESCE_MAX_DELAY)
+
+# Sink (class or dotted path) the chunks spooled by
+# `chunked_upload.sinks.writebehind.WriteBehindSink` are flushed to. `None`
+# means `AzureAppendBlobSink` if `USE_AZURE_APPEND_BLOB` is set, else
+# `LocalFileSink`
+DEFAULT_WRITE_BEHIND_SINK_CLASS = None
+WRITE_BEHIND_SINK_CLASS = getattr(settings,
+                                  'CHUNKED_UPLOAD_WRITE_BEHIND_SINK_CLASS',
+                                  DEFAULT_WRITE_BEHIND_SINK_CLASS)
+
+# Directory `WriteBehindSink` spools the chunks to (on a fast local disk).
+# `None` means a `chunked_upload` directory in the temporary directory
+DEFAULT_WRITE_BEHIND_DIR = None
+WRITE_BEHIND_DIR = getattr(settings, 'CHUNKED_UPLOAD_WRITE_BEHIND_DIR',
+                           DEFAULT_WRITE_BEHIND_DIR)
+
+# Threads of each process flushing the spools of `WriteBehindSink`
+DEFAULT_WRITE_BEHIND_THREADS = 2
+WRITE_BEHIND_THREADS = getattr(settings, 'CHUNKED_UPLOAD_WRITE_BEHIND_THREADS',
+                               DEFAULT_WRITE_BEHIND_THREADS)
+
+# Directory where `chunked_upload.sinks.memory.MemorySink` keeps the data
+# (on a tmpfs). `None` means `/dev/shm/chunked_upload` if there's a
+# `/dev/shm`, else a directory in the temporary directory
+DEFAULT_MEMORY_DIR = None
+MEMORY_DIR = getattr(settings, 'CHUNKED_UPLOAD_MEMORY_DIR', DEFAULT_MEMORY_DIR)
+
+# Max amount of bytes kept by `MemorySink` in `CHUNKED_UPLOAD_MEMORY_DIR`,
+# by all the processes of the host...
+DEFAULT_MEMORY_MAX_SIZE = 256 * 1024 * 1024
+MEMORY_MAX_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MEMORY_MAX_SIZE',
+                          DEFAULT_MEMORY_MAX_SIZE)
+
+# ...beyond which the least recently written files are spilled to this
+# directory, on disk. `None` means a directory in the temporary directory
+DEFAULT_MEMORY_SPILL_DIR = None
+MEMORY_SPILL_DIR = getattr(settings, 'CHUNKED_UPLOAD_MEMORY_SPILL_DIR',
+                           DEFAULT_MEMORY_SPILL_DIR)
+
+# Client class (or dotted path) used when `USE_AZURE_APPEND_BLOB` is set
+DEFAULT_AZURE_CLIENT_CLASS = 'azure.storage.blob.BlobServiceClient'
+AZURE_CLIENT_CLASS = getattr(settings, 'CHUNKED_UPLOAD_AZURE_CLIENT_CLASS',
+                             DEFAULT_AZURE_CLIENT_CLASS)
+
+# Client class (or dotted path) of `azure.storage.blob.aio`, used by async
+# views
+DEFAULT_AZURE_ASYNC_CLIENT_CLASS = 'azure.storage.blob.aio.BlobServiceClient'
+AZURE_ASYNC_CLIENT_CLASS = getattr(settings,
+                                   'CHUNKED_UPLOAD_AZURE_ASYNC_CLIENT_CLASS',
+                                   DEFAULT_AZURE_ASYNC_CLIENT_CLASS)
+
+# Max amount of connections kept alive to Azure by each process
+DEFAULT_AZURE_CONNECTION_POOL_SIZE = 10
+AZURE_CONNECTION_POOL_SIZE = getattr(settings,
+                                     'CHUNKED_UPLOAD_AZURE_CONNECTION_POOL_SIZE',
+                                     DEFAULT_AZURE_CONNECTION_POOL_SIZE)
+
+# Send the MD5 of each appended block, so Azure verifies it on arrival
+DEFAULT_AZURE_VALIDATE_CONTENT = True
+AZURE_VALIDATE_CONTENT = getattr(settings,
+                                 'CHUNKED_UPLOAD_AZURE_VALIDATE_CONTENT',
+                                 DEFAULT_AZURE_VALIDATE_CONTENT)
+
+# Max size of the blocks appended to Azure append blobs. Larger chunks are
+# split. Azure accepts up to 100 MiB since API version 2022-11-02, 4 MiB
+# before it
+DEFAULT_AZURE_APPEND_BLOCK_SIZE = 4 * 1024 * 1024
+AZURE_APPEND_BLOCK_SIZE = getattr(settings,
+                                  'CHUNKED_UPLOAD_AZURE_APPEND_BLOCK_SIZE',
+                                  DEFAULT_AZURE_APPEND_BLOCK_SIZE)
+
+# S3 (or S3-compatible store, e.g. MinIO) bucket used by
+# `chunked_upload.sinks.s3.S3MultipartSink`
+DEFAULT_S3_BUCKET = None
+S3_BUCKET = getattr(settings, 'CHUNKED_UPLOAD_S3_BUCKET', DEFAULT_S3_BUCKET)
+
+# Endpoint of S3-compatible stores. `None` means AWS
+DEFAULT_S3_ENDPOINT_URL = None
+S3_ENDPOINT_URL = getattr(settings, 'CHUNKED_UPLOAD_S3_ENDPOINT_URL',
+                          DEFAULT_S3_ENDPOINT_URL)
+
+DEFAULT_S3_REGION_NAME = None
+S3_REGION_NAME = getattr(settings, 'CHUNKED_UPLOAD_S3_REGION_NAME',
+                         DEFAULT_S3_REGION_NAME)
+
+# Credentials. `None` means the default ones of boto3 (environment,
+# instance profile...)
+DEFAULT_S3_ACCESS_KEY_ID = None
+S3_ACCESS_KEY_ID = getattr(settings, 'CHUNKED_UPLOAD_S3_ACCESS_KEY_ID',
+                           DEFAULT_S3_ACCESS_KEY_ID)
+DEFAULT_S3_SECRET_ACCESS_KEY = None
+S3_SECRET_ACCESS_KEY = getattr(settings, 'CHUNKED_UPLOAD_S3_SECRET_ACCESS_KEY',
+                               DEFAULT_S3_SECRET_ACCESS_KEY)
+
+# Chunks must start at a multiple of this size, which gives their part
+# number (so there can't be more than 10000 of them). S3 needs parts (but
+# the last one) of at least 5 MiB
+DEFAULT_S3_PART_SIZE = 5 * 1024 * 1024
+S3_PART_SIZE = getattr(settings, 'CHUNKED_UPLOAD_S3_PART_SIZE',
+                       DEFAULT_S3_PART_SIZE)
+
+# Max amount of connections kept alive to S3 by each process
+DEFAULT_S3_CONNECTION_POOL_SIZE = 10
+S3_CONNECTION_POOL_SIZE = getattr(settings,
+                                  'CHUNKED_UPLOAD_S3_CONNECTION_POOL_SIZE',
+                                  DEFAULT_S3_CONNECTION_POOL_SIZE)
+
+# Send the MD5 of each part, so S3 verifies it on arrival
+DEFAULT_S3_VALIDATE_CONTENT = True
+S3_VALIDATE_CONTENT = getattr(settings, 'CHUNKED_UPLOAD_S3_VALIDATE_CONTENT',
+                              DEFAULT_S3_VALIDATE_CONTENT)
+
 USE_AZURE_APPEND_BLOB = False  # Set to False in your dev environment
 AZURE_ACCOUNT_NAME = None
 AZURE_ACCOUNT_KEY = None
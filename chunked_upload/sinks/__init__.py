@@ -0,0 +1,425 @@
+"""
+Chunk sinks: where the chunks of an upload are written to.
+
+A sink is bound to an upload and writes its data under the name of its
+`file` field. The built-in sinks are `local.LocalFileSink` (a file on the
+local filesystem), `local.PreallocatedFileSink` (a preallocated file on the
+local filesystem), `azure.AzureAppendBlobSink` (an Azure append blob),
+`azure.AzureBlockBlobSink` (an Azure block blob) and `s3.S3MultipartSink`
+(an S3 multipart upload). `coalescing.CoalescingSink` gathers small chunks
+before writing them to one of them, and `writebehind.WriteBehindSink`
+writes them to one of them in the background. `memory.MemorySink` keeps
+the data in memory (a tmpfs), for short-lived uploads.
+"""
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.utils.module_loading import import_string
+
+from ..settings import DELETE_THREADS, SINK_CLASS, WRITE_BUFFER_SIZE
+
+# Capabilities a sink may have (see `BaseChunkSink.capabilities`)
+WRITE_AT = 'write_at'  # chunks can be written at any offset, in any order
+LOCAL_PATH = 'local_path'  # the data is a file on the local filesystem
+COPY_FILE = 'copy_file'  # chunks can be copied from a local file
+TRUNCATE = 'truncate'  # the data written last can be dropped
+ASYNC = 'async'  # chunks can be written from coroutines (`aopen`, `awrite`)
+
+
+class PartialWriteError(Exception):
+    """
+    Raised by `BaseChunkSink.write` when only the first `size` bytes of a
+    chunk could be stored (e.g. the storage failed after some blocks were
+    appended), and they can't be dropped. The upload keeps them, so its
+    offset matches the data stored.
+    """
+
+    def __init__(self, size):
+        super(PartialWriteError, self).__init__(size)
+        self.size = size
+
+
+class SliceReader(object):
+    """
+    Read-only file-like view of `size` bytes of `file_obj`, from `start`,
+    so part of a chunk can be streamed to the storage.
+    """
+
+    def __init__(self, file_obj, start, size):
+        self.file_obj = file_obj
+        self.start = start
+        self.size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        remaining = self.size - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if not size:
+            return b''
+        self.file_obj.seek(self.start + self._position)
+        data = self.file_obj.read(size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = max(0, min(offset, self.size))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class AsyncSliceBody(object):
+    """
+    Async iterable over `size` bytes of `file_obj` (with `async read` and
+    `seek`, see `checksums.AsyncHashingReader`), from `start`, read in
+    pieces of `WRITE_BUFFER_SIZE`. Each iteration starts over, so it can be
+    sent again (e.g. when a request is retried), or read a first time to
+    compute its MD5.
+    """
+
+    def __init__(self, file_obj, start, size):
+        self.file_obj = file_obj
+        self.start = start
+        self.size = size
+
+    async def __aiter__(self):
+        await self.file_obj.seek(self.start)
+        remaining = self.size
+        while remaining:
+            data = await self.file_obj.read(min(WRITE_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class SinkReader(object):
+    """
+    Read-only file-like object over the first `size` bytes stored by
+    `sink` (see `BaseChunkSink.read_range`).
+    """
+
+    def __init__(self, sink, size):
+        self.sink = sink
+        self.size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        remaining = self.size - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if not size:
+            return b''
+        data = self.sink.read_range(self._position, size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = max(0, min(offset, self.size))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        pass
+
+
+def get_storage_key(storage, name):
+    """
+    Key (or blob name) of `name` in the bucket of a django-storages storage,
+    which keeps its files under its `location`.
+    """
+    location = getattr(storage, 'location', '') or ''
+    return posixpath.join(location, name) if location else name
+
+
+def get_default_sink_class(sink_class=SINK_CLASS):
+    if sink_class is not None:
+        return sink_class
+    if getattr(settings, 'USE_AZURE_APPEND_BLOB', False):
+        return 'chunked_upload.sinks.azure.AzureAppendBlobSink'
+    return 'chunked_upload.sinks.local.LocalFileSink'
+
+
+def get_sink_class(sink_class=None):
+    """
+    Return the sink class for `sink_class` (a class, a dotted path or
+    `None` for the default one).
+    """
+    if sink_class is None:
+        sink_class = get_default_sink_class()
+    if isinstance(sink_class, str):
+        sink_class = import_string(sink_class)
+    return sink_class
+
+
+def get_sink_class_path(sink_class):
+    if isinstance(sink_class, str):
+        return sink_class
+    return '%s.%s' % (sink_class.__module__, sink_class.__qualname__)
+
+
+def map_in_threads(function, items):
+    """
+    Call `function` on each of `items` from a pool of
+    `CHUNKED_UPLOAD_DELETE_THREADS` threads (for storage calls that can't be
+    batched), and return the results. The first error is raised.
+    """
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(
+            max_workers=min(len(items), DELETE_THREADS)) as executor:
+        return list(executor.map(function, items))
+
+
+def delete_sinks(sinks):
+    """
+    Delete the data of several sinks, grouped by class so each group can
+    use the batch operations of its storage (see `BaseChunkSink.delete_many`).
+    """
+    by_class = {}
+    for sink in sinks:
+        by_class.setdefault(type(sink), []).append(sink)
+    for sink_class, class_sinks in by_class.items():
+        sink_class.delete_many(class_sinks)
+
+
+class BaseChunkSink(object):
+    """
+    Base class of the chunk sinks. Subclasses must implement at least
+    `append` (or `write_at`, with the `WRITE_AT` capability), `size` and
+    `delete`.
+    """
+
+    capabilities = frozenset()
+
+    def __init__(self, chunked_upload):
+        self.chunked_upload = chunked_upload
+
+    @property
+    def name(self):
+        return self.chunked_upload.file.name
+
+    def create_file(self, save=False):
+        """
+        Name the `file` field of a new upload. By default, an empty file is
+        saved to its storage, which picks the name.
+        """
+        self.chunked_upload.file.save(name='tmp', content=ContentFile(b''),
+                                      save=save)
+
+    def open_file(self):
+        """
+        Open the data of a completed upload for reading, as a Django `File`.
+        """
+        self.chunked_upload.file.close()
+        self.chunked_upload.file.open(mode='rb')  # mode = read+binary
+        return self.chunked_upload.file
+
+    def check_chunk(self, start, size, total):
+        """
+        Raise `ChunkedUploadError` if a chunk of `size` bytes can't be stored
+        at `start` of a file of `total` bytes.
+        """
+
+    def open(self, size=None):
+        """
+        Prepare the storage for a new upload. Called before writing the
+        first chunk. `size` is the size of the whole file, if known.
+        """
+
+    def write(self, offset, file_obj, size):
+        """
+        Write a chunk of `size` bytes, read from `file_obj`, at `offset` (the
+        current offset, for sinks without the `WRITE_AT` capability). It has
+        to be read in buffers of `CHUNKED_UPLOAD_WRITE_BUFFER_SIZE` bytes at
+        most, so the memory used doesn't depend on the size of the chunk. By
+        default, each buffer is passed to `append` (or `write_at`). Raises
+        `PartialWriteError` if it fails after storing part of the chunk
+        for good.
+        """
+        while True:
+            data = file_obj.read(WRITE_BUFFER_SIZE)
+            if not data:
+                break
+            if WRITE_AT in self.capabilities:
+                self.write_at(offset, data)
+            else:
+                self.append(data)
+            offset += len(data)
+
+    async def aopen(self, size=None):
+        """
+        Async version of `open`, for sinks with the `ASYNC` capability.
+        """
+
+    async def awrite(self, offset, file_obj, size):
+        """
+        Async version of `write`, for async views. Only sinks with the
+        `ASYNC` capability implement it. `file_obj` is read with
+        `await file_obj.read(size)` (see `checksums.AsyncHashingReader`), so
+        the event loop doesn't wait on the disk; other CPU bound work (e.g.
+        hashing) has to run off the loop too.
+        """
+        raise NotImplementedError
+
+    def append(self, data):
+        """
+        Write `data` right after the data already stored.
+        """
+        raise NotImplementedError
+
+    def write_at(self, offset, data):
+        """
+        Write `data` at `offset`. Only sinks with the `WRITE_AT` capability
+        implement it.
+        """
+        raise NotImplementedError
+
+    def copy_file(self, path, offset):
+        """
+        Write the content of the file at `path` at `offset` (the current
+        offset, for sinks without the `WRITE_AT` capability), without
+        reading it into Python buffers. Only sinks with the `COPY_FILE`
+        capability implement it.
+        """
+        raise NotImplementedError
+
+    def truncate(self, size):
+        """
+        Drop the data stored past `size` (e.g. a chunk that turned out to be
+        corrupted). Only sinks with the `TRUNCATE` capability implement it.
+        """
+        raise NotImplementedError
+
+    def commit_part(self, start, part, tree_leaves):
+        """
+        Called once a chunk appended at `start` has been written and
+        verified, with its `add_part` arguments. Returns the arguments of
+        the chunks stored for good, to be recorded by the upload: this one,
+        unless the sink buffers chunks (see `pending_size`), in which case
+        they're returned when flushed.
+        """
+        return [(start, part, tree_leaves)]
+
+    def pending_size(self):
+        """
+        Amount of bytes appended after the offset of the upload but not
+        stored for good yet (buffered by the sink).
+        """
+        return 0
+
+    def discard_pending(self):
+        """
+        Drop the data buffered by the sink (e.g. the client resumed from
+        the offset).
+        """
+
+    def flush(self):
+        """
+        Store the data buffered by the sink for good. Returns the arguments
+        of `add_part` for the chunks stored (see `commit_part`).
+        """
+        return []
+
+    def finalize(self):
+        """
+        Called once all the chunks have been written, before the upload is
+        completed (e.g. to commit them). The data must be readable after it.
+        """
+
+    def save_to(self, name, storage, move=True):
+        """
+        Save the data of a completed upload as `name` in `storage` (a Django
+        storage) and return the name it was saved as. If `move`, the data is
+        deleted from the sink afterwards, so it may be moved instead. Sinks
+        override it to avoid reading the data when the storage allows it
+        (e.g. a rename, or a copy done by the storage server); by default
+        it's streamed to the storage.
+        """
+        reader = SinkReader(self, self.chunked_upload.offset)
+        saved_name = storage.save(name, File(reader, name=name))
+        if move:
+            self.delete()
+        return saved_name
+
+    def size(self):
+        """
+        Amount of bytes stored.
+        """
+        raise NotImplementedError
+
+    def delete(self):
+        """
+        Delete the stored data.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def delete_many(cls, sinks):
+        """
+        Delete the data of several sinks of this class. Data already
+        missing is ignored. By default each sink is deleted from a pool of
+        threads; sinks override it to use the batch operations of their
+        storage.
+        """
+        map_in_threads(lambda sink: sink.delete(), sinks)
+
+    def local_path(self):
+        """
+        Path of the data if it's a file on the local filesystem (the sink
+        has the `LOCAL_PATH` capability), else `None`.
+        """
+        return None
+
+    def chunks(self, chunk_size=None):
+        """
+        Iterate over the stored data.
+        """
+        return self.chunked_upload.file.chunks(chunk_size=chunk_size)
+
+    def read_range(self, start, size):
+        with self.chunked_upload.file.storage.open(self.name, 'rb') as file_obj:
+            file_obj.seek(start)
+            return file_obj.read(size)
+
+    def get_stored_checksums(self):
+        """
+        Checksums of the whole data kept by the storage, if any (see
+        `store_checksums`). Returns hex digests keyed by algorithm name.
+        """
+        return {}
+
+    def store_checksums(self, checksums):
+        """
+        Keep the checksums of the whole data along with it, if the storage
+        supports it.
+        """
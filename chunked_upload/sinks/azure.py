@@ -0,0 +1,260 @@
+import asyncio
+import base64
+import hashlib
+import time
+
+from django.conf import settings
+
+from .. import azure
+from ..settings import AZURE_APPEND_BLOCK_SIZE, AZURE_VALIDATE_CONTENT
+from . import ASYNC, WRITE_AT, AsyncSliceBody, BaseChunkSink, PartialWriteError, SliceReader, get_storage_key
+
+# Max amount of blobs deleted by a batch request
+MAX_BATCH_SIZE = 256
+
+
+class AzureBlobSink(BaseChunkSink):
+    """
+    Base class of the sinks writing to an Azure blob (settings
+    `AZURE_ACCOUNT_NAME`, `AZURE_ACCOUNT_KEY` and `AZURE_MEDIA_CONTAINER`).
+    Chunks can be written from async views too, with the clients of
+    `azure.storage.blob.aio`.
+    """
+
+    capabilities = frozenset([ASYNC])
+
+    def get_blob_client(self):
+        return azure.get_blob_client(self.name)
+
+    def get_async_blob_client(self):
+        return azure.get_async_blob_client(self.name)
+
+    @staticmethod
+    async def _ablock(file_obj, start, length):
+        """
+        Body streaming `length` bytes of `file_obj` from `start`, for
+        `awrite`, along with the arguments sending their MD5. The MD5 is
+        computed off the event loop, in a first pass over the data (with
+        `validate_content`, the client would read the whole block in memory,
+        and hash it on the loop).
+        """
+        body = AsyncSliceBody(file_obj, start, length)
+        kwargs = {}
+        if AZURE_VALIDATE_CONTENT:
+            md5 = hashlib.md5()
+            loop = asyncio.get_running_loop()
+            async for data in body:
+                await loop.run_in_executor(None, md5.update, data)
+            kwargs['transactional_content_md5'] = md5.digest()
+        return body, kwargs
+
+    def size(self):
+        return self.get_blob_client().get_blob_properties().size
+
+    def delete(self):
+        self.get_blob_client().delete_blob()
+
+    @classmethod
+    def delete_many(cls, sinks):
+        from azure.core.exceptions import HttpResponseError
+
+        # Blob batch requests (uncommitted blocks are garbage collected)
+        container_client = azure.get_container_client()
+        names = [sink.name for sink in sinks]
+        for i in range(0, len(names), MAX_BATCH_SIZE):
+            batch = names[i:i + MAX_BATCH_SIZE]
+            responses = container_client.delete_blobs(
+                *batch, raise_on_any_failure=False)
+            for name, response in zip(batch, responses):
+                if response.status_code not in (202, 404):
+                    raise HttpResponseError(
+                        'Delete of %s failed: %s %s' % (
+                            name, response.status_code, response.reason))
+
+    def chunks(self, chunk_size=None):
+        return self.get_blob_client().download_blob().chunks()
+
+    def read_range(self, start, size):
+        return self.get_blob_client().download_blob(
+            offset=start, length=size).readall()
+
+    def get_stored_checksums(self):
+        properties = self.get_blob_client().get_blob_properties()
+        content_md5 = properties.content_settings.content_md5
+        if content_md5 and properties.size == self.chunked_upload.offset:
+            return {'md5': bytes(content_md5).hex()}
+        return {}
+
+    def save_to(self, name, storage, move=True):
+        # A django-storages `AzureStorage` on the same container: the blob
+        # is copied by Azure (synchronously, within an account)
+        if getattr(storage, 'account_name', None) != \
+                settings.AZURE_ACCOUNT_NAME or \
+                getattr(storage, 'azure_container', None) != \
+                settings.AZURE_MEDIA_CONTAINER:
+            return super(AzureBlobSink, self).save_to(name, storage, move)
+        name = storage.get_available_name(name)
+        blob_client = azure.get_blob_client(get_storage_key(storage, name))
+        status = blob_client.start_copy_from_url(
+            self.get_blob_client().url)['copy_status']
+        while status == 'pending':
+            time.sleep(1)
+            status = blob_client.get_blob_properties().copy.status
+        if status != 'success':
+            from azure.core.exceptions import HttpResponseError
+
+            raise HttpResponseError('Copy of %s %s' % (self.name, status))
+        if move:
+            self.delete()
+        return name
+
+    def store_checksums(self, checksums):
+        if 'md5' not in checksums:
+            return
+        from azure.storage.blob import ContentSettings
+
+        content_settings = ContentSettings(
+            content_md5=bytearray.fromhex(checksums['md5']))
+        self.get_blob_client().set_http_headers(
+            content_settings=content_settings)
+
+
+class AzureAppendBlobSink(AzureBlobSink):
+    """
+    Appends the chunks to an Azure append blob. Chunks larger than
+    `CHUNKED_UPLOAD_AZURE_APPEND_BLOCK_SIZE` are split in blocks of that
+    size, streamed from the chunk.
+    """
+
+    def open(self, size=None):
+        # Replaces any blob already there, whatever its type, so new uploads
+        # start from a clean slate in a single request
+        self.get_blob_client().create_append_blob()
+
+    async def aopen(self, size=None):
+        await self.get_async_blob_client().create_append_blob()
+
+    def write(self, offset, file_obj, size):
+        from azure.core.exceptions import AzureError
+
+        blob_client = self.get_blob_client()
+        for position in range(offset, offset + size, AZURE_APPEND_BLOCK_SIZE):
+            length = min(AZURE_APPEND_BLOCK_SIZE, offset + size - position)
+            try:
+                self._append_block(blob_client, SliceReader(
+                    file_obj, position - offset, length), length, position)
+            except AzureError as error:
+                # It may have been stored by an attempt whose reply was lost
+                try:
+                    appended = blob_client.get_blob_properties().size == \
+                        position + length
+                except AzureError:
+                    appended = False
+                if not appended:
+                    self._raise_write_error(error, position - offset)
+
+    async def awrite(self, offset, file_obj, size):
+        from azure.core.exceptions import AzureError
+
+        blob_client = self.get_async_blob_client()
+        for position in range(offset, offset + size, AZURE_APPEND_BLOCK_SIZE):
+            length = min(AZURE_APPEND_BLOCK_SIZE, offset + size - position)
+            body, kwargs = await self._ablock(file_obj, position - offset,
+                                              length)
+            try:
+                await blob_client.append_block(
+                    body, length=length, appendpos_condition=position,
+                    **kwargs)
+            except AzureError as error:
+                try:
+                    appended = (await blob_client.get_blob_properties(
+                    )).size == position + length
+                except AzureError:
+                    appended = False
+                if not appended:
+                    self._raise_write_error(error, position - offset)
+
+    def append(self, data):
+        # Azure verifies the block against its MD5 (sent along with it)
+        self.get_blob_client().append_block(
+            data, validate_content=AZURE_VALIDATE_CONTENT)
+
+    @staticmethod
+    def _append_block(blob_client, data, length, position):
+        # Azure verifies the block against its MD5 (sent along with it). It's
+        # only appended at `position`, so a block sent again (e.g. retried
+        # after a timeout) can't be stored twice
+        return blob_client.append_block(
+            data, length=length, appendpos_condition=position,
+            validate_content=AZURE_VALIDATE_CONTENT)
+
+    @staticmethod
+    def _raise_write_error(error, written):
+        if written:
+            # Append blobs can't be truncated: the blocks appended are kept
+            raise PartialWriteError(written) from error
+        raise error
+
+
+class AzureBlockBlobSink(AzureBlobSink):
+    """
+    Stages each chunk as a block of an Azure block blob, so chunks can be
+    sent in any order and in parallel. The blocks are committed, in the
+    order of their offsets, when the upload is completed.
+    """
+
+    capabilities = frozenset([WRITE_AT, ASYNC])
+
+    @staticmethod
+    def get_block_id(start):
+        # Block ids of a blob must all have the same length
+        return base64.b64encode(b'%020d' % start).decode('ascii')
+
+    def write(self, offset, file_obj, size):
+        # Streamed from the file, as a single block
+        self.get_blob_client().stage_block(
+            self.get_block_id(offset), file_obj, length=size,
+            validate_content=AZURE_VALIDATE_CONTENT)
+
+    async def awrite(self, offset, file_obj, size):
+        # Streamed from the file, as a single block
+        body, kwargs = await self._ablock(file_obj, 0, size)
+        await self.get_async_blob_client().stage_block(
+            self.get_block_id(offset), body, length=size, **kwargs)
+
+    def write_at(self, offset, data):
+        self.get_blob_client().stage_block(
+            self.get_block_id(offset), data,
+            validate_content=AZURE_VALIDATE_CONTENT)
+
+    def finalize(self):
+        from azure.storage.blob import BlobBlock
+
+        starts = sorted(int(start) for start in self.chunked_upload.parts)
+        self.get_blob_client().commit_block_list(
+            [BlobBlock(block_id=self.get_block_id(start)) for start in starts])
+
+    def size(self):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return super(AzureBlockBlobSink, self).size()
+        except ResourceNotFoundError:
+            return 0  # blocks not committed yet
+
+    def get_stored_checksums(self):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return super(AzureBlockBlobSink, self).get_stored_checksums()
+        except ResourceNotFoundError:
+            return {}
+
+    def delete(self):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        # Uncommitted blocks are garbage collected by Azure
+        try:
+            super(AzureBlockBlobSink, self).delete()
+        except ResourceNotFoundError:
+            pass
@@ -0,0 +1,251 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from ..checksums import COMBINABLE_ALGORITHMS, crc_combine
+from ..settings import COALESCE_MAX_DELAY, COALESCE_SINK_CLASS, COALESCE_SIZE, EXPIRATION_DELTA, WRITE_BUFFER_SIZE
+from . import TRUNCATE, BaseChunkSink, PartialWriteError, delete_sinks, get_default_sink_class, get_sink_class, \
+    get_sink_class_path
+
+
+def merge_parts(parts):
+    """
+    Merge the `add_part` arguments of consecutive chunks into those of a
+    single part covering them all (the sink stores them at once: a sink
+    writing at any offset has one part, or block, for them).
+    """
+    start, merged, merged_leaves = parts[0]
+    merged = dict(merged)
+    merged_leaves = dict((name, dict(leaves))
+                         for name, leaves in merged_leaves.items())
+    for _, part, tree_leaves in parts[1:]:
+        for name, polynomial in COMBINABLE_ALGORITHMS.items():
+            if name in merged:
+                merged[name] = '%08x' % crc_combine(
+                    polynomial, int(merged[name], 16), int(part[name], 16),
+                    part['size'])
+        merged['size'] += part['size']
+        for name, leaves in tree_leaves.items():
+            merged_leaves.setdefault(name, {}).update(leaves)
+    return [(start, merged, merged_leaves)]
+
+
+class Spool(object):
+    """
+    Chunks of an upload gathered from `start`: their data, in a temporary
+    file, and the `add_part` arguments of each one.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.file = tempfile.TemporaryFile()
+        self.size = 0  # of the chunks committed
+        self.parts = []
+        self.created = self.used = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+
+class SpoolCache(object):
+    """
+    Process-wide store of the spools, keyed by upload id. As the running
+    hashes (`checksums.RunningHashCache`), the chunks gathered by a process
+    can only be flushed by it. Spools unused for `max_age` seconds (e.g.
+    abandoned uploads) are dropped.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._spools = {}
+        self._lock = threading.Lock()
+
+    def get(self, upload_id):
+        with self._lock:
+            return self._spools.get(upload_id)
+
+    def put(self, upload_id, spool):
+        now = time.monotonic()
+        with self._lock:
+            dropped = [self._spools.pop(key) for key, value in
+                       list(self._spools.items())
+                       if key == upload_id or now - value.used > self.max_age]
+            self._spools[upload_id] = spool
+        for old in dropped:
+            old.close()
+
+    def pop(self, upload_id):
+        with self._lock:
+            return self._spools.pop(upload_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._spools.clear()
+
+
+spools = SpoolCache(EXPIRATION_DELTA.total_seconds())
+
+if hasattr(os, 'register_at_fork'):
+    # The temporary files can't be shared with the parent process
+    os.register_at_fork(after_in_child=spools.clear)
+
+
+class CoalescingSink(BaseChunkSink):
+    """
+    Gathers consecutive chunks in a local temporary file, and writes them at
+    once to another sink (`CHUNKED_UPLOAD_COALESCE_SINK_CLASS`) when they add
+    up to `CHUNKED_UPLOAD_COALESCE_SIZE` bytes, when a chunk arrives
+    `CHUNKED_UPLOAD_COALESCE_MAX_DELAY` seconds after the first one, or when
+    the upload is completed. Many small chunks then cost a single write to
+    the storage, and a single save of the upload.
+
+    The offset of the upload only moves once the chunks are flushed. The
+    chunks gathered are kept by the process that received them, so the
+    following ones must reach the same process (e.g. sticky sessions);
+    otherwise the client is told to resume from the offset.
+    """
+
+    capabilities = frozenset([TRUNCATE])
+
+    def __init__(self, chunked_upload):
+        super(CoalescingSink, self).__init__(chunked_upload)
+        self._sink = None
+
+    @property
+    def sink(self):
+        """
+        Sink the chunks are flushed to.
+        """
+        if self._sink is None:
+            state = self.chunked_upload.sink_state
+            if not state.get('coalesced_sink_class_path'):
+                # Keep using the same sink even if the settings change
+                state['coalesced_sink_class_path'] = get_sink_class_path(
+                    get_sink_class(get_default_sink_class(COALESCE_SINK_CLASS)))
+            self._sink = get_sink_class(
+                state['coalesced_sink_class_path'])(self.chunked_upload)
+        return self._sink
+
+    def _get_spool(self):
+        spool = spools.get(self.chunked_upload.upload_id)
+        if spool is not None and spool.start != self.chunked_upload.offset:
+            # The offset moved in another process, where these chunks were
+            # sent again
+            self.discard_pending()
+            return None
+        return spool
+
+    def create_file(self, save=False):
+        self.sink.create_file(save=save)
+
+    def open_file(self):
+        return self.sink.open_file()
+
+    def check_chunk(self, start, size, total):
+        self.sink.check_chunk(start, size, total)
+
+    def open(self, size=None):
+        self.sink.open(size=size)
+
+    def write(self, offset, file_obj, size):
+        spool = self._get_spool()
+        if spool is None:
+            spool = Spool(offset)
+            spools.put(self.chunked_upload.upload_id, spool)
+        # Drop any chunk written but not committed
+        spool.file.seek(spool.size)
+        spool.file.truncate()
+        shutil.copyfileobj(file_obj, spool.file, WRITE_BUFFER_SIZE)
+        spool.used = time.monotonic()
+
+    def truncate(self, size):
+        spool = self._get_spool()
+        if spool is not None:
+            spool.file.truncate(max(size - spool.start, spool.size))
+
+    def commit_part(self, start, part, tree_leaves):
+        spool = self._get_spool()
+        spool.parts.append((start, part, tree_leaves))
+        spool.size = start + part['size'] - spool.start
+        if spool.size >= COALESCE_SIZE or \
+                time.monotonic() - spool.created >= COALESCE_MAX_DELAY:
+            return self.flush()
+        return []
+
+    def pending_size(self):
+        spool = self._get_spool()
+        return spool.size if spool is not None else 0
+
+    def discard_pending(self):
+        spool = spools.pop(self.chunked_upload.upload_id)
+        if spool is not None:
+            spool.close()
+
+    def flush(self):
+        spool = spools.pop(self.chunked_upload.upload_id)
+        if spool is None:
+            return []
+        try:
+            if spool.start != self.chunked_upload.offset or not spool.size:
+                return []
+            spool.file.truncate(spool.size)
+            spool.file.seek(0)
+            try:
+                self.sink.write(spool.start, spool.file, spool.size)
+            except PartialWriteError as error:
+                error.parts = self._get_stored_parts(spool, error.size)
+                raise
+        finally:
+            spool.close()
+        return merge_parts(spool.parts)
+
+    def _get_stored_parts(self, spool, size):
+        """
+        `add_part` arguments of the first `size` bytes of `spool`.
+        """
+        end = spool.start + size
+        parts = []
+        for start, part, tree_leaves in spool.parts:
+            if start + part['size'] <= end:
+                parts.append((start, part, tree_leaves))
+            elif start < end:
+                spool.file.seek(start - spool.start)
+                parts.append(self.chunked_upload.hash_part(
+                    spool.file, start, end - start))
+        return merge_parts(parts)
+
+    def finalize(self):
+        self.sink.finalize()
+
+    def size(self):
+        return self.sink.size()
+
+    def delete(self):
+        self.discard_pending()
+        self.sink.delete()
+
+    @classmethod
+    def delete_many(cls, sinks):
+        for sink in sinks:
+            sink.discard_pending()
+        delete_sinks([sink.sink for sink in sinks])
+
+    def local_path(self):
+        return self.sink.local_path()
+
+    def chunks(self, chunk_size=None):
+        return self.sink.chunks(chunk_size=chunk_size)
+
+    def read_range(self, start, size):
+        return self.sink.read_range(start, size)
+
+    def save_to(self, name, storage, move=True):
+        return self.sink.save_to(name, storage, move)
+
+    def get_stored_checksums(self):
+        return self.sink.get_stored_checksums()
+
+    def store_checksums(self, checksums):
+        self.sink.store_checksums(checksums)
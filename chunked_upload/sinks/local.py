@@ -0,0 +1,197 @@
+import errno
+import os
+import shutil
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from ..settings import PREALLOCATE_MAX_SIZE, WRITE_BUFFER_SIZE
+from . import BaseChunkSink, COPY_FILE, LOCAL_PATH, TRUNCATE, WRITE_AT
+
+
+def pwrite_all(fd, data, offset):
+    """
+    Write the whole `data` at `offset` of `fd` (`os.pwrite` may write only
+    part of it).
+    """
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def copy_file_data(src_path, dst_fd, offset):
+    """
+    Copy the content of the file at `src_path` at `offset` of `dst_fd`. The
+    kernel copies it when possible (`copy_file_range`, which may even share
+    the extents on filesystems supporting reflinks, else `sendfile`), so
+    the data doesn't go through user space.
+    """
+    with open(src_path, 'rb') as src:
+        src_fd = src.fileno()
+        size = os.fstat(src_fd).st_size
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    count = os.copy_file_range(src_fd, dst_fd, size - copied,
+                                               copied, offset + copied)
+                    if not count:
+                        break
+                    copied += count
+            except OSError as error:
+                # e.g. different filesystems on older kernels
+                if error.errno not in (errno.EXDEV, errno.ENOSYS,
+                                       errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        if copied < size and hasattr(os, 'sendfile'):
+            os.lseek(dst_fd, offset + copied, os.SEEK_SET)
+            try:
+                while copied < size:
+                    count = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                    if not count:
+                        break
+                    copied += count
+            except OSError as error:
+                if error.errno not in (errno.ENOSYS, errno.EINVAL):
+                    raise
+        while copied < size:
+            data = os.pread(src_fd, min(WRITE_BUFFER_SIZE, size - copied),
+                            copied)
+            if not data:
+                break
+            pwrite_all(dst_fd, data, offset + copied)
+            copied += len(data)
+
+
+class LocalFileSink(BaseChunkSink):
+    """
+    Appends the chunks to a file on the local filesystem. The storage of
+    the `file` field must support paths (e.g. `FileSystemStorage`).
+    """
+
+    capabilities = frozenset([LOCAL_PATH, COPY_FILE, TRUNCATE])
+
+    @property
+    def path(self):
+        return self.chunked_upload.file.path
+
+    def write(self, offset, file_obj, size):
+        self.chunked_upload.file.close()
+        with open(self.path, mode='ab') as dst:
+            shutil.copyfileobj(file_obj, dst, WRITE_BUFFER_SIZE)
+
+    def append(self, data):
+        self.chunked_upload.file.close()
+        with open(self.path, mode='ab') as file_obj:
+            file_obj.write(data)
+
+    def truncate(self, size):
+        self.chunked_upload.file.close()
+        os.truncate(self.path, size)
+
+    def copy_file(self, path, offset):
+        self.chunked_upload.file.close()
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            copy_file_data(path, fd, offset)
+        finally:
+            os.close(fd)
+
+    def save_to(self, name, storage, move=True):
+        self.chunked_upload.file.close()
+        if not isinstance(storage, FileSystemStorage):
+            # Not on the local filesystem: streamed from the file
+            with open(self.path, 'rb') as file_obj:
+                name = storage.save(name, File(file_obj, name=name))
+            if move:
+                self.delete()
+            return name
+        name = storage.get_available_name(name)
+        dst_path = storage.path(name)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            # The new name shares the data: nothing is copied
+            os.link(self.path, dst_path)
+        except FileExistsError:
+            # Taken in the meantime
+            return super(LocalFileSink, self).save_to(name, storage, move)
+        except OSError:
+            # e.g. another filesystem: copied by the kernel
+            fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o666)
+            try:
+                copy_file_data(self.path, fd, 0)
+            finally:
+                os.close(fd)
+        mode = getattr(storage, 'file_permissions_mode', None)
+        if mode is not None:
+            os.chmod(dst_path, mode)
+        if move:
+            os.unlink(self.path)
+        return name
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def delete(self):
+        self.chunked_upload.file.close()
+        self.chunked_upload.file.storage.delete(self.name)
+
+    def local_path(self):
+        return self.path
+
+
+class PreallocatedFileSink(LocalFileSink):
+    """
+    Writes each chunk at its offset in a file on the local filesystem
+    (`os.pwrite`), so chunks can be sent in any order and in parallel. The
+    whole file is allocated with the first chunk when its size is known (up
+    to `CHUNKED_UPLOAD_PREALLOCATE_MAX_SIZE`), so it's laid out contiguously
+    on disk instead of growing chunk by chunk.
+    """
+
+    capabilities = frozenset([WRITE_AT, LOCAL_PATH, COPY_FILE])
+
+    def open(self, size=None):
+        self.chunked_upload.file.close()
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            # The size is declared by the client: a larger file isn't
+            # allocated before its data is received
+            if size and hasattr(os, 'posix_fallocate') and (
+                    PREALLOCATE_MAX_SIZE is None or
+                    size <= PREALLOCATE_MAX_SIZE):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    pass  # Not supported by the filesystem: grow as written
+        finally:
+            os.close(fd)
+
+    def write(self, offset, file_obj, size):
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            while True:
+                data = file_obj.read(WRITE_BUFFER_SIZE)
+                if not data:
+                    break
+                pwrite_all(fd, data, offset)
+                offset += len(data)
+        finally:
+            os.close(fd)
+
+    def append(self, data):
+        self.write_at(self.chunked_upload.offset, data)
+
+    def write_at(self, offset, data):
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            pwrite_all(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def finalize(self):
+        # Drop the space allocated past the data received
+        os.truncate(self.path, self.chunked_upload.offset)
@@ -0,0 +1,231 @@
+import fcntl
+import io
+import os
+import tempfile
+
+from django.core.files import File
+
+from ..settings import MEMORY_DIR, MEMORY_MAX_SIZE, MEMORY_SPILL_DIR, WRITE_BUFFER_SIZE
+from . import LOCAL_PATH, TRUNCATE
+from .local import LocalFileSink, copy_file_data, pwrite_all
+
+
+def get_memory_dir():
+    if MEMORY_DIR is not None:
+        return MEMORY_DIR
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/chunked_upload'
+    return os.path.join(tempfile.gettempdir(), 'chunked_upload_memory')
+
+
+def get_spill_dir():
+    if MEMORY_SPILL_DIR is not None:
+        return MEMORY_SPILL_DIR
+    return os.path.join(tempfile.gettempdir(), 'chunked_upload_spill')
+
+
+def _lock(path, create=True):
+    """
+    Open `path` (created if needed, if `create`) and lock it with `flock`.
+    Returns the file descriptor, to close once done.
+    """
+    if create:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    else:
+        fd = os.open(path, os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _spill(memory_path, spill_path):
+    """
+    Move a file from memory to disk, unless it's being written. Returns
+    whether it was moved.
+    """
+    try:
+        fd = os.open(memory_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        if os.fstat(fd).st_nlink == 0:
+            return False  # spilled or deleted meanwhile
+        os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+        tmp_path = spill_path + '.spilling'
+        dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+        try:
+            copy_file_data(memory_path, dst_fd, 0)
+        finally:
+            os.close(dst_fd)
+        os.replace(tmp_path, spill_path)
+        # Writers waiting for the lock see the file is gone, and go to disk
+        os.unlink(memory_path)
+        return True
+    finally:
+        os.close(fd)
+
+
+def make_room(size, exclude=None):
+    """
+    Spill the least recently written files from memory to disk until `size`
+    more bytes fit in `CHUNKED_UPLOAD_MEMORY_MAX_SIZE`. Files being written
+    and `exclude` are kept. Returns whether there's room.
+    """
+    memory_dir = get_memory_dir()
+    # A single process of the host spills at once
+    lock_fd = _lock(os.path.join(memory_dir, '.lock'))
+    try:
+        files = []
+        used = 0
+        for dir_path, dir_names, file_names in os.walk(memory_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if file_name == '.lock':
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                used += stat.st_size
+                if path != exclude:
+                    files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        for mtime, path, file_size in files:
+            if used + size <= MEMORY_MAX_SIZE:
+                break
+            spill_path = os.path.join(get_spill_dir(),
+                                      os.path.relpath(path, memory_dir))
+            if _spill(path, spill_path):
+                used -= file_size
+        return used + size <= MEMORY_MAX_SIZE
+    finally:
+        os.close(lock_fd)
+
+
+class MemorySink(LocalFileSink):
+    """
+    Keeps the data in memory: files in a tmpfs directory
+    (`CHUNKED_UPLOAD_MEMORY_DIR`, `/dev/shm` by default), shared by the
+    processes of the host, for short-lived uploads consumed by
+    `on_completion`. When they take more than
+    `CHUNKED_UPLOAD_MEMORY_MAX_SIZE`, the least recently written ones are
+    spilled to disk (`CHUNKED_UPLOAD_MEMORY_SPILL_DIR`). The storage of the
+    `file` field is only used to name the upload, and by `move_to`.
+
+    All the chunks, and the completion, must reach the same host.
+    """
+
+    capabilities = frozenset([LOCAL_PATH, TRUNCATE])
+
+    @property
+    def memory_path(self):
+        return os.path.join(get_memory_dir(), self.name)
+
+    @property
+    def spill_path(self):
+        return os.path.join(get_spill_dir(), self.name)
+
+    @property
+    def path(self):
+        if os.path.exists(self.memory_path):
+            return self.memory_path
+        if os.path.exists(self.spill_path):
+            return self.spill_path
+        return self.memory_path
+
+    def create_file(self, save=False):
+        # Named as by the storage, without creating anything in it
+        self.chunked_upload.file.name = \
+            self.chunked_upload.file.field.generate_filename(
+                self.chunked_upload, 'tmp')
+        if save:
+            self.chunked_upload.save()
+
+    def _open(self, mode='rb'):
+        # Spilled to disk between the lookup and the opening
+        try:
+            return open(self.path, mode)
+        except FileNotFoundError:
+            return open(self.path, mode)
+
+    def open_file(self):
+        return File(self._open(), name=self.name)
+
+    def _lock_data(self, path, create=False):
+        """
+        Open and lock the file at `path`, or on disk if it was spilled
+        meanwhile. Returns the file descriptor, to close once done.
+        """
+        try:
+            fd = _lock(path, create=create)
+        except FileNotFoundError:
+            fd = None
+        if fd is not None:
+            if os.fstat(fd).st_nlink:
+                return fd
+            os.close(fd)
+        return _lock(self.spill_path, create=create)
+
+    def write(self, offset, file_obj, size):
+        path = self.path
+        if path == self.memory_path and not make_room(size, exclude=path):
+            # Doesn't fit in memory, even alone
+            _spill(path, self.spill_path)
+            path = self.spill_path
+        # Created with the first chunk only: the file could have been
+        # spilled since the lookup
+        fd = self._lock_data(path, create=not offset)
+        try:
+            while True:
+                data = file_obj.read(WRITE_BUFFER_SIZE)
+                if not data:
+                    break
+                pwrite_all(fd, data, offset)
+                offset += len(data)
+        finally:
+            os.close(fd)
+
+    def append(self, data):
+        self.write(self.chunked_upload.offset, io.BytesIO(data), len(data))
+
+    def truncate(self, size):
+        fd = self._lock_data(self.path)
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def delete(self):
+        for path in (self.memory_path, self.spill_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def chunks(self, chunk_size=None):
+        with self._open() as file_obj:
+            while True:
+                data = file_obj.read(chunk_size or WRITE_BUFFER_SIZE)
+                if not data:
+                    break
+                yield data
+
+    def read_range(self, start, size):
+        with self._open() as file_obj:
+            file_obj.seek(start)
+            return file_obj.read(size)
@@ -0,0 +1,255 @@
+import base64
+import hashlib
+
+from .. import s3
+from ..constants import COMPLETE, http_status
+from ..exceptions import ChunkedUploadError
+from ..settings import S3_BUCKET, S3_ENDPOINT_URL, S3_PART_SIZE, S3_VALIDATE_CONTENT, WRITE_BUFFER_SIZE
+from . import WRITE_AT, BaseChunkSink, get_storage_key, map_in_threads
+
+# Limits of S3 multipart uploads
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+# Max amount of objects deleted by a DeleteObjects request
+MAX_DELETE_OBJECTS = 1000
+
+
+class S3MultipartSink(BaseChunkSink):
+    """
+    Uploads each chunk as a part of an S3 multipart upload (settings
+    `CHUNKED_UPLOAD_S3_*`), completed along with the chunked upload. The
+    part number of a chunk is given by its offset (see
+    `CHUNKED_UPLOAD_S3_PART_SIZE`), so chunks can be sent in any order and
+    in parallel.
+    """
+
+    capabilities = frozenset([WRITE_AT])
+
+    @property
+    def bucket(self):
+        return S3_BUCKET
+
+    @property
+    def multipart_upload_id(self):
+        return self.chunked_upload.sink_state.get('multipart_upload_id')
+
+    def get_client(self):
+        return s3.get_client()
+
+    def get_part_number(self, start):
+        return start // S3_PART_SIZE + 1
+
+    def check_chunk(self, start, size, total):
+        if start % S3_PART_SIZE:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail='Chunks must start at a multiple of %d bytes'
+                       % S3_PART_SIZE)
+        if size < MIN_PART_SIZE and start + size < total:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail='Chunks (but the last one) must have at least %d bytes'
+                       % MIN_PART_SIZE)
+        if self.get_part_number(start) > MAX_PARTS:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail='Too many chunks: the file has to be sent in chunks of '
+                       'more than %d bytes' % S3_PART_SIZE)
+
+    def open(self, size=None):
+        response = self.get_client().create_multipart_upload(
+            Bucket=self.bucket, Key=self.name)
+        # Saved with the upload, which is saved once the chunk is written
+        self.chunked_upload.sink_state['multipart_upload_id'] = \
+            response['UploadId']
+
+    def write(self, offset, file_obj, size):
+        kwargs = {}
+        if S3_VALIDATE_CONTENT:
+            digest = getattr(file_obj, 'md5_digest', None)
+            if digest is None:
+                # Parts are spooled to disk by Django (they have at least
+                # 5 MiB): read twice, unless its MD5 was computed meanwhile
+                # (see `handlers.MD5TemporaryFileUploadHandler`)
+                md5 = hashlib.md5()
+                while True:
+                    data = file_obj.read(WRITE_BUFFER_SIZE)
+                    if not data:
+                        break
+                    md5.update(data)
+                file_obj.seek(0)
+                digest = md5.digest()
+            kwargs['ContentMD5'] = base64.b64encode(digest).decode('ascii')
+        # Streamed from the file (which can be read again on retries)
+        self.upload_part(offset, file_obj, ContentLength=size, **kwargs)
+
+    def write_at(self, offset, data):
+        kwargs = {}
+        if S3_VALIDATE_CONTENT:
+            kwargs['ContentMD5'] = base64.b64encode(
+                hashlib.md5(data).digest()).decode('ascii')
+        self.upload_part(offset, data, **kwargs)
+
+    def upload_part(self, offset, body, **kwargs):
+        from botocore.exceptions import ClientError
+
+        # S3 verifies the part against its MD5, if sent along with it
+        try:
+            self._upload_part(offset, body, **kwargs)
+        except ClientError as e:
+            if s3.get_error_code(e) != 'NoSuchUpload' or not self.reopen():
+                raise
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            self._upload_part(offset, body, **kwargs)
+
+    def _upload_part(self, offset, body, **kwargs):
+        self.get_client().upload_part(
+            Bucket=self.bucket, Key=self.name, Body=body,
+            UploadId=self.multipart_upload_id,
+            PartNumber=self.get_part_number(offset), **kwargs)
+
+    def reopen(self):
+        """
+        Start a new multipart upload from the object completed already (e.g.
+        its checksums didn't match: chunks are sent again), its parts copied
+        by S3. Returns whether the upload could be reopened.
+        """
+        from django.db import transaction
+
+        chunked_upload = self.chunked_upload
+        # Chunks may be sent again in parallel: the first one reopens it
+        with transaction.atomic():
+            row = type(chunked_upload)._default_manager.select_for_update(
+            ).get(pk=chunked_upload.pk)
+            upload_id = row.sink_state.get('multipart_upload_id')
+            if upload_id == self.multipart_upload_id:
+                if not self.size():
+                    return False  # Not completed: aborted
+                upload_id = self.get_client().create_multipart_upload(
+                    Bucket=self.bucket, Key=self.name)['UploadId']
+                map_in_threads(
+                    lambda item: self._copy_part(upload_id, *item),
+                    [(int(start), part['size'])
+                     for start, part in row.parts.items()])
+                row.sink_state['multipart_upload_id'] = upload_id
+                type(row)._default_manager.filter(pk=row.pk).update(
+                    sink_state=row.sink_state)
+        chunked_upload.sink_state['multipart_upload_id'] = upload_id
+        return True
+
+    def _copy_part(self, upload_id, start, size):
+        self.get_client().upload_part_copy(
+            Bucket=self.bucket, Key=self.name, UploadId=upload_id,
+            PartNumber=self.get_part_number(start),
+            CopySource={'Bucket': self.bucket, 'Key': self.name},
+            CopySourceRange='bytes=%d-%d' % (start, start + size - 1))
+
+    def _list_parts(self):
+        paginator = self.get_client().get_paginator('list_parts')
+        pages = paginator.paginate(Bucket=self.bucket, Key=self.name,
+                                   UploadId=self.multipart_upload_id)
+        etags = {}
+        for page in pages:
+            for part in page.get('Parts', []):
+                etags[part['PartNumber']] = part['ETag']
+        return etags
+
+    def finalize(self):
+        from botocore.exceptions import ClientError
+
+        try:
+            etags = self._list_parts()
+        except ClientError as e:
+            if s3.get_error_code(e) == 'NoSuchUpload' and \
+                    self.size() == self.chunked_upload.offset:
+                return  # Completed already
+            raise
+        numbers = sorted(self.get_part_number(int(start))
+                         for start in self.chunked_upload.parts)
+        self.get_client().complete_multipart_upload(
+            Bucket=self.bucket, Key=self.name,
+            UploadId=self.multipart_upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number,
+                                        'ETag': etags[number]}
+                                       for number in numbers]})
+
+    def size(self):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.get_client().head_object(Bucket=self.bucket,
+                                                      Key=self.name)
+        except ClientError as e:
+            if s3.get_error_code(e) in ('404', 'NoSuchKey'):
+                return 0  # Parts not completed yet
+            raise
+        return response['ContentLength']
+
+    def save_to(self, name, storage, move=True):
+        # A django-storages `S3Storage` on the same endpoint: the object is
+        # copied by S3 (in parts, for large objects)
+        if getattr(storage, 'bucket_name', None) is None or \
+                getattr(storage, 'endpoint_url', None) != S3_ENDPOINT_URL:
+            return super(S3MultipartSink, self).save_to(name, storage, move)
+        name = storage.get_available_name(name)
+        self.get_client().copy({'Bucket': self.bucket, 'Key': self.name},
+                               storage.bucket_name,
+                               get_storage_key(storage, name))
+        if move:
+            self.delete()
+        return name
+
+    def abort(self):
+        """
+        Drop the parts of a multipart upload that wasn't completed.
+        """
+        from botocore.exceptions import ClientError
+
+        if self.multipart_upload_id is None:
+            return
+        try:
+            self.get_client().abort_multipart_upload(
+                Bucket=self.bucket, Key=self.name,
+                UploadId=self.multipart_upload_id)
+        except ClientError as e:
+            if s3.get_error_code(e) != 'NoSuchUpload':
+                raise
+
+    def delete(self):
+        self.abort()
+        self.get_client().delete_object(Bucket=self.bucket, Key=self.name)
+
+    @classmethod
+    def delete_many(cls, sinks):
+        from botocore.exceptions import ClientError
+
+        # Multipart uploads can't be aborted in batches, but those of
+        # completed uploads are gone already
+        map_in_threads(lambda sink: sink.abort(),
+                       [sink for sink in sinks
+                        if sink.chunked_upload.status != COMPLETE])
+        keys = {}
+        for sink in sinks:
+            keys.setdefault((sink.get_client(), sink.bucket), []).append(
+                sink.name)
+        for (client, bucket), bucket_keys in keys.items():
+            for i in range(0, len(bucket_keys), MAX_DELETE_OBJECTS):
+                response = client.delete_objects(Bucket=bucket, Delete={
+                    'Objects': [{'Key': key} for key in
+                                bucket_keys[i:i + MAX_DELETE_OBJECTS]],
+                    'Quiet': True})
+                errors = response.get('Errors')
+                if errors:
+                    raise ClientError({'Error': errors[0]}, 'DeleteObjects')
+
+    def chunks(self, chunk_size=None):
+        response = self.get_client().get_object(Bucket=self.bucket,
+                                                Key=self.name)
+        return response['Body'].iter_chunks(chunk_size or 1024 * 1024)
+
+    def read_range(self, start, size):
+        response = self.get_client().get_object(
+            Bucket=self.bucket, Key=self.name,
+            Range='bytes=%d-%d' % (start, start + size - 1))
+        return response['Body'].read()
@@ -0,0 +1,377 @@
+import fcntl
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+
+from ..constants import http_status
+from ..exceptions import ChunkedUploadError
+from ..settings import WRITE_BEHIND_DIR, WRITE_BEHIND_SINK_CLASS, WRITE_BEHIND_THREADS, WRITE_BUFFER_SIZE
+from . import TRUNCATE, WRITE_AT, BaseChunkSink, PartialWriteError, SliceReader, delete_sinks, get_default_sink_class, \
+    get_sink_class, get_sink_class_path
+from .local import pwrite_all
+
+logger = logging.getLogger(__name__)
+
+
+def get_spool_dir():
+    if WRITE_BEHIND_DIR is not None:
+        return WRITE_BEHIND_DIR
+    return os.path.join(tempfile.gettempdir(), 'chunked_upload')
+
+
+class SpoolLock(object):
+    """
+    Exclusive lock on the spool of an upload, held while it's flushed, so
+    the processes of a host flush it in turn. The lock file also holds the
+    offset the spool starts from, and the offset it has been flushed up to
+    (see `read_positions`). Raises `FileNotFoundError` if the file is
+    missing, unless `create`.
+    """
+
+    def __init__(self, path, create=False):
+        self.path = path
+        self.create = create
+        self.fd = None
+
+    def acquire(self):
+        flags = os.O_RDWR | os.O_CREAT if self.create else os.O_RDWR
+        self.fd = os.open(self.path, flags, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def read_positions(self):
+        """
+        Returns the offset the spool starts from and the offset it has been
+        flushed up to, or `None` if they weren't written yet.
+        """
+        return parse_positions(os.pread(self.fd, 64, 0))
+
+    def write_positions(self, start, flushed):
+        os.ftruncate(self.fd, 0)
+        pwrite_all(self.fd, b'%d %d' % (start, flushed), 0)
+        os.fsync(self.fd)
+
+
+def parse_positions(data):
+    try:
+        start, flushed = data.split()
+        return int(start), int(flushed)
+    except ValueError:
+        return None
+
+
+class FlushWorker(object):
+    """
+    Threads of the process flushing the spools in the background. A flush
+    scheduled while the previous one of the same upload is waiting replaces
+    it, so each upload is flushed at most once per pass.
+    """
+
+    def __init__(self, threads):
+        self.threads = threads
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._started = False
+
+    def schedule(self, key, function):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.threads):
+                    threading.Thread(target=self._run, args=(self._queue,),
+                                     daemon=True).start()
+                self._started = True
+            queued = key in self._jobs
+            self._jobs[key] = function
+        if not queued:
+            self._queue.put(key)
+
+    def cancel(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def _run(self, jobs_queue):
+        while True:
+            key = jobs_queue.get()
+            with self._lock:
+                function = self._jobs.pop(key, None)
+            if function is None:
+                continue
+            try:
+                function()
+            except Exception:
+                # Flushed again with the next chunk, or on completion
+                logger.exception('Flush of the spool of upload %s failed', key)
+
+
+worker = FlushWorker(WRITE_BEHIND_THREADS)
+
+if hasattr(os, 'register_at_fork'):
+    # The threads don't survive in the child process
+    os.register_at_fork(after_in_child=worker.clear)
+
+
+class WriteBehindSink(BaseChunkSink):
+    """
+    Spools the chunks to a local file (`CHUNKED_UPLOAD_WRITE_BEHIND_DIR`),
+    synced to disk before they're acknowledged, and writes them to another
+    sink (`CHUNKED_UPLOAD_WRITE_BEHIND_SINK_CLASS`) in order, from
+    background threads. Clients then wait on the local disk rather than on
+    the storage. Completing the upload flushes what's left of its spool.
+
+    The offset of the upload moves as soon as a chunk is spooled. The spool
+    is kept on the host that received the chunks (any of its processes can
+    flush it), so the following chunks, and the completion, must reach the
+    same host until it's flushed.
+    """
+
+    capabilities = frozenset([TRUNCATE])
+
+    def __init__(self, chunked_upload):
+        super(WriteBehindSink, self).__init__(chunked_upload)
+        self._sink = None
+
+    @property
+    def sink(self):
+        """
+        Sink the chunks are flushed to.
+        """
+        if self._sink is None:
+            state = self.chunked_upload.sink_state
+            if not state.get('write_behind_sink_class_path'):
+                # Keep using the same sink even if the settings change
+                state['write_behind_sink_class_path'] = get_sink_class_path(
+                    get_sink_class(
+                        get_default_sink_class(WRITE_BEHIND_SINK_CLASS)))
+            sink_class = get_sink_class(
+                state['write_behind_sink_class_path'])
+            if WRITE_AT in sink_class.capabilities:
+                # Written in order, in pieces unrelated to the chunks
+                raise ImproperlyConfigured(
+                    'WriteBehindSink needs a sink appending the chunks, not '
+                    '%s' % state['write_behind_sink_class_path'])
+            self._sink = sink_class(self.chunked_upload)
+        return self._sink
+
+    @property
+    def spool_path(self):
+        return os.path.join(get_spool_dir(),
+                            '%s.spool' % self.chunked_upload.upload_id)
+
+    @property
+    def lock_path(self):
+        return os.path.join(get_spool_dir(),
+                            '%s.lock' % self.chunked_upload.upload_id)
+
+    def _get_spool_start(self):
+        """
+        Offset the spool starts from (the data before it was flushed by
+        another host), or `None` if there's no spool.
+        """
+        try:
+            with open(self.lock_path, 'rb') as file_obj:
+                positions = parse_positions(file_obj.read())
+        except FileNotFoundError:
+            return None
+        if positions is None or not os.path.exists(self.spool_path):
+            return None
+        return positions[0]
+
+    def _create_spool(self, offset):
+        if offset and self.sink.size() != offset:
+            # Spooled on another host, which hasn't flushed it yet
+            raise ChunkedUploadError(
+                status=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Chunks of this upload are not stored yet')
+        os.makedirs(get_spool_dir(), exist_ok=True)
+        with SpoolLock(self.lock_path, create=True) as lock:
+            os.close(os.open(self.spool_path, os.O_WRONLY | os.O_CREAT,
+                             0o600))
+            lock.write_positions(offset, offset)
+
+    def create_file(self, save=False):
+        self.sink.create_file(save=save)
+
+    def open_file(self):
+        return self.sink.open_file()
+
+    def check_chunk(self, start, size, total):
+        self.sink.check_chunk(start, size, total)
+
+    def open(self, size=None):
+        self.sink.open(size=size)
+
+    def write(self, offset, file_obj, size):
+        if self._get_spool_start() is None:
+            self._create_spool(offset)
+        fd = os.open(self.spool_path, os.O_WRONLY)
+        try:
+            while True:
+                data = file_obj.read(WRITE_BUFFER_SIZE)
+                if not data:
+                    break
+                pwrite_all(fd, data, offset)
+                offset += len(data)
+            # Acknowledged once it's on disk
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def truncate(self, size):
+        start = self._get_spool_start()
+        if start is not None:
+            os.truncate(self.spool_path, max(size, start))
+
+    def commit_part(self, start, part, tree_leaves):
+        worker.schedule(self.chunked_upload.upload_id, self._flush_job(
+            self.sink, start + part['size']))
+        return [(start, part, tree_leaves)]
+
+    def _flush_job(self, sink, end):
+        def flush():
+            self._flush(sink, end)
+        return flush
+
+    def _flush(self, sink, end):
+        """
+        Write the spool to `sink` up to `end`, from what it holds already.
+        """
+        lock = SpoolLock(self.lock_path)
+        try:
+            lock.acquire()
+        except FileNotFoundError:
+            return  # Flushed and removed already
+        try:
+            positions = lock.read_positions()
+            if positions is None or not os.path.exists(self.spool_path):
+                return
+            # Not the size of the sink, which may not follow the data
+            # written (e.g. preallocated)
+            start, offset = positions
+            if offset >= end:
+                return
+            try:
+                with open(self.spool_path, 'rb') as file_obj:
+                    sink.write(offset, SliceReader(file_obj, offset,
+                                                   end - offset),
+                               end - offset)
+            except PartialWriteError as error:
+                lock.write_positions(start, offset + error.size)
+                raise
+            lock.write_positions(start, end)
+        finally:
+            lock.release()
+
+    def flush(self):
+        # Waits for a flush of this upload running in the background
+        worker.cancel(self.chunked_upload.upload_id)
+        if self._get_spool_start() is None:
+            if self.sink.size() < self.chunked_upload.offset:
+                # Spooled on another host, which hasn't flushed it yet
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail='Chunks of this upload are not stored yet')
+            return []
+        try:
+            self._flush(self.sink, self.chunked_upload.offset)
+        except PartialWriteError as error:
+            error.parts = []  # already recorded when spooled
+            raise
+        return []
+
+    def finalize(self):
+        self.sink.finalize()
+        self._remove_spool()
+
+    def _remove_spool(self):
+        worker.cancel(self.chunked_upload.upload_id)
+        for path in (self.spool_path, self.lock_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def size(self):
+        if self._get_spool_start() is not None:
+            return os.path.getsize(self.spool_path)
+        return self.sink.size()
+
+    def delete(self):
+        self._remove_spool()
+        self.sink.delete()
+
+    @classmethod
+    def delete_many(cls, sinks):
+        for sink in sinks:
+            sink._remove_spool()
+        delete_sinks([sink.sink for sink in sinks])
+
+    def local_path(self):
+        start = self._get_spool_start()
+        if start is None:
+            return self.sink.local_path()
+        # Only if the spool holds the whole data
+        return self.spool_path if start == 0 else None
+
+    def chunks(self, chunk_size=None):
+        start = self._get_spool_start()
+        if start is None:
+            return self.sink.chunks(chunk_size=chunk_size)
+        return self._spooled_chunks(start, chunk_size or WRITE_BUFFER_SIZE)
+
+    def _spooled_chunks(self, start, chunk_size):
+        if start:
+            # The data before the spool, which may have grown since
+            remaining = start
+            for chunk in self.sink.chunks(chunk_size=chunk_size):
+                yield chunk[:remaining]
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+        with open(self.spool_path, 'rb') as file_obj:
+            file_obj.seek(start)
+            while True:
+                chunk = file_obj.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def read_range(self, start, size):
+        spool_start = self._get_spool_start()
+        if spool_start is None or start + size <= spool_start:
+            return self.sink.read_range(start, size)
+        data = b''
+        if start < spool_start:
+            data = self.sink.read_range(start, spool_start - start)
+            size -= spool_start - start
+            start = spool_start
+        with open(self.spool_path, 'rb') as file_obj:
+            file_obj.seek(start)
+            return data + file_obj.read(size)
+
+    def save_to(self, name, storage, move=True):
+        return self.sink.save_to(name, storage, move)
+
+    def get_stored_checksums(self):
+        return self.sink.get_stored_checksums()
+
+    def store_checksums(self, checksums):
+        self.sink.store_checksums(checksums)
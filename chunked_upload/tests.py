@@ -1,2 +1,4 @@
-# Tests for chunked_upload should be created on the app where it is being used,
-# with its own views and models.
+# The tests of chunked_upload are in the `tests` directory, at the root of the
+# repository (run them with `python runtests.py`). Tests of your project
+# should be created on the app where it is being used, with its own views and
+# models.
@@ -1,15 +1,18 @@
 import re
 
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.views.generic import View
 from django.shortcuts import get_object_or_404
-from django.core.files.base import ContentFile
 from django.utils import timezone
 
-from .settings import MAX_BYTES
+from .settings import MAX_BYTES, TREE_HASH_LEAF_SIZE, DEDUPLICATE
 from .models import ChunkedUpload
 from .response import Response
 from .constants import http_status, COMPLETE
 from .exceptions import ChunkedUploadError
+from .sinks import PartialWriteError
+from .checksums import ALGORITHMS, CONTENT_ADDRESS_ALGORITHMS, parse_algorithms, parse_digest_header, decode_base64_digest
 
 
 def is_authenticated(user):
@@ -78,6 +81,18 @@ class ChunkedUploadBaseView(View):
         self.save(chunked_upload, self.request, new=new)
         self.post_save(chunked_upload, self.request, new=new)
 
+    def partial_write_error(self, chunked_upload):
+        """
+        Error returned when the storage failed after storing part of the
+        data. The upload keeps that part: the client resumes from `offset`.
+        """
+        return ChunkedUploadError(
+            status=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Chunk was only partially stored',
+            upload_id=chunked_upload.upload_id,
+            offset=chunked_upload.offset
+        )
+
     def check_permissions(self, request):
         """
         Grants permission to start/continue an upload based on the request.
@@ -109,11 +124,21 @@ class ChunkedUploadView(ChunkedUploadBaseView):
     """
 
     field_name = 'file'
+    # POST field where the client may pick the checksum algorithms (comma
+    # separated) when starting an upload
+    checksum_algorithms_field = 'checksum_algorithms'
     content_range_header = 'HTTP_CONTENT_RANGE'
     content_range_pattern = re.compile(
         r'^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)$'
     )
+    # Optional headers with the checksum of each chunk. The chunk is
+    # rejected (and the offset doesn't move) if it doesn't match
+    content_md5_header = 'HTTP_CONTENT_MD5'
+    digest_headers = ('HTTP_DIGEST', 'HTTP_REPR_DIGEST')
     max_bytes = MAX_BYTES  # Max amount of data that can be uploaded
+    # Sink (class or dotted path) where the chunks of new uploads are
+    # written. `None` means the default one of the model
+    sink_class = None
     # If `fail_if_no_header` is True, an exception will be raised if the
     # content-range header is not found. Default is False to match Jquery File
     # Upload behavior (doesn't send header if the file is smaller than chunk)
@@ -139,14 +164,83 @@ class ChunkedUploadView(ChunkedUploadBaseView):
 
         return self.max_bytes
 
+    def get_checksum_algorithms(self, request):
+        """
+        Checksum algorithms picked by the client for a new upload. `None`
+        means the default ones (`CHUNKED_UPLOAD_CHECKSUM_ALGORITHMS`).
+        """
+        value = request.POST.get(self.checksum_algorithms_field)
+        if not value:
+            return None
+        try:
+            return parse_algorithms(value)
+        except ValueError as error:
+            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
+                                     detail=str(error))
+
+    def get_chunk_checksums(self, request):
+        """
+        Checksums of the chunk sent in the request headers (`Content-MD5`,
+        `Digest` or `Repr-Digest`), as hex digests keyed by algorithm name.
+        """
+        checksums = {}
+        try:
+            for header in self.digest_headers:
+                if request.META.get(header):
+                    checksums.update(parse_digest_header(request.META[header]))
+            if request.META.get(self.content_md5_header):
+                checksums['md5'] = decode_base64_digest(
+                    request.META[self.content_md5_header].strip())
+        except ValueError:
+            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
+                                     detail='Malformed chunk checksum header')
+        return checksums
+
+    def get_declared_digest(self, request):
+        """
+        Digest of the whole file declared by the client when starting an
+        upload (e.g. a `sha256` POST field, along with `size`), as
+        `(digest, size)`. `None` if not declared.
+        """
+        size = request.POST.get('size')
+        if not size or not size.isdigit():
+            return None
+        for name in CONTENT_ADDRESS_ALGORITHMS:
+            value = request.POST.get(name)
+            if value:
+                return '%s:%s' % (name, value.strip().lower()), int(size)
+        return None
+
+    def find_uploaded(self, request, digest, size):
+        """
+        Completed upload, visible to the user, with the same content as the
+        one being started. `None` if there isn't any.
+        """
+        return self.get_queryset(request).filter(
+            digest=digest, offset=size, status=COMPLETE).exclude(
+            file='').first()
+
+    def create_linked_upload(self, original, **attrs):
+        """
+        Creates new chunked upload instance linked to the file of an
+        identical upload, so no data has to be transferred. It's read through
+        the sink of `original`, and there's nothing to finalize on completion.
+        """
+        chunked_upload = self.model(**attrs)
+        chunked_upload.link_to(original)
+        chunked_upload.checksum_algorithms = original.digest.split(':')[0]
+        return chunked_upload
+
     def create_chunked_upload(self, save=False, **attrs):
         """
         Creates new chunked upload instance. Called if no 'upload_id' is
         found in the POST data.
         """
         chunked_upload = self.model(**attrs)
+        if self.sink_class is not None:
+            chunked_upload.set_sink_class(self.sink_class)
         # file starts empty
-        chunked_upload.file.save(name='tmp', content=ContentFile(b''), save=save)
+        chunked_upload.get_sink().create_file(save=save)
         return chunked_upload
 
     def is_valid_chunked_upload(self, chunked_upload):
@@ -160,6 +254,30 @@ class ChunkedUploadView(ChunkedUploadBaseView):
         if chunked_upload.status == COMPLETE:
             raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
                                      detail=error_msg % 'complete')
+        if chunked_upload.digest:
+            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
+                                     detail='Upload already has all its data')
+
+    def is_valid_chunk_range(self, chunked_upload, start, chunk_size, total):
+        """
+        Check a chunk that may be written at any offset (the sink has the
+        `WRITE_AT` capability) against the ones already received. Sending a
+        chunk again is allowed.
+        """
+        if start + chunk_size > total:
+            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
+                                     detail='Error in request headers')
+        for part_start, part in chunked_upload.parts.items():
+            part_start = int(part_start)
+            if part_start == start and part['size'] == chunk_size:
+                continue
+            if part_start < start + chunk_size and \
+                    start < part_start + part['size']:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail='Chunk overlaps data already received',
+                    offset=chunked_upload.offset
+                )
 
     def get_response_data(self, chunked_upload, request):
         """
@@ -168,11 +286,48 @@ class ChunkedUploadView(ChunkedUploadBaseView):
         return {
             'upload_id': chunked_upload.upload_id,
             'offset': chunked_upload.offset,
+            # Where the next chunk starts: past the chunks buffered by the
+            # sink, which `offset` doesn't count until they're stored
+            'received': chunked_upload.get_append_offset(),
             'expires': chunked_upload.expires_on
         }
 
     def _post(self, request, *args, **kwargs):
         chunk = request.FILES.get(self.field_name)
+        if not request.POST.get('upload_id'):
+            response = self._post_declared_digest(request, chunk)
+            if response is not None:
+                return response
+        chunked_upload, start, total = self._get_chunked_upload(request, chunk)
+
+        checksums = self.get_chunk_checksums(request)
+        if not chunked_upload.supports_write_at():
+            try:
+                moved = chunked_upload.append_chunk(
+                    chunk, chunk_size=chunk.size, save=False,
+                    checksums=checksums, total=total)
+            except PartialWriteError:
+                self._save(chunked_upload)
+                raise self.partial_write_error(chunked_upload)
+            # Not saved while the chunks are only buffered by the sink
+            if moved or chunked_upload._state.adding:
+                self._save(chunked_upload)
+        else:
+            part, tree_leaves = chunked_upload.write_chunk(
+                chunk, start, checksums=checksums, total=total)
+            chunked_upload = self._add_part(request, chunked_upload, start,
+                                            part, tree_leaves)
+
+        return Response(self.get_response_data(chunked_upload, request),
+                        status=http_status.HTTP_200_OK)
+
+    def _get_chunked_upload(self, request, chunk, open_sink=True):
+        """
+        Validate the request and return the upload the chunk belongs to (a
+        new one, not saved yet, for the first chunk, whose sink is opened
+        unless `open_sink` is false), along with the position of the chunk
+        and the size of the whole file.
+        """
         if chunk is None:
             raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
                                      detail='No chunk file was submitted')
@@ -185,6 +340,9 @@ class ChunkedUploadView(ChunkedUploadBaseView):
             self.is_valid_chunked_upload(chunked_upload)
         else:
             attrs = {'filename': chunk.name}
+            algorithms = self.get_checksum_algorithms(request)
+            if algorithms:
+                attrs['checksum_algorithms'] = ','.join(algorithms)
             attrs.update(self.get_extra_attrs(request))
             chunked_upload = self.create_chunked_upload(save=False, **attrs)
 
@@ -211,17 +369,132 @@ class ChunkedUploadView(ChunkedUploadBaseView):
                 status=http_status.HTTP_400_BAD_REQUEST,
                 detail='Size of file exceeds the limit (%s bytes)' % max_bytes
             )
-        if chunked_upload.offset != start:
-            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
-                                     detail='Offsets do not match',
-                                     offset=chunked_upload.offset)
+        if chunked_upload.supports_write_at():
+            self.is_valid_chunk_range(chunked_upload, start, chunk_size, total)
+        elif chunked_upload.get_append_offset() != start:
+            if chunked_upload.offset != start:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail='Offsets do not match',
+                    offset=chunked_upload.offset
+                )
+            # Resumed from the offset: the chunks buffered by the sink after
+            # it are sent again
+            chunked_upload.get_sink().discard_pending()
         if chunk.size != chunk_size:
             raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
                                      detail="File size doesn't match headers")
+        chunked_upload.get_sink().check_chunk(start, chunk_size, total)
+        if open_sink and chunked_upload._state.adding:
+            chunked_upload.open_sink(size=total)
+        return chunked_upload, start, total
+
+    def _add_part(self, request, chunked_upload, start, part, tree_leaves):
+        """
+        Record a chunk written at any offset, and save the upload. Returns
+        the upload saved.
+        """
+        if chunked_upload.pk is None:
+            chunked_upload.add_part(start, part, tree_leaves)
+            self._save(chunked_upload)
+            return chunked_upload
+        # Chunks may be written in parallel: the upload is only locked to
+        # record the chunk, once it has been written
+        with transaction.atomic():
+            chunked_upload = self.get_queryset(request).select_for_update(
+            ).get(pk=chunked_upload.pk)
+            chunked_upload.add_part(start, part, tree_leaves)
+            self._save(chunked_upload)
+        return chunked_upload
 
-        chunked_upload.append_chunk(chunk, chunk_size=chunk_size, save=False)
-
+    def _post_declared_digest(self, request, chunk):
+        """
+        If the client declared the digest of the file and an identical file
+        was already uploaded, skip the transfer: the new upload is linked to
+        that file and the response already reports all its data (the client
+        goes straight to completion).
+        """
+        declared = self.get_declared_digest(request)
+        if declared is None:
+            return None
+        digest, size = declared
+        max_bytes = self.get_max_bytes(request)
+        if max_bytes is not None and size > max_bytes:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail='Size of file exceeds the limit (%s bytes)' % max_bytes
+            )
+        original = self.find_uploaded(request, digest, size)
+        if original is None:
+            return None
+        self.validate(request)
+        filename = request.POST.get('filename') or (
+            chunk.name if chunk is not None else original.filename)
+        attrs = {'filename': filename}
+        attrs.update(self.get_extra_attrs(request))
+        chunked_upload = self.create_linked_upload(original, **attrs)
         self._save(chunked_upload)
+        return Response(self.get_response_data(chunked_upload, request),
+                        status=http_status.HTTP_200_OK)
+
+
+class AsyncChunkedUploadView(ChunkedUploadView):
+    """
+    `ChunkedUploadView` for ASGI deployments. The chunks are written from
+    the event loop by sinks with the `ASYNC` capability (e.g. the Azure
+    ones), so no thread is held while the storage replies. The database
+    queries and other sinks run in worker threads.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        """
+        Handle POST requests.
+        """
+        try:
+            await sync_to_async(self.check_permissions)(request)
+            return await self._apost(request, *args, **kwargs)
+        except ChunkedUploadError as error:
+            return Response(error.data, status=error.status_code)
+
+    async def _apost(self, request, *args, **kwargs):
+        # Parsing the request may spool the chunk to disk
+        chunk = await sync_to_async(request.FILES.get)(self.field_name)
+        if not request.POST.get('upload_id'):
+            # May look for the file among the uploads, and copy it: not on
+            # the thread shared by the other requests
+            response = await sync_to_async(self._post_declared_digest,
+                                           thread_sensitive=False)(
+                request, chunk)
+            if response is not None:
+                return response
+        # The sink is opened by `awrite_chunk`, from the event loop if it
+        # can be
+        chunked_upload, start, total = await sync_to_async(
+            self._get_chunked_upload, thread_sensitive=False)(
+            request, chunk, open_sink=False)
+
+        checksums = self.get_chunk_checksums(request)
+        try:
+            part, tree_leaves = await chunked_upload.awrite_chunk(
+                chunk, start, checksums=checksums, total=total)
+            if not chunked_upload.supports_write_at():
+                # May flush the chunks buffered by the sink
+                moved = await sync_to_async(chunked_upload.commit_chunk,
+                                            thread_sensitive=False)(
+                    start, part, tree_leaves)
+        except PartialWriteError as error:
+            if chunked_upload.supports_write_at():
+                raise
+            for args in error.parts:
+                chunked_upload.add_part(*args)
+            await sync_to_async(self._save)(chunked_upload)
+            raise self.partial_write_error(chunked_upload)
+        if not chunked_upload.supports_write_at():
+            if moved or chunked_upload._state.adding:
+                await sync_to_async(self._save)(chunked_upload)
+        else:
+            chunked_upload = await sync_to_async(self._add_part)(
+                request, chunked_upload, start, part, tree_leaves)
 
         return Response(self.get_response_data(chunked_upload, request),
                         status=http_status.HTTP_200_OK)
@@ -233,9 +506,12 @@ class ChunkedUploadCompleteView(ChunkedUploadBaseView):
     define what to do when upload is complete.
     """
 
-    # I wouldn't recommend to turn off the md5 check, unless is really
+    # I wouldn't recommend to turn off the checksum check, unless is really
     # impacting your performance. Proceed at your own risk.
     do_md5_check = True
+    # Link the upload to an identical one already stored, if any, instead of
+    # keeping a second copy of the data
+    deduplicate = DEDUPLICATE
 
     def on_completion(self, uploaded_file, request):
         """
@@ -250,23 +526,67 @@ class ChunkedUploadCompleteView(ChunkedUploadBaseView):
             error_msg = "Upload has already been marked as complete"
             raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
                                       detail=error_msg)
+        if chunked_upload.has_missing_chunks():
+            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
+                                     detail='Upload is missing chunks',
+                                     offset=chunked_upload.offset)
+
+    def get_checksums(self, request):
+        """
+        Checksums sent by the client, keyed by algorithm name (one POST
+        field per algorithm, e.g. `md5` or `sha256`).
+        """
+        return dict((name, request.POST[name].strip().lower())
+                    for name in ALGORITHMS if request.POST.get(name))
+
+    def checksum_check(self, chunked_upload, checksums):
+        """
+        Verify if the checksums sent by client match the generated ones.
+        """
+        algorithms = chunked_upload.get_checksum_algorithms()
+        for name, value in checksums.items():
+            if name not in algorithms:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail='%s checksum was not computed for this upload' % name
+                )
+            if chunked_upload.checksums[name] != value:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail='%s checksum does not match' % name
+                )
 
     def md5_check(self, chunked_upload, md5):
         """
         Verify if md5 checksum sent by client matches generated md5.
         """
-        if chunked_upload.md5 != md5:
-            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
-                                     detail='md5 checksum does not match')
+        self.checksum_check(chunked_upload, {'md5': md5})
+
+    def finalize_chunks(self, chunked_upload):
+        """
+        Make the chunks of the upload readable as a single file (see
+        `ChunkedUpload.finalize_chunks`).
+        """
+        offset = chunked_upload.offset
+        try:
+            chunked_upload.finalize_chunks()
+        except PartialWriteError:
+            self._save(chunked_upload)
+            raise self.partial_write_error(chunked_upload)
+        if chunked_upload.offset != offset:
+            # Chunks buffered by the sink were flushed: recorded even if the
+            # checksums don't match
+            self._save(chunked_upload)
 
     def _post(self, request, *args, **kwargs):
         upload_id = request.POST.get('upload_id')
-        md5 = request.POST.get('md5')
+        checksums = self.get_checksums(request)
 
         error_msg = None
         if self.do_md5_check:
-            if not upload_id or not md5:
-                error_msg = "Both 'upload_id' and 'md5' are required"
+            if not upload_id or not checksums:
+                error_msg = ("Both 'upload_id' and 'md5' (or another "
+                             "checksum) are required")
         elif not upload_id:
             error_msg = "'upload_id' is required"
         if error_msg:
@@ -278,9 +598,16 @@ class ChunkedUploadCompleteView(ChunkedUploadBaseView):
 
         self.validate(request)
         self.is_valid_chunked_upload(chunked_upload)
+        # Uploads linked to a file already stored (see `create_linked_upload`)
+        # have a digest: there is nothing to finalize
+        if not chunked_upload.digest:
+            self.finalize_chunks(chunked_upload)
         if self.do_md5_check:
-            self.md5_check(chunked_upload, md5)
+            self.checksum_check(chunked_upload, checksums)
 
+        chunked_upload.store_checksums()
+        if self.deduplicate:
+            chunked_upload.deduplicate()
         chunked_upload.status = COMPLETE
         chunked_upload.completed_on = timezone.now()
         self._save(chunked_upload)
@@ -288,3 +615,58 @@ class ChunkedUploadCompleteView(ChunkedUploadBaseView):
 
         return Response(self.get_response_data(chunked_upload, request),
                         status=http_status.HTTP_200_OK)
+
+
+class AsyncChunkedUploadCompleteView(ChunkedUploadCompleteView):
+    """
+    `ChunkedUploadCompleteView` for ASGI deployments, along with
+    `AsyncChunkedUploadView`. Completing may read the data stored, so it
+    runs in a worker thread of its own, rather than on the thread shared by
+    the database queries of the other requests.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        """
+        Handle POST requests.
+        """
+        return await sync_to_async(
+            super(AsyncChunkedUploadCompleteView, self).post,
+            thread_sensitive=False)(request, *args, **kwargs)
+
+
+class ChunkedUploadManifestView(ChunkedUploadBaseView):
+    """
+    Returns the leaves of the tree hashes recorded for an upload (GET with
+    `upload_id`), so the client can check which ranges the server has.
+    """
+
+    def get_response_data(self, chunked_upload, request):
+        """
+        Data for the response. Should return a dictionary-like object.
+        """
+        return {
+            'upload_id': chunked_upload.upload_id,
+            'offset': chunked_upload.offset,
+            'leaf_size': TREE_HASH_LEAF_SIZE,
+            'leaves': chunked_upload.tree_leaves,
+        }
+
+    def _get(self, request, *args, **kwargs):
+        upload_id = request.GET.get('upload_id')
+        if not upload_id:
+            raise ChunkedUploadError(status=http_status.HTTP_400_BAD_REQUEST,
+                                     detail="'upload_id' is required")
+        chunked_upload = get_object_or_404(self.get_queryset(request),
+                                           upload_id=upload_id)
+        return Response(self.get_response_data(chunked_upload, request),
+                        status=http_status.HTTP_200_OK)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handle GET requests.
+        """
+        try:
+            self.check_permissions(request)
+            return self._get(request, *args, **kwargs)
+        except ChunkedUploadError as error:
+            return Response(error.data, status=error.status_code)
@@ -0,0 +1,22 @@
+"""
+Runs the tests of `tests/` with pytest too (`python runtests.py` runs them
+with the test runner of Django).
+"""
+import os
+
+import django
+
+
+def pytest_configure(config):
+    from django.test.runner import DiscoverRunner
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+    config.django_runner = DiscoverRunner(verbosity=0, interactive=False)
+    config.django_runner.setup_test_environment()
+    config.django_old_config = config.django_runner.setup_databases()
+
+
+def pytest_unconfigure(config):
+    config.django_runner.teardown_databases(config.django_old_config)
+    config.django_runner.teardown_test_environment()
@@ -17,7 +17,8 @@ download_url = (
 
 setup(
     name='django-chunked-upload',
-    packages=['chunked_upload', 'chunked_upload.migrations', 'chunked_upload.management', 'chunked_upload.management.commands'],
+    packages=['chunked_upload', 'chunked_upload.migrations', 'chunked_upload.management', 'chunked_upload.management.commands',
+              'chunked_upload.sinks'],
     version=version,
     description=('Upload large files to Django in multiple chunks, with the '
                  'ability to resume if the upload is interrupted.'),
@@ -29,5 +30,10 @@ setup(
     install_requires=[
         'azure-storage-blob>=12.0.0',
     ],
+    extras_require={
+        's3': ['boto3'],
+        'aio': ['aiohttp'],
+        'test': ['aiohttp', 'boto3', 'crc32c', 'moto[s3]'],
+    },
     license='MIT-Zero'
 )
@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+TEMP_DIR = tempfile.mkdtemp(prefix='chunked_upload_tests')
+
+SECRET_KEY = 'tests'
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'chunked_upload',
+]
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(TEMP_DIR, 'db.sqlite3'),
+        # On disk, so chunks can be sent in parallel from several threads
+        'TEST': {'NAME': os.path.join(TEMP_DIR, 'test.sqlite3')},
+        'OPTIONS': {'timeout': 30, 'transaction_mode': 'IMMEDIATE'},
+    },
+}
+MEDIA_ROOT = os.path.join(TEMP_DIR, 'media')
+USE_TZ = True
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+AZURE_ACCOUNT_NAME = 'account'
+AZURE_ACCOUNT_KEY = 'a2V5'
+AZURE_MEDIA_CONTAINER = 'media'
+
+CHUNKED_UPLOAD_AZURE_CLIENT_CLASS = 'chunked_upload.azure_fake.FakeBlobServiceClient'
+CHUNKED_UPLOAD_AZURE_ASYNC_CLIENT_CLASS = 'chunked_upload.azure_fake.FakeAsyncBlobServiceClient'
+CHUNKED_UPLOAD_S3_BUCKET = 'chunked-uploads'
+CHUNKED_UPLOAD_S3_REGION_NAME = 'us-east-1'
+CHUNKED_UPLOAD_S3_ACCESS_KEY_ID = 'tests'
+CHUNKED_UPLOAD_S3_SECRET_ACCESS_KEY = 'tests'
+CHUNKED_UPLOAD_TREE_HASH_LEAF_SIZE = 1024
+CHUNKED_UPLOAD_WRITE_BEHIND_DIR = os.path.join(TEMP_DIR, 'spool')
+CHUNKED_UPLOAD_MEMORY_DIR = os.path.join(TEMP_DIR, 'memory')
+CHUNKED_UPLOAD_MEMORY_SPILL_DIR = os.path.join(TEMP_DIR, 'spill')
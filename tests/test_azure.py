@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from azure.core.exceptions import HttpResponseError
+from django.db import connection
+
+from chunked_upload import azure
+from chunked_upload.azure_fake import FakeBlobClient
+from chunked_upload.checksums import AsyncHashingReader, running_hashes
+from chunked_upload.sinks import get_sink_class
+from chunked_upload.views import AsyncChunkedUploadCompleteView, AsyncChunkedUploadView
+
+from .utils import UploadTestCase, md5
+
+
+class AzureAppendBlobSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.azure.AzureAppendBlobSink'
+    data = os.urandom(10000)
+
+    def test_upload(self):
+        upload_id = self.upload_all(self.data, 3000)
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_blob_not_read_by_other_processes(self):
+        with mock.patch.object(FakeBlobClient, 'download_blob',
+                               autospec=True) as download_blob:
+            upload_id = None
+            for start in range(0, len(self.data), 3000):
+                status, response = self.upload(
+                    self.data[start:start + 3000], start, len(self.data),
+                    upload_id)
+                upload_id = response['upload_id']
+                # The next request lands on another process
+                running_hashes.discard(upload_id)
+
+            status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        download_blob.assert_not_called()
+
+    @mock.patch('chunked_upload.sinks.azure.AZURE_APPEND_BLOCK_SIZE', 1000)
+    def test_resumed_after_a_failed_block(self):
+        calls = []
+
+        def append_block(blob_client, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                error = HttpResponseError('Server Busy')
+                error.status_code = 503
+                raise error
+            return _append_block(blob_client, *args, **kwargs)
+
+        _append_block = FakeBlobClient.append_block
+        upload_id = self.upload_all(self.data[:3000], 3000)
+        with mock.patch.object(FakeBlobClient, 'append_block', append_block):
+            status, response = self.upload(self.data[3000:6000], 3000,
+                                           len(self.data), upload_id)
+
+        # The blocks appended before the failure are kept
+        self.assertEqual(status, 503, response)
+        self.assertEqual(response['offset'], 4000)
+        self.assertEqual(self.get_upload(upload_id).offset, 4000)
+        self.assertEqual(self.read(upload_id), self.data[:4000])
+
+        status, response = self.upload(self.data[4000:], 4000,
+                                       len(self.data), upload_id)
+        self.assertEqual(status, 200, response)
+        status, response = self.complete(upload_id, md5(self.data))
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), self.data)
+
+
+class AzureBlockBlobSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.azure.AzureBlockBlobSink'
+    data = os.urandom(16000)
+
+    def send(self, start, upload_id):
+        try:
+            status, response = self.upload(self.data[start:start + 1000],
+                                           start, len(self.data), upload_id)
+            self.assertEqual(status, 200, response)
+        finally:
+            connection.close()
+
+    def test_parallel_chunks(self):
+        status, response = self.upload(self.data[:1000], 0, len(self.data))
+        upload_id = response['upload_id']
+        starts = list(range(1000, len(self.data), 1000))
+        random.shuffle(starts)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.send, starts, [upload_id] * len(starts)))
+
+        # No chunk lost while recording them concurrently
+        upload = self.get_upload(upload_id)
+        self.assertEqual(len(upload.parts), 16)
+        self.assertEqual(upload.offset, len(self.data))
+        status, response = self.complete(upload_id, md5(self.data))
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_missing_chunks(self):
+        status, response = self.upload(self.data[:1000], 0, len(self.data))
+        upload_id = response['upload_id']
+        self.send(2000, upload_id)
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 400, response)
+        self.assertEqual(response['offset'], 1000)
+
+
+class AsyncAzureAppendBlobSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.azure.AzureAppendBlobSink'
+    upload_view_class = AsyncChunkedUploadView
+    complete_view_class = AsyncChunkedUploadCompleteView
+    data = os.urandom(10000)
+
+    def call(self, view, data, **headers):
+        request = self.factory.post('/', data, **headers)
+        response = asyncio.run(view(request))
+        return response.status_code, json.loads(response.content)
+
+    def test_upload(self):
+        upload_id = self.upload_all(self.data, 3000)
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    @mock.patch('chunked_upload.sinks.azure.AZURE_VALIDATE_CONTENT', True)
+    def test_content_md5_sent(self):
+        with mock.patch('chunked_upload.azure_fake._check_content_md5') as \
+                check_content_md5:
+            self.upload(self.data)
+
+        kwargs = check_content_md5.call_args[0][1]
+        self.assertEqual(kwargs['transactional_content_md5'],
+                         hashlib.md5(self.data).digest())
+
+    @mock.patch('chunked_upload.sinks.azure.AZURE_VALIDATE_CONTENT', True)
+    @mock.patch('chunked_upload.sinks.WRITE_BUFFER_SIZE', 1000)
+    def test_streamed_in_pieces(self):
+        with mock.patch.object(AsyncHashingReader, 'read', autospec=True,
+                               side_effect=AsyncHashingReader.read) as read:
+            status, response = self.upload(self.data)
+
+        self.assertEqual(status, 200, response)
+        self.assertTrue(read.call_args_list)
+        for call in read.call_args_list:
+            self.assertTrue(0 < call[0][1] <= 1000, call)
+        upload_id = response['upload_id']
+        self.assertEqual(self.complete(upload_id, md5(self.data))[0], 200)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_sink_opened_from_the_loop(self):
+        sink_class = get_sink_class(self.sink_class)
+        with mock.patch.object(sink_class, 'open') as open_sink:
+            status, response = self.upload(self.data)
+
+        self.assertEqual(status, 200, response)
+        open_sink.assert_not_called()
+        upload_id = response['upload_id']
+        self.assertEqual(self.complete(upload_id, md5(self.data))[0], 200)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_session_closed_with_the_loop(self):
+        sessions = []
+
+        def create_async_session():
+            sessions.append(create_session())
+            return sessions[-1]
+
+        create_session = azure.create_async_session
+        with mock.patch.object(azure, 'create_async_session',
+                               create_async_session):
+            status, response = self.upload(self.data)
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(len(sessions), 1)
+        self.assertTrue(sessions[0].closed)
+
+
+class AsyncAzureBlockBlobSinkTests(AsyncAzureAppendBlobSinkTests):
+
+    sink_class = 'chunked_upload.sinks.azure.AzureBlockBlobSink'
@@ -0,0 +1,166 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import zlib
+from unittest import TestCase, mock
+
+import crc32c
+
+from chunked_upload.checksums import COMBINABLE_ALGORITHMS, MultiHash, OpenSSLHash, combine_part_checksums, crc_combine, \
+    get_openssl_functions, new_running_hash, running_hashes
+from chunked_upload.models import ChunkedUpload
+
+from .utils import UploadTestCase, md5
+
+
+class OpenSSLHashTests(UploadTestCase):
+
+    def test_restored_state(self):
+        data = os.urandom(5000)
+        for name in get_openssl_functions():
+            hash_obj = OpenSSLHash(name)
+            hash_obj.update(data[:1234])
+            restored = OpenSSLHash(name, hash_obj.get_state(), 1234)
+            restored.update(memoryview(data)[1234:])
+            self.assertEqual(restored.hexdigest(),
+                             hashlib.new(name, data).hexdigest())
+
+    def test_multi_hash_state(self):
+        data = os.urandom(5000)
+        hash_obj = new_running_hash(['md5', 'sha256'])
+        hash_obj.update(data[:100])
+
+        restored = MultiHash.from_state(['md5', 'sha256'],
+                                        hash_obj.get_state(), 100)
+        restored.update(data[100:])
+
+        self.assertEqual(restored.hexdigests(), {
+            'md5': hashlib.md5(data).hexdigest(),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        })
+
+    def test_not_saved_for_other_algorithms(self):
+        self.assertIsNone(new_running_hash(['md5', 'blake2b']).get_state())
+
+    def test_invalid_states_rejected(self):
+        for name, functions in get_openssl_functions().items():
+            hash_obj = OpenSSLHash(name)
+            hash_obj.update(b'x' * 10)
+            state = hash_obj.get_state()
+            fields = list(functions.context.unpack(state))
+            # Amount of bytes pending, past the pending block
+            fields[functions.hash_words + 2] = 10 ** 6
+            corrupted = functions.context.pack(*fields)
+
+            for state, size in ((corrupted, 10), (state, 11),
+                                (state[:-1], 10)):
+                with self.assertRaises(ValueError):
+                    OpenSSLHash(name, state, size)
+            self.assertIsNone(MultiHash.from_state(
+                [name], {name: 'not base64'}, 10))
+            self.assertIsNone(MultiHash.from_state([name], {}, 10))
+
+    def test_read_only_buffer_hashed_in_place(self):
+        data = os.urandom(5000)
+        with tempfile.TemporaryFile() as file_obj:
+            file_obj.write(data)
+            file_obj.flush()
+            with mmap.mmap(file_obj.fileno(), 0,
+                           access=mmap.ACCESS_READ) as mapped:
+                for name in get_openssl_functions():
+                    hash_obj = OpenSSLHash(name)
+                    hash_obj.update(mapped)
+                    with memoryview(mapped) as view:
+                        hash_obj.update(view[1000:])
+                    self.assertEqual(hash_obj.hexdigest(), hashlib.new(
+                        name, data + data[1000:]).hexdigest())
+
+
+class RunningHashTests(UploadTestCase):
+
+    data = os.urandom(10000)
+
+    def send_on_other_processes(self, extra=None):
+        """
+        Send the chunks as if each one landed on another process.
+        """
+        upload_id = None
+        for start in range(0, len(self.data), 1000):
+            status, response = self.upload(
+                self.data[start:start + 1000], start, len(self.data),
+                upload_id, extra=extra)
+            self.assertEqual(status, 200, response)
+            upload_id = response['upload_id']
+            running_hashes.discard(upload_id)
+        return upload_id
+
+    def test_resumed_from_the_saved_state(self):
+        with mock.patch.object(ChunkedUpload, '_hash_stored_data',
+                               autospec=True) as hash_stored_data:
+            upload_id = self.send_on_other_processes()
+        hash_stored_data.assert_not_called()
+        self.assertEqual(self.get_upload(upload_id).hash_state['offset'],
+                         len(self.data))
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+
+    def test_stored_data_hashed_once_without_saved_state(self):
+        extra = {'checksum_algorithms': 'md5,blake2b'}
+        with mock.patch.object(ChunkedUpload, '_hash_stored_data',
+                               autospec=True) as hash_stored_data:
+            upload_id = self.send_on_other_processes(extra=extra)
+        hash_stored_data.assert_not_called()
+
+        status, response = self.complete(upload_id, md5(self.data), extra={
+            'blake2b': hashlib.blake2b(self.data).hexdigest()})
+
+        self.assertEqual(status, 200, response)
+
+    def test_state_of_another_library_not_used(self):
+        upload_id = self.send_on_other_processes()
+        upload = self.get_upload(upload_id)
+        upload.hash_state['format'] = 'OpenSSL 0.9.8 big'
+        upload.save()
+
+        with mock.patch.object(ChunkedUpload, '_hash_stored_data',
+                               autospec=True,
+                               side_effect=ChunkedUpload._hash_stored_data) \
+                as hash_stored_data:
+            status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        hash_stored_data.assert_called_once()
+
+
+class CRCCombineTests(TestCase):
+
+    functions = {'crc32': zlib.crc32, 'crc32c': crc32c.crc32c}
+
+    def test_combined(self):
+        data = os.urandom(5000)
+        for name, func in self.functions.items():
+            polynomial = COMBINABLE_ALGORITHMS[name]
+            for split in (0, 1, 1234, 5000):
+                self.assertEqual(
+                    crc_combine(polynomial, func(data[:split]),
+                                func(data[split:]), len(data) - split),
+                    func(data), (name, split))
+
+    def test_part_checksums_combined(self):
+        data = os.urandom(5000)
+        # Including an empty one
+        bounds = [(0, 1000), (1000, 3999), (3999, 5000), (5000, 5000)]
+        for name, func in self.functions.items():
+            parts = dict(
+                (str(start), {'size': end - start,
+                              name: '%08x' % func(data[start:end])})
+                for start, end in reversed(bounds))
+
+            self.assertEqual(combine_part_checksums(name, parts, len(data)),
+                             '%08x' % func(data))
+            self.assertIsNone(combine_part_checksums(name, parts, 6000))
+            del parts['1000']
+            self.assertIsNone(combine_part_checksums(name, parts, len(data)))
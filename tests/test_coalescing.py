@@ -0,0 +1,103 @@
+import hashlib
+import os
+import zlib
+from unittest import TestCase, mock
+
+from chunked_upload.sinks.coalescing import merge_parts
+
+from .utils import UploadTestCase, md5
+
+
+class CoalescingSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.coalescing.CoalescingSink'
+    data = os.urandom(5000)
+
+    def send(self, start, end, upload_id=None):
+        status, response = self.upload(self.data[start:end], start,
+                                       len(self.data), upload_id)
+        self.assertEqual(status, 200, response)
+        return response
+
+    def test_chunks_sent_from_received(self):
+        response = self.send(0, 1000)
+        upload_id = response['upload_id']
+        while response['received'] < len(self.data):
+            response = self.send(response['received'],
+                                 response['received'] + 1000, upload_id)
+            # Buffered: not stored for good yet
+            self.assertEqual(response['offset'], 0)
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.get_upload(upload_id).offset, len(self.data))
+        self.assertEqual(self.read(upload_id), self.data)
+
+    @mock.patch('chunked_upload.sinks.coalescing.COALESCE_SIZE', 2000)
+    def test_flushed_once_buffered_size_is_reached(self):
+        upload_id = self.send(0, 1000)['upload_id']
+
+        response = self.send(1000, 2500, upload_id)
+
+        self.assertEqual(response['offset'], 2500)
+        self.assertEqual(response['received'], 2500)
+        self.assertEqual(self.read(upload_id), self.data[:2500])
+
+    def test_resumed_from_offset(self):
+        upload_id = self.send(0, 1000)['upload_id']
+        self.send(1000, 2000, upload_id)
+
+        # e.g. the response was lost: the buffered chunks are sent again
+        response = self.send(0, 1000, upload_id)
+        self.assertEqual(response['received'], 1000)
+        response = self.send(1000, len(self.data), upload_id)
+
+        self.assertEqual(response['received'], len(self.data))
+        self.assertEqual(self.complete(upload_id, md5(self.data))[0], 200)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    @mock.patch('chunked_upload.sinks.coalescing.COALESCE_SIZE', 6000)
+    @mock.patch('chunked_upload.sinks.coalescing.COALESCE_SINK_CLASS',
+                'chunked_upload.sinks.azure.AzureBlockBlobSink')
+    def test_flushed_as_a_single_block(self):
+        data = os.urandom(12000)
+        extra = {'checksum_algorithms': 'md5,crc32,sha256_tree'}
+        upload_id = None
+        for start in range(0, len(data), 3000):
+            status, response = self.upload(
+                data[start:start + 3000], start, len(data),
+                upload_id, extra=extra)
+            self.assertEqual(status, 200, response)
+            upload_id = response['upload_id']
+
+        upload = self.get_upload(upload_id)
+        self.assertEqual(sorted(upload.parts), ['0', '6000'])
+        self.assertEqual(upload.parts['0']['crc32'],
+                         '%08x' % zlib.crc32(data[:6000]))
+        status, response = self.complete(upload_id, md5(data), extra={
+            'crc32': '%08x' % zlib.crc32(data)})
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), data)
+
+
+class MergePartsTests(TestCase):
+
+    def test_merged(self):
+        data = os.urandom(3000)
+        parts = []
+        # Including an empty chunk
+        for index, (start, end) in enumerate(
+                ((0, 1000), (1000, 1000), (1000, 3000))):
+            parts.append((start, {
+                'size': end - start,
+                'crc32': '%08x' % zlib.crc32(data[start:end]),
+            }, {'sha256_tree': {str(index): [
+                end - start, hashlib.sha256(data[start:end]).hexdigest()]}}))
+
+        [(start, part, tree_leaves)] = merge_parts(parts)
+
+        self.assertEqual(start, 0)
+        self.assertEqual(part, {'size': 3000,
+                                'crc32': '%08x' % zlib.crc32(data)})
+        self.assertEqual(sorted(tree_leaves['sha256_tree']), ['0', '1', '2'])
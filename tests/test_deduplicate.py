@@ -0,0 +1,83 @@
+import hashlib
+import os
+
+from django.conf import settings
+
+from .utils import UploadTestCase, md5
+
+
+class DeduplicateTests(UploadTestCase):
+
+    data = os.urandom(3000)
+    algorithms = {'checksum_algorithms': 'md5,sha256'}
+
+    def send(self, sink_class):
+        status, response = self.upload(self.data, extra=self.algorithms,
+                                       sink_class=sink_class)
+        self.assertEqual(status, 200, response)
+        return response['upload_id']
+
+    def test_linked_to_the_sink_of_the_original(self):
+        original_id = self.send('chunked_upload.sinks.azure.AzureBlockBlobSink')
+        self.assertEqual(self.complete(original_id, md5(self.data))[0], 200)
+        upload_id = self.send('chunked_upload.sinks.local.LocalFileSink')
+        path = os.path.join(settings.MEDIA_ROOT,
+                            self.get_upload(upload_id).file.name)
+        self.assertTrue(os.path.exists(path))
+
+        status, response = self.complete(upload_id, md5(self.data),
+                                         deduplicate=True)
+
+        self.assertEqual(status, 200, response)
+        original = self.get_upload(original_id)
+        upload = self.get_upload(upload_id)
+        self.assertEqual(upload.file.name, original.file.name)
+        self.assertEqual(upload.sink_class_path, original.sink_class_path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_data_kept_until_the_last_upload_is_deleted(self):
+        original_id = self.send('chunked_upload.sinks.local.LocalFileSink')
+        self.complete(original_id, md5(self.data))
+        upload_id = self.send('chunked_upload.sinks.local.LocalFileSink')
+        self.complete(upload_id, md5(self.data), deduplicate=True)
+
+        self.get_upload(original_id).delete()
+
+        self.assertEqual(self.read(upload_id), self.data)
+
+
+class DeclaredDigestTests(UploadTestCase):
+
+    data = os.urandom(3000)
+
+    def declare(self):
+        status, response = self.call(self.upload_view_class.as_view(), {
+            'size': len(self.data),
+            'sha256': hashlib.sha256(self.data).hexdigest(),
+        })
+        self.assertEqual(status, 200, response)
+        self.assertEqual(response['offset'], len(self.data))
+        return response['upload_id']
+
+    def check_linked(self, sink_class):
+        status, response = self.upload(
+            self.data, extra={'checksum_algorithms': 'sha256'},
+            sink_class=sink_class)
+        self.assertEqual(status, 200, response)
+        original_id = response['upload_id']
+        self.complete(original_id)
+        upload_id = self.declare()
+
+        status, response = self.complete(
+            upload_id, extra={'sha256': hashlib.sha256(self.data).hexdigest()})
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(original_id), self.data)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_azure_block_blob(self):
+        self.check_linked('chunked_upload.sinks.azure.AzureBlockBlobSink')
+
+    def test_s3(self):
+        self.check_linked('chunked_upload.sinks.s3.S3MultipartSink')
@@ -0,0 +1,143 @@
+import contextlib
+import io
+import os
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from chunked_upload import azure, s3
+from chunked_upload.azure_fake import FakeContainerClient
+from chunked_upload.constants import COMPLETE
+from chunked_upload.models import ChunkedUpload
+from chunked_upload.settings import S3_BUCKET
+
+from .utils import UploadTestCase, md5
+
+
+class DeleteTests(UploadTestCase):
+
+    data = os.urandom(3000)
+
+    def send(self, sink_class=None, complete=True, **extra):
+        status, response = self.upload(
+            self.data, sink_class=sink_class or self.sink_class, extra=extra)
+        self.assertEqual(status, 200, response)
+        upload_id = response['upload_id']
+        if complete:
+            self.assertEqual(self.complete(upload_id, md5(self.data))[0], 200)
+        return self.get_upload(upload_id)
+
+    def create_uploads(self, sink_class, count):
+        """
+        Create `count` complete uploads with empty files, without going
+        through the views.
+        """
+        ChunkedUpload.objects.bulk_create([
+            ChunkedUpload(file='uploads/%d.bin' % i, status=COMPLETE,
+                          sink_class_path=sink_class)
+            for i in range(count)])
+        return ['uploads/%d.bin' % i for i in range(count)]
+
+    def test_data_deleted(self):
+        local = self.send()
+        path = local.get_sink().local_path()
+        append_blob = self.send(
+            'chunked_upload.sinks.azure.AzureAppendBlobSink', complete=False)
+        block_blob = self.send('chunked_upload.sinks.azure.AzureBlockBlobSink')
+        multipart = self.send('chunked_upload.sinks.s3.S3MultipartSink',
+                              complete=False)
+
+        ChunkedUpload.objects.all().delete()
+
+        self.assertFalse(os.path.exists(path))
+        for upload in (append_blob, block_blob):
+            self.assertFalse(azure.get_blob_client(upload.file.name).exists())
+        response = s3.get_client().list_multipart_uploads(Bucket=S3_BUCKET)
+        self.assertFalse(response.get('Uploads'))
+
+    def test_data_kept_without_delete_files(self):
+        path = self.send().get_sink().local_path()
+
+        ChunkedUpload.objects.all().delete(delete_files=False)
+
+        self.assertTrue(os.path.exists(path))
+
+    def test_shared_files_kept(self):
+        algorithms = {'checksum_algorithms': 'md5,sha256'}
+        original = self.send(**algorithms)
+        path = original.get_sink().local_path()
+        status, response = self.upload(self.data, extra=algorithms)
+        upload_id = response['upload_id']
+        self.complete(upload_id, md5(self.data), deduplicate=True)
+
+        ChunkedUpload.objects.filter(pk=original.pk).delete()
+
+        self.assertEqual(self.read(upload_id), self.data)
+        # Deleted along with the last upload using it
+        ChunkedUpload.objects.all().delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_blobs_deleted_in_batches(self):
+        names = self.create_uploads(
+            'chunked_upload.sinks.azure.AzureAppendBlobSink', 300)
+        # Blobs already gone are ignored
+        for name in names[1:]:
+            azure.get_blob_client(name).create_append_blob()
+
+        with mock.patch.object(FakeContainerClient, 'delete_blobs',
+                               autospec=True,
+                               side_effect=FakeContainerClient.delete_blobs) \
+                as delete_blobs:
+            ChunkedUpload.objects.all().delete()
+
+        self.assertEqual([len(call[0]) - 1 for call in
+                          delete_blobs.call_args_list], [256, 44])
+        for name in names:
+            self.assertFalse(azure.get_blob_client(name).exists())
+
+    def test_objects_deleted_in_batches(self):
+        names = self.create_uploads(
+            'chunked_upload.sinks.s3.S3MultipartSink', 1001)
+        client = s3.get_client()
+        for name in names:
+            client.put_object(Bucket=S3_BUCKET, Key=name, Body=b'x')
+
+        with mock.patch.object(client, 'delete_objects',
+                               wraps=client.delete_objects) as delete_objects:
+            ChunkedUpload.objects.all().delete()
+
+        self.assertEqual([len(call[1]['Delete']['Objects']) for call in
+                          delete_objects.call_args_list], [1000, 1])
+        response = client.list_objects_v2(Bucket=S3_BUCKET)
+        self.assertEqual(response['KeyCount'], 0)
+
+
+class DeleteExpiredUploadsTests(UploadTestCase):
+
+    data = os.urandom(3000)
+
+    def test_expired_deleted(self):
+        upload_ids = [self.upload_all(self.data, 3000) for i in range(3)]
+        self.assertEqual(self.complete(upload_ids[0], md5(self.data))[0], 200)
+        recent_id = self.upload_all(self.data, 3000)
+        ChunkedUpload.objects.exclude(upload_id=recent_id).update(
+            created_on=timezone.now() - timedelta(days=2))
+        paths = [self.get_upload(upload_id).get_sink().local_path()
+                 for upload_id in upload_ids]
+
+        output = io.StringIO()
+        with mock.patch('chunked_upload.management.commands.'
+                        'delete_expired_uploads.Command.batch_size', 2), \
+                contextlib.redirect_stdout(output):
+            call_command('delete_expired_uploads')
+
+        self.assertEqual(output.getvalue(),
+                         '1 complete uploads were deleted.\n'
+                         '2 incomplete uploads were deleted.\n')
+        self.assertEqual(list(ChunkedUpload.objects.values_list(
+            'upload_id', flat=True)), [recent_id])
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.read(recent_id), self.data)
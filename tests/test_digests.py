@@ -0,0 +1,160 @@
+import base64
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from chunked_upload.views import ChunkedUploadManifestView
+
+from .utils import UploadTestCase, md5
+
+
+def b64(digest):
+    return base64.b64encode(digest).decode()
+
+
+class ChunkDigestTests(UploadTestCase):
+
+    data = os.urandom(3000)
+
+    def send_first(self):
+        status, response = self.upload(self.data[:1000], 0, len(self.data))
+        self.assertEqual(status, 200, response)
+        return response['upload_id']
+
+    def send_second(self, upload_id, headers):
+        return self.upload(self.data[1000:2000], 1000, len(self.data),
+                           upload_id, headers=headers)
+
+    def test_matching_headers_accepted(self):
+        chunk = self.data[1000:2000]
+        for headers in (
+                {'HTTP_CONTENT_MD5': b64(hashlib.md5(chunk).digest())},
+                {'HTTP_DIGEST': 'sha-256=%s' % b64(
+                    hashlib.sha256(chunk).digest())},
+                {'HTTP_REPR_DIGEST': 'sha-256=:%s:, md5=:%s:' % (
+                    b64(hashlib.sha256(chunk).digest()),
+                    b64(hashlib.md5(chunk).digest()))}):
+            upload_id = self.send_first()
+
+            status, response = self.send_second(upload_id, headers)
+
+            self.assertEqual(status, 200, (headers, response))
+            self.assertEqual(response['offset'], 2000)
+
+    def test_mismatching_chunks_dropped(self):
+        wrong_md5 = b64(hashlib.md5(b'other').digest())
+        wrong_sha256 = b64(hashlib.sha256(b'other').digest())
+        for headers in ({'HTTP_CONTENT_MD5': wrong_md5},
+                        {'HTTP_DIGEST': 'sha-256=%s' % wrong_sha256},
+                        {'HTTP_REPR_DIGEST': 'sha-256=:%s:' % wrong_sha256}):
+            upload_id = self.send_first()
+
+            status, response = self.send_second(upload_id, headers)
+
+            self.assertEqual(status, 400, (headers, response))
+            self.assertEqual(response['offset'], 1000)
+            upload = self.get_upload(upload_id)
+            self.assertEqual(upload.offset, 1000)
+            # Truncated back to the data stored before the chunk
+            self.assertEqual(os.path.getsize(upload.get_sink().local_path()),
+                             1000)
+            # The client sends the chunk again
+            status, response = self.send_second(upload_id, {})
+            self.assertEqual(status, 200, response)
+            status, response = self.upload(self.data[2000:], 2000,
+                                           len(self.data), upload_id)
+            self.assertEqual(status, 200, response)
+            status, response = self.complete(upload_id, md5(self.data))
+            self.assertEqual(status, 200, response)
+
+    def test_malformed_headers_rejected(self):
+        for headers in ({'HTTP_CONTENT_MD5': 'not base64'},
+                        {'HTTP_DIGEST': 'sha-256'}):
+            upload_id = self.send_first()
+
+            status, response = self.send_second(upload_id, headers)
+
+            self.assertEqual(status, 400, (headers, response))
+            self.assertEqual(self.get_upload(upload_id).offset, 1000)
+
+
+class TreeHashTests(UploadTestCase):
+
+    leaf_size = settings.CHUNKED_UPLOAD_TREE_HASH_LEAF_SIZE
+    data = os.urandom(5000)
+    algorithms = {'checksum_algorithms': 'sha256_tree'}
+
+    def tree_hash(self, data):
+        level = [hashlib.sha256(data[i:i + self.leaf_size]).digest()
+                 for i in range(0, len(data), self.leaf_size)]
+        while len(level) > 1:
+            pairs = [level[i:i + 2] for i in range(0, len(level), 2)]
+            level = [hashlib.sha256(b''.join(pair)).digest()
+                     if len(pair) == 2 else pair[0] for pair in pairs]
+        return level[0].hex()
+
+    def send(self):
+        upload_id = None
+        for start in range(0, len(self.data), 1500):
+            status, response = self.upload(
+                self.data[start:start + 1500], start, len(self.data),
+                upload_id, extra=self.algorithms)
+            self.assertEqual(status, 200, response)
+            upload_id = response['upload_id']
+        return upload_id
+
+    def get_manifest(self, upload_id):
+        request = self.factory.get('/', {'upload_id': upload_id})
+        response = ChunkedUploadManifestView.as_view()(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_root_checked_on_completion(self):
+        upload_id = self.send()
+
+        status, response = self.complete(upload_id, extra={
+            'sha256_tree': self.tree_hash(self.data[:-1] + b'x')})
+        self.assertEqual(status, 400, response)
+        status, response = self.complete(upload_id, extra={
+            'sha256_tree': self.tree_hash(self.data)})
+
+        self.assertEqual(status, 200, response)
+
+    def test_manifest(self):
+        upload_id = self.send()
+
+        status, response = self.get_manifest(upload_id)
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(response['offset'], len(self.data))
+        self.assertEqual(response['leaf_size'], self.leaf_size)
+        leaves = response['leaves']['sha256_tree']
+        self.assertTrue(leaves)
+        for index, (size, checksum) in leaves.items():
+            # Leaves spanning two chunks are recorded up to the end of the
+            # first one
+            start = int(index) * self.leaf_size
+            self.assertLessEqual(size, self.leaf_size)
+            self.assertEqual(checksum, hashlib.sha256(
+                self.data[start:start + size]).hexdigest())
+        self.assertEqual(leaves['3'][0], self.leaf_size)
+
+    def test_manifest_needs_the_upload_id(self):
+        status, response = self.get_manifest('')
+
+        self.assertEqual(status, 400, response)
+
+    def test_stored_leaves_checked(self):
+        upload_id = self.send()
+        upload = self.get_upload(upload_id)
+        self.assertEqual(upload.check_tree_leaves('sha256_tree'), [])
+
+        data = bytearray(self.data)
+        data[3 * self.leaf_size + 100] ^= 1
+        with open(upload.get_sink().local_path(), 'r+b') as file_obj:
+            file_obj.write(data)
+
+        self.assertEqual(upload.check_tree_leaves('sha256_tree'), [3])
+        # Leaf 2 spans two chunks: only recorded in part
+        self.assertEqual(upload.check_tree_leaves('sha256_tree', [2, 3]), [3])
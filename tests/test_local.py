@@ -0,0 +1,63 @@
+import os
+from unittest import mock
+
+import crc32c
+
+from chunked_upload.models import ChunkedUpload
+
+from .utils import UploadTestCase, md5
+
+
+class PreallocatedFileSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.local.PreallocatedFileSink'
+
+    def get_path(self, upload_id):
+        return self.get_upload(upload_id).get_sink().local_path()
+
+    def test_chunks_out_of_order(self):
+        data = os.urandom(3000)
+        status, response = self.upload(data[2000:], 2000, len(data))
+        upload_id = response['upload_id']
+        self.assertEqual(response['offset'], 0)
+        self.upload(data[:1000], 0, len(data), upload_id)
+        status, response = self.upload(data[1000:2000], 1000, len(data),
+                                       upload_id)
+        self.assertEqual(response['offset'], len(data))
+
+        status, response = self.complete(upload_id, md5(data))
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), data)
+
+    def test_crc32c_of_chunks_out_of_order(self):
+        data = os.urandom(3000)
+        extra = {'checksum_algorithms': 'crc32c'}
+        status, response = self.upload(data[2000:], 2000, len(data),
+                                       extra=extra)
+        upload_id = response['upload_id']
+        self.upload(data[:1000], 0, len(data), upload_id)
+        self.upload(data[1000:2000], 1000, len(data), upload_id)
+
+        # Combined from the CRCs of the chunks
+        with mock.patch.object(ChunkedUpload, '_hash_stored_data',
+                               autospec=True) as hash_stored_data:
+            status, response = self.complete(upload_id, extra={
+                'crc32c': '%08x' % crc32c.crc32c(data)})
+
+        self.assertEqual(status, 200, response)
+        hash_stored_data.assert_not_called()
+
+    def test_preallocated(self):
+        status, response = self.upload(b'x' * 10, 0, 5000)
+
+        self.assertEqual(os.path.getsize(self.get_path(response['upload_id'])),
+                         5000)
+
+    @mock.patch('chunked_upload.sinks.local.PREALLOCATE_MAX_SIZE', 1000)
+    def test_larger_files_not_preallocated(self):
+        status, response = self.upload(b'x' * 10, 0, 10 ** 12)
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(os.path.getsize(self.get_path(response['upload_id'])),
+                         10)
@@ -0,0 +1,93 @@
+import os
+from unittest import mock
+
+from chunked_upload.sinks.memory import _lock, _spill
+
+from .utils import UploadTestCase, md5
+
+
+class MemorySinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.memory.MemorySink'
+    data = os.urandom(10000)
+
+    def get_sink(self, upload_id):
+        return self.get_upload(upload_id).get_sink()
+
+    def assertInMemory(self, upload_id):
+        sink = self.get_sink(upload_id)
+        self.assertTrue(os.path.exists(sink.memory_path))
+        self.assertFalse(os.path.exists(sink.spill_path))
+
+    def assertSpilled(self, upload_id):
+        sink = self.get_sink(upload_id)
+        self.assertFalse(os.path.exists(sink.memory_path))
+        self.assertTrue(os.path.exists(sink.spill_path))
+
+    def test_upload(self):
+        upload_id = self.upload_all(self.data, 3000)
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertInMemory(upload_id)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_deleted(self):
+        upload_id = self.upload_all(self.data, 3000)
+        sink = self.get_sink(upload_id)
+
+        self.get_upload(upload_id).delete()
+
+        self.assertFalse(os.path.exists(sink.memory_path))
+        self.assertFalse(os.path.exists(sink.spill_path))
+
+    @mock.patch('chunked_upload.sinks.memory.MEMORY_MAX_SIZE', 12000)
+    def test_least_recently_written_spilled(self):
+        first_id = self.upload_all(self.data, 5000)
+
+        second_id = self.upload_all(self.data, 5000)
+
+        self.assertSpilled(first_id)
+        self.assertInMemory(second_id)
+        self.assertEqual(self.read(first_id), self.data)
+        self.assertEqual(self.read(second_id), self.data)
+
+    @mock.patch('chunked_upload.sinks.memory.MEMORY_MAX_SIZE', 12000)
+    def test_spilled_while_written(self):
+        status, response = self.upload(self.data[:5000], 0, len(self.data))
+        first_id = response['upload_id']
+        self.upload_all(self.data, 5000)
+        self.assertSpilled(first_id)
+
+        # The following chunks go to disk
+        status, response = self.upload(self.data[5000:], 5000,
+                                       len(self.data), first_id)
+
+        self.assertEqual(status, 200, response)
+        self.assertSpilled(first_id)
+        status, response = self.complete(first_id, md5(self.data))
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(first_id), self.data)
+
+    @mock.patch('chunked_upload.sinks.memory.MEMORY_MAX_SIZE', 5000)
+    def test_larger_than_memory(self):
+        upload_id = self.upload_all(self.data, 10000)
+
+        self.assertSpilled(upload_id)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    def test_not_spilled_while_written(self):
+        upload_id = self.upload_all(self.data, 3000)
+        sink = self.get_sink(upload_id)
+
+        fd = _lock(sink.memory_path, create=False)
+        try:
+            self.assertFalse(_spill(sink.memory_path, sink.spill_path))
+        finally:
+            os.close(fd)
+
+        self.assertInMemory(upload_id)
+        self.assertTrue(_spill(sink.memory_path, sink.spill_path))
+        self.assertSpilled(upload_id)
+        self.assertEqual(self.read(upload_id), self.data)
@@ -0,0 +1,137 @@
+import errno
+import os
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, InMemoryStorage
+
+from chunked_upload import azure, s3
+from chunked_upload.azure_fake import FakeBlobClient
+from chunked_upload.settings import S3_BUCKET
+
+from .utils import UploadTestCase, md5
+
+
+class AzureStorage(object):
+    """
+    The attributes of a django-storages `AzureStorage` looked at by the
+    sinks.
+    """
+
+    account_name = settings.AZURE_ACCOUNT_NAME
+    azure_container = settings.AZURE_MEDIA_CONTAINER
+    location = 'moved'
+
+    def get_available_name(self, name):
+        return name
+
+
+class S3Storage(object):
+    """
+    The attributes of a django-storages `S3Storage` looked at by the sinks.
+    """
+
+    bucket_name = S3_BUCKET
+    endpoint_url = None
+    location = 'moved'
+
+    def get_available_name(self, name):
+        return name
+
+
+class MoveToTests(UploadTestCase):
+
+    data = os.urandom(3000)
+
+    def setUp(self):
+        super(MoveToTests, self).setUp()
+        self.storage = FileSystemStorage(
+            location=tempfile.mkdtemp(dir=settings.TEMP_DIR))
+
+    def send(self, sink_class=None, **extra):
+        status, response = self.upload(
+            self.data, sink_class=sink_class or self.sink_class, extra=extra)
+        self.assertEqual(status, 200, response)
+        upload_id = response['upload_id']
+        self.assertEqual(self.complete(upload_id, md5(self.data))[0], 200)
+        return self.get_upload(upload_id)
+
+    def test_hard_linked(self):
+        upload = self.send()
+        path = upload.get_sink().local_path()
+        inode = os.stat(path).st_ino
+
+        name = upload.move_to('moved/file.bin', self.storage)
+
+        self.assertEqual(os.stat(self.storage.path(name)).st_ino, inode)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(self.get_upload(upload.upload_id).file)
+        with self.storage.open(name) as file_obj:
+            self.assertEqual(file_obj.read(), self.data)
+
+    def test_copied_across_filesystems(self):
+        upload = self.send()
+
+        with mock.patch('chunked_upload.sinks.local.os.link',
+                        side_effect=OSError(errno.EXDEV, 'Cross-device')):
+            name = upload.move_to('file.bin', self.storage)
+
+        with self.storage.open(name) as file_obj:
+            self.assertEqual(file_obj.read(), self.data)
+
+    def test_streamed_to_other_storages(self):
+        storage = InMemoryStorage()
+        for sink_class in ('chunked_upload.sinks.local.LocalFileSink',
+                           'chunked_upload.sinks.azure.AzureBlockBlobSink'):
+            upload = self.send(sink_class)
+
+            name = upload.move_to('file.bin', storage)
+
+            with storage.open(name) as file_obj:
+                self.assertEqual(file_obj.read(), self.data)
+            self.assertFalse(self.get_upload(upload.upload_id).file)
+
+    def test_copied_by_azure(self):
+        upload = self.send('chunked_upload.sinks.azure.AzureBlockBlobSink')
+
+        with mock.patch.object(FakeBlobClient, 'download_blob',
+                               autospec=True) as download_blob:
+            name = upload.move_to('file.bin', AzureStorage())
+
+        download_blob.assert_not_called()
+        self.assertEqual(name, 'file.bin')
+        self.assertEqual(azure.get_blob_client('moved/file.bin').download_blob(
+        ).readall(), self.data)
+
+    def test_copied_by_s3(self):
+        upload = self.send('chunked_upload.sinks.s3.S3MultipartSink')
+        key = upload.get_sink().name
+
+        name = upload.move_to('file.bin', S3Storage())
+
+        self.assertEqual(name, 'file.bin')
+        response = s3.get_client().get_object(
+            Bucket=S3Storage.bucket_name, Key='moved/file.bin')
+        self.assertEqual(response['Body'].read(), self.data)
+        response = s3.get_client().list_objects_v2(
+            Bucket=S3Storage.bucket_name, Prefix=key)
+        self.assertEqual(response['KeyCount'], 0)
+
+    def test_shared_file_kept(self):
+        algorithms = {'checksum_algorithms': 'md5,sha256'}
+        original = self.send(**algorithms)
+        status, response = self.upload(self.data, extra=algorithms)
+        upload_id = response['upload_id']
+        self.complete(upload_id, md5(self.data), deduplicate=True)
+        self.assertEqual(self.get_upload(upload_id).file.name,
+                         original.file.name)
+
+        name = original.move_to('file.bin', self.storage)
+
+        with self.storage.open(name) as file_obj:
+            self.assertEqual(file_obj.read(), self.data)
+        # Still used by the deduplicated upload
+        self.assertTrue(self.get_upload(original.upload_id).file)
+        self.assertEqual(self.read(upload_id), self.data)
+        self.assertEqual(self.read(original.upload_id), self.data)
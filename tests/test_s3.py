@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from moto.s3.exceptions import NoSuchUpload
+from moto.s3.models import S3Backend
+
+from chunked_upload.sinks.s3 import MIN_PART_SIZE
+
+from .utils import UploadTestCase, md5
+
+
+_upload_part = S3Backend.upload_part
+
+
+def upload_part(self, bucket_name, multipart_id, part_id, value):
+    # Like S3 (moto raises a KeyError) for completed multipart uploads
+    if multipart_id not in self.get_bucket(bucket_name).multiparts:
+        raise NoSuchUpload(multipart_id)
+    return _upload_part(self, bucket_name, multipart_id, part_id, value)
+
+
+class S3MultipartSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.s3.S3MultipartSink'
+    data = os.urandom(2 * MIN_PART_SIZE + 1000)
+
+    def send(self, start, upload_id=None, data=None):
+        if data is None:
+            data = self.data
+        status, response = self.upload(
+            data[start:start + MIN_PART_SIZE], start, len(data), upload_id)
+        self.assertEqual(status, 200, response)
+        return response
+
+    def send_from_thread(self, start, upload_id):
+        try:
+            return self.send(start, upload_id)
+        finally:
+            connection.close()
+
+    def test_parallel_chunks(self):
+        upload_id = self.send(0)['upload_id']
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(self.send_from_thread,
+                              [2 * MIN_PART_SIZE, MIN_PART_SIZE],
+                              [upload_id] * 2))
+
+        upload = self.get_upload(upload_id)
+        self.assertEqual(upload.offset, len(self.data))
+        self.assertEqual(len(upload.parts), 3)
+        status, response = self.complete(upload_id, md5(self.data))
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    @mock.patch.object(S3Backend, 'upload_part', upload_part)
+    def test_chunk_sent_again_after_checksum_mismatch(self):
+        corrupted = bytearray(self.data)
+        corrupted[MIN_PART_SIZE] ^= 1
+        upload_id = self.send(0)['upload_id']
+        self.send(MIN_PART_SIZE, upload_id, bytes(corrupted))
+        self.send(2 * MIN_PART_SIZE, upload_id)
+        status, response = self.complete(upload_id, md5(self.data))
+        self.assertEqual(status, 400, response)
+
+        # The multipart upload was completed: reopened from the object
+        self.send(MIN_PART_SIZE, upload_id)
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read(upload_id), self.data)
+
+    @override_settings(FILE_UPLOAD_HANDLERS=[
+        'django.core.files.uploadhandler.MemoryFileUploadHandler',
+        'chunked_upload.handlers.MD5TemporaryFileUploadHandler',
+    ])
+    def test_md5_computed_while_received(self):
+        data = self.data[:MIN_PART_SIZE]
+        with mock.patch('chunked_upload.sinks.s3.hashlib') as hashlib:
+            upload_id = self.send(0, data=data)['upload_id']
+
+        hashlib.md5.assert_not_called()
+        self.assertEqual(self.complete(upload_id, md5(data))[0], 200)
+        self.assertEqual(self.read(upload_id), data)
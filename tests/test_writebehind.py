@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from unittest import TestCase, mock
+
+from django.core.exceptions import ImproperlyConfigured
+
+from chunked_upload.sinks import writebehind
+from chunked_upload.sinks.azure import AzureAppendBlobSink
+from chunked_upload.sinks.writebehind import FlushWorker
+
+from .utils import UploadTestCase, md5
+
+
+@mock.patch('chunked_upload.sinks.writebehind.WRITE_BEHIND_SINK_CLASS',
+            'chunked_upload.sinks.azure.AzureAppendBlobSink')
+class WriteBehindSinkTests(UploadTestCase):
+
+    sink_class = 'chunked_upload.sinks.writebehind.WriteBehindSink'
+    data = os.urandom(10000)
+
+    def get_sink(self, upload_id):
+        return self.get_upload(upload_id).get_sink()
+
+    def read_flushed(self, upload_id):
+        return b''.join(self.get_sink(upload_id).sink.chunks())
+
+    @mock.patch.object(writebehind.worker, 'schedule')
+    def test_spooled_then_flushed_on_completion(self, schedule):
+        upload_id = self.upload_all(self.data, 3000)
+        sink = self.get_sink(upload_id)
+        self.assertEqual(self.get_upload(upload_id).offset, len(self.data))
+        self.assertTrue(os.path.exists(sink.spool_path))
+        self.assertEqual(sink.sink.size(), 0)
+        # Read from the spool meanwhile
+        self.assertEqual(self.read(upload_id), self.data)
+
+        status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertFalse(os.path.exists(sink.spool_path))
+        self.assertFalse(os.path.exists(sink.lock_path))
+        self.assertEqual(self.read_flushed(upload_id), self.data)
+
+    def test_flushed_in_the_background(self):
+        upload_id = self.upload_all(self.data, 3000)
+        sink = self.get_sink(upload_id)
+
+        deadline = time.time() + 10
+        while sink.sink.size() < len(self.data) and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.read_flushed(upload_id), self.data)
+        status, response = self.complete(upload_id, md5(self.data))
+        self.assertEqual(status, 200, response)
+
+    @mock.patch.object(writebehind.worker, 'schedule')
+    def test_flushed_from_the_recorded_offset(self, schedule):
+        upload_id = self.upload_all(self.data, 3000)
+        sink = self.get_sink(upload_id)
+
+        # Not from the size of the sink, which may not follow the data
+        with mock.patch.object(AzureAppendBlobSink, 'size', return_value=0):
+            sink._flush(sink.sink, 3000)
+            sink._flush(sink.sink, 6000)
+            status, response = self.complete(upload_id, md5(self.data))
+
+        self.assertEqual(status, 200, response)
+        self.assertEqual(self.read_flushed(upload_id), self.data)
+
+    def test_sinks_writing_at_any_offset_refused(self):
+        with mock.patch(
+                'chunked_upload.sinks.writebehind.WRITE_BEHIND_SINK_CLASS',
+                'chunked_upload.sinks.local.PreallocatedFileSink'):
+            with self.assertRaises(ImproperlyConfigured):
+                self.upload(self.data)
+
+    @mock.patch.object(writebehind.worker, 'schedule')
+    def test_spooled_on_another_host(self, schedule):
+        status, response = self.upload(self.data[:3000], 0, len(self.data))
+        upload_id = response['upload_id']
+        self.get_sink(upload_id)._remove_spool()
+
+        status, response = self.upload(self.data[3000:6000], 3000,
+                                       len(self.data), upload_id)
+
+        self.assertEqual(status, 503, response)
+        status, response = self.complete(upload_id)
+        self.assertEqual(status, 503, response)
+
+
+class FlushWorkerTests(TestCase):
+
+    def test_queued_flush_replaced(self):
+        worker = FlushWorker(1)
+        started, release, done = (threading.Event(), threading.Event(),
+                                  threading.Event())
+        calls = []
+
+        def block():
+            started.set()
+            release.wait(10)
+
+        worker.schedule('a', block)
+        started.wait(10)
+        worker.schedule('b', lambda: calls.append(1))
+        worker.schedule('b', lambda: calls.append(2))
+        worker.schedule('c', done.set)
+        release.set()
+
+        self.assertTrue(done.wait(10))
+        self.assertEqual(calls, [2])
+
+    def test_cancelled(self):
+        worker = FlushWorker(1)
+        started, release, done = (threading.Event(), threading.Event(),
+                                  threading.Event())
+        calls = []
+
+        def block():
+            started.set()
+            release.wait(10)
+
+        worker.schedule('a', block)
+        started.wait(10)
+        worker.schedule('b', lambda: calls.append(1))
+        worker.cancel('b')
+        worker.schedule('c', done.set)
+        release.set()
+
+        self.assertTrue(done.wait(10))
+        self.assertEqual(calls, [])
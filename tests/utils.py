@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TransactionTestCase
+from moto import mock_aws
+
+from chunked_upload import s3
+from chunked_upload.azure_fake import FakeBlobServiceClient
+from chunked_upload.models import ChunkedUpload
+from chunked_upload.settings import S3_BUCKET
+from chunked_upload.views import ChunkedUploadCompleteView, ChunkedUploadView
+
+
+class UploadTestCase(TransactionTestCase):
+    """
+    Sends chunks to the views, writing them to `sink_class`. Azure is
+    replaced by `chunked_upload.azure_fake`, and S3 by moto. Transactions
+    are really committed, so chunks can be sent from several threads.
+    """
+
+    sink_class = 'chunked_upload.sinks.local.LocalFileSink'
+    upload_view_class = ChunkedUploadView
+    complete_view_class = ChunkedUploadCompleteView
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        FakeBlobServiceClient.reset()
+        self.aws = mock_aws()
+        self.aws.start()
+        # Created again within the mocks of moto
+        s3._clients.clear()
+        s3.get_client().create_bucket(Bucket=S3_BUCKET)
+
+    def tearDown(self):
+        ChunkedUpload.objects.all().delete()
+        self.aws.stop()
+
+    def call(self, view, data, **headers):
+        request = self.factory.post('/', data, **headers)
+        response = view(request)
+        return response.status_code, json.loads(response.content)
+
+    def upload(self, data, start=0, total=None, upload_id=None, extra=None,
+               headers=None, **view_attrs):
+        if total is None:
+            total = start + len(data)
+        fields = {'file': SimpleUploadedFile('file.bin', data)}
+        if upload_id:
+            fields['upload_id'] = upload_id
+        fields.update(extra or {})
+        view_attrs.setdefault('sink_class', self.sink_class)
+        return self.call(
+            self.upload_view_class.as_view(**view_attrs), fields,
+            HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (
+                start, start + len(data) - 1, total), **(headers or {}))
+
+    def upload_all(self, data, chunk_size, **view_attrs):
+        """
+        Send `data` in order, in chunks of `chunk_size` bytes. Returns the
+        upload id.
+        """
+        upload_id = None
+        for start in range(0, len(data), chunk_size):
+            status, response = self.upload(
+                data[start:start + chunk_size], start, len(data), upload_id,
+                **view_attrs)
+            self.assertEqual(status, 200, response)
+            upload_id = response['upload_id']
+        return upload_id
+
+    def complete(self, upload_id, md5=None, extra=None, **view_attrs):
+        fields = {'upload_id': upload_id}
+        if md5 is not None:
+            fields['md5'] = md5
+        fields.update(extra or {})
+        if len(fields) == 1:
+            view_attrs.setdefault('do_md5_check', False)
+        return self.call(self.complete_view_class.as_view(**view_attrs),
+                         fields)
+
+    def get_upload(self, upload_id):
+        return ChunkedUpload.objects.get(upload_id=upload_id)
+
+    def read(self, upload_id):
+        # Through the sink: the storage of the `file` field is a local one
+        return b''.join(self.get_upload(upload_id).get_sink().chunks())
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()